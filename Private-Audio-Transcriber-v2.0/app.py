@@ -7,31 +7,590 @@
 #----------------------
 
 import os
+import io
 import sys
 import glob
+import math
 import socket
-from flask import Flask, render_template_string, request, jsonify
+from flask import Flask, Request, render_template_string, request, jsonify, Response, g
 import re
 import json     
 import tempfile
 import webbrowser
+import time
+import uuid
+import queue
+import bisect
+import heapq
+import hashlib
+import subprocess
+from collections import OrderedDict, deque
+import gc
+import threading
+import itertools
+import contextvars
+import multiprocessing
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
 from threading import Timer
-import mlx_whisper
-from mlx_lm import load, generate
-from mlx_lm.sample_utils import make_sampler
+import numpy as np
+from engines import create_engine, SAMPLE_RATE
+
+try:
+    from cryptography.fernet import Fernet, InvalidToken  # Optional: only for encrypted caches
+except ImportError:
+    Fernet = None
+    InvalidToken = ValueError
+
+try:
+    import psutil  # Optional: used for free-memory readings when installed
+except ImportError:
+    psutil = None
+
+try:
+    import soundfile  # Optional: FLAC decoding without ffmpeg
+except (ImportError, OSError):   # OSError: the package is installed but libsndfile is missing
+    soundfile = None
 
 os.environ["TRANSFORMERS_OFFLINE"] = "1"
 os.environ["HF_HUB_OFFLINE"] = "1"
 
-# --- MLX Model Loading ---
-print("Loading translation model, please wait...")
-try:
-    model, tokenizer = load("models/tiny-aya-global-8bit-mlx")
-    print("Translation model loaded successfully.")
-except Exception as e:
-    print(f"FATAL: Could not load the translation model. Error: {e}")
-    print("Please ensure the 'models/tiny-aya-global-8bit-mlx' directory exists and is correct.")
-    sys.exit(1)
+# --- Inference Scheduler ---
+# Flask serves each request on its own thread, so without coordination two
+# requests would run Whisper (or the translation model) at the same time and
+# fight over the accelerator and memory. Every inference takes a turn on its
+# model's lane instead: one runs at a time and the rest wait in arrival
+# order. The Whisper and translation lanes run side by side only while free
+# memory is above SCHEDULER_CONCURRENT_MIN_FREE_MB; below it they take turns
+# with each other too.
+#
+# Each inference has a priority class, and a lane serves its waiting queue
+# by class first and arrival order second: live dictation, then interactive
+# requests (single files, translation), then batch uploads. A long batch job
+# takes one turn per Whisper window rather than one for the whole file, so
+# live and interactive work gets in between its windows. Lane wait and turn
+# latency percentiles per class are in /scheduler/stats.
+#
+# Routes are admitted to their lane before doing any work: when
+# LANE_MAX_PENDING requests are already in progress on it, the request gets
+# a 429 with a Retry-After estimate instead of joining the queue. Time spent
+# waiting for a lane is reported as its own stage ("whisper_wait",
+# "translation_wait"), apart from compute.
+LANE_MAX_PENDING = 8
+SCHEDULER_CONCURRENT_MIN_FREE_MB = 4096   # Set to 0 to always let the lanes run together
+PRIORITY_CLASSES = ("live", "interactive", "batch")   # Highest first
+PRIORITY_LATENCY_WINDOW = 500   # Recent turns per class kept for the latency percentiles
+
+class ServerBusy(Exception):
+    """A queue is full; retry_after is the number of seconds for the Retry-After header."""
+
+    def __init__(self, retry_after):
+        super().__init__(f"Server busy, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+scheduler_changed = threading.Condition()
+lane_tickets = itertools.count()
+lanes = []
+# The class of the work running in this context; set per request and per job
+current_priority = contextvars.ContextVar("current_priority", default="interactive")
+priority_latencies = {name: {"wait": deque(maxlen=PRIORITY_LATENCY_WINDOW),
+                             "latency": deque(maxlen=PRIORITY_LATENCY_WINDOW)}
+                      for name in PRIORITY_CLASSES}
+
+class Lane:
+    """Runs one inference at a time for a model, by priority class and then arrival order."""
+
+    def __init__(self, name, max_pending=LANE_MAX_PENDING):
+        self.name = name
+        self.max_pending = max_pending
+        self.pending = 0          # Admitted requests not yet answered
+        self.waiting = []         # Heap of (priority rank, ticket); the head goes next
+        self.busy = False
+        self.avg_seconds = 5.0    # Running average length of a turn, for Retry-After
+        self.turns = 0
+        self.rejected = 0
+        lanes.append(self)
+
+    def full(self):
+        return max(self.pending, len(self.waiting)) >= self.max_pending
+
+    def admit(self):
+        """Count a request in, or raise ServerBusy if the lane is full. Pair with release()."""
+        with scheduler_changed:
+            if not self.full():
+                self.pending += 1
+                return
+            self.rejected += 1
+            retry_after = max(1, math.ceil(self.pending * self.avg_seconds))
+        lane_rejected.inc(lane=self.name)
+        raise ServerBusy(retry_after)
+
+    def release(self):
+        with scheduler_changed:
+            self.pending -= 1
+
+    def can_start(self, entry):
+        """Whether the head of this lane may start now. Caller holds scheduler_changed."""
+        if self.busy or self.waiting[0] != entry:
+            return False
+        # Another lane running, or with a more urgent head, only matters under memory pressure
+        others = [lane for lane in lanes if lane is not self]
+        if not any(lane.busy or (lane.waiting and lane.waiting[0] < entry) for lane in others):
+            return True
+        free = available_memory_bytes()
+        return free is None or free >= SCHEDULER_CONCURRENT_MIN_FREE_MB * MB
+
+    def should_yield(self, rank):
+        """Whether a long turn at this rank should end early for another lane's waiting head.
+
+        True when that head is at least as urgent and cannot start alongside
+        this lane (memory pressure). Caller holds scheduler_changed.
+        """
+        if not any(lane.waiting and lane.waiting[0][0] <= rank for lane in lanes if lane is not self):
+            return False
+        free = available_memory_bytes()
+        return free is not None and free < SCHEDULER_CONCURRENT_MIN_FREE_MB * MB
+
+    @contextmanager
+    def turn(self):
+        """Wait for this lane, then hold it until the block ends."""
+        priority = current_priority.get()
+        queued_at = time.perf_counter()
+        with scheduler_changed:
+            entry = (PRIORITY_CLASSES.index(priority), next(lane_tickets))
+            heapq.heappush(self.waiting, entry)
+            lane_waiting.inc(lane=self.name)
+            while not self.can_start(entry):
+                scheduler_changed.wait()
+            heapq.heappop(self.waiting)
+            self.busy = True
+        lane_waiting.dec(lane=self.name)
+        started = time.perf_counter()
+        lane_wait_seconds.observe(started - queued_at, lane=self.name, priority=priority)
+        record_stage(f"{self.name}_wait", started - queued_at)
+        try:
+            yield
+        finally:
+            finished = time.perf_counter()
+            with scheduler_changed:
+                self.busy = False
+                self.turns += 1
+                self.avg_seconds = 0.8 * self.avg_seconds + 0.2 * (finished - started)
+                priority_latencies[priority]["wait"].append(started - queued_at)
+                priority_latencies[priority]["latency"].append(finished - queued_at)
+                scheduler_changed.notify_all()
+
+    def status(self):
+        return {
+            "busy": self.busy,
+            "pending": self.pending,
+            "waiting": len(self.waiting),
+            "max_pending": self.max_pending,
+            "avg_turn_seconds": round(self.avg_seconds, 3),
+            "turns": self.turns,
+            "rejected": self.rejected,
+        }
+
+whisper_lane = Lane("whisper")
+translation_lane = Lane("translation")
+
+def latency_percentiles(samples):
+    """p50/p95/p99 of a list of seconds, in milliseconds."""
+    if not samples:
+        return None
+    values = np.percentile(samples, [50, 95, 99]) * 1000
+    return {name: round(float(value), 1) for name, value in zip(("p50_ms", "p95_ms", "p99_ms"), values)}
+
+def scheduler_snapshot():
+    decode_loop_status = decode_loop.status()
+    with scheduler_changed:
+        free = available_memory_bytes()
+        priorities = {
+            name: {
+                "turns": len(samples["latency"]),
+                "wait": latency_percentiles(list(samples["wait"])),
+                "latency": latency_percentiles(list(samples["latency"])),   # Wait plus inference
+            }
+            for name, samples in priority_latencies.items()
+        }
+        return {
+            "lanes": {lane.name: lane.status() for lane in lanes},
+            "lanes_run_together": free is None or free >= SCHEDULER_CONCURRENT_MIN_FREE_MB * MB,
+            "priorities": priorities,
+            "translation_decode_loop": decode_loop_status,
+        }
+
+# --- Inference Engine and Model Loading ---
+# Whisper and the translation model run on the engine named by PAT_ENGINE:
+# "mlx" (Apple Silicon, the default), "cpu" or "fake" (see engines.py).
+# Models are loaded on first use, or in a background thread at startup
+# (MODEL_WARMUP_AT_STARTUP) so the server can answer requests while they load.
+# A warm-up inference compiles the kernels so the first real request is not
+# the one paying for it. /ready reports the state of each model.
+#
+# To share the machine with other software, a model that has been idle for
+# MODEL_IDLE_UNLOAD_SECONDS, or the least recently used one when free memory
+# drops below MODEL_MIN_FREE_MEMORY_MB, is unloaded and reloaded on next use.
+INFERENCE_ENGINE = os.environ.get("PAT_ENGINE", "mlx")
+ENGINE_MODEL_PATHS = {   # (Whisper, translation) for each engine
+    "mlx": ("models/whisper-turbo-mlx", "models/tiny-aya-global-8bit-mlx"),
+    "cpu": ("models/faster-whisper-large-v3-turbo", "models/tiny-aya-global-q8_0.gguf"),
+    "fake": ("fake-whisper", "fake-aya"),
+}
+WHISPER_MODEL_PATH, TRANSLATION_MODEL_PATH = ENGINE_MODEL_PATHS.get(INFERENCE_ENGINE, (None, None))
+MODEL_WARMUP_AT_STARTUP = True
+MODEL_IDLE_UNLOAD_SECONDS = 20 * 60     # Set to 0 to keep idle models loaded
+MODEL_MIN_FREE_MEMORY_MB = 1024         # Set to 0 to ignore memory pressure
+MODEL_PRESSURE_MIN_IDLE_SECONDS = 60    # Never unload a model used more recently than this
+MODEL_RESIDENCY_CHECK_SECONDS = 30
+MEMORY_READING_MAX_AGE_SECONDS = 1      # The scheduler asks often; a reading this recent is reused
+
+MB = 1024 * 1024
+
+memory_reading = {"at": None, "bytes": None}
+
+def available_memory_bytes():
+    """Memory available to new allocations, or None if it cannot be read."""
+    now = time.monotonic()
+    if memory_reading["at"] is None or now - memory_reading["at"] >= MEMORY_READING_MAX_AGE_SECONDS:
+        memory_reading["bytes"] = read_available_memory()
+        memory_reading["at"] = now
+    return memory_reading["bytes"]
+
+def read_available_memory():
+    if psutil is not None:
+        return psutil.virtual_memory().available
+    if sys.platform == "darwin":
+        return macos_available_memory()
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024   # Counts reclaimable page cache, unlike MemFree
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (ValueError, OSError, AttributeError):
+        return None
+
+def macos_available_memory():
+    """Free, inactive and speculative pages as reported by vm_stat (what psutil would count)."""
+    try:
+        output = subprocess.run(["vm_stat"], capture_output=True, text=True, timeout=2, check=True).stdout
+    except (OSError, subprocess.SubprocessError):
+        return None
+    page_size = re.search(r"page size of (\d+) bytes", output)
+    pages = re.findall(r"^Pages (?:free|inactive|speculative):\s+(\d+)", output, re.MULTILINE)
+    if page_size is None or not pages:
+        return None
+    return sum(int(count) for count in pages) * int(page_size.group(1))
+
+class ModelSlot:
+    """A lazily loaded model with its load state, timings and residency."""
+
+    def __init__(self, name, path, lane, loader, warmup=None, unloader=None):
+        self.name = name
+        self.path = path
+        self.lane = lane
+        self.loader = loader
+        self.warmup = warmup
+        self.unloader = unloader
+        self.lock = threading.Lock()
+        self.value = None
+        self.state = "not_loaded"   # -> "loading" -> "warming_up" -> "ready" (-> "unloaded"), or "failed"
+        self.error = None
+        self.load_seconds = None
+        self.warmup_seconds = None
+        self.resident_bytes = 0
+        self.last_used = time.time()
+        self.in_use = 0
+        self.loads = 0
+
+    def get(self):
+        value = self.value
+        self.last_used = time.time()
+        if value is not None:
+            return value
+        with self.lock:
+            if self.value is None:
+                self.load()
+            return self.value
+
+    @contextmanager
+    def use(self):
+        """Take a turn on the model's lane and hold the model for a whole inference."""
+        with self.lane.turn():
+            with self.lock:
+                if self.value is None:
+                    self.load()
+                self.in_use += 1
+                value = self.value
+            try:
+                yield value
+            finally:
+                with self.lock:
+                    self.in_use -= 1
+                    self.last_used = time.time()
+
+    def load(self):
+        """Load and warm up the model. Caller holds self.lock."""
+        self.state = "loading"
+        print(f"Loading {self.name} model, please wait...")
+        started = time.time()
+        try:
+            value = self.loader()
+        except Exception as e:
+            self.state = "failed"
+            self.error = str(e)
+            print(f"ERROR: Could not load the {self.name} model. Error: {e}")
+            print(f"Please ensure the '{self.path}' directory exists and is correct.")
+            raise
+        self.load_seconds = round(time.time() - started, 2)
+        self.resident_bytes = engine.resident_bytes(value[0] if isinstance(value, tuple) else value)
+        self.loads += 1
+        # Usable from here on; the warm-up itself goes through get()
+        self.value = value
+        if self.warmup is not None:
+            self.state = "warming_up"
+            started = time.time()
+            try:
+                self.warmup(value)
+                self.warmup_seconds = round(time.time() - started, 2)
+            except Exception as e:
+                print(f"Warning: {self.name} model warm-up failed: {e}")
+        self.state = "ready"
+        self.error = None
+        self.last_used = time.time()
+        warmup_note = f" (warm-up {self.warmup_seconds}s)" if self.warmup_seconds is not None else ""
+        print(f"{self.name.capitalize()} model loaded in {self.load_seconds}s{warmup_note}, "
+              f"{self.resident_bytes / MB:.0f} MB resident.")
+
+    def unload(self, reason):
+        """Drop the model unless it is loading or in use. Returns True if it was unloaded."""
+        if not self.lock.acquire(blocking=False):
+            return False   # Being loaded right now
+        try:
+            if self.value is None or self.in_use:
+                return False
+            self.value = None
+            if self.unloader is not None:
+                self.unloader()
+            freed = self.resident_bytes
+            self.resident_bytes = 0
+            self.state = "unloaded"
+        finally:
+            self.lock.release()
+        gc.collect()
+        engine.release_memory()
+        free = available_memory_bytes()
+        free_note = f" {free / MB:.0f} MB free." if free is not None else ""
+        print(f"Unloaded {self.name} model ({reason}), releasing ~{freed / MB:.0f} MB.{free_note}")
+        return True
+
+    def idle_seconds(self):
+        return 0 if self.in_use else time.time() - self.last_used
+
+    def status(self):
+        return {
+            "state": self.state,
+            "path": self.path,
+            "load_seconds": self.load_seconds,
+            "warmup_seconds": self.warmup_seconds,
+            "resident_bytes": self.resident_bytes,
+            "idle_seconds": round(self.idle_seconds()) if self.value is not None else None,
+            "loads": self.loads,
+            "error": "Model failed to load" if self.error else None,
+        }
+
+engine = create_engine(INFERENCE_ENGINE, WHISPER_MODEL_PATH, TRANSLATION_MODEL_PATH)
+
+def warm_up_whisper(whisper):
+    engine.transcribe(np.zeros(SAMPLE_RATE, dtype=np.float32))
+
+def warm_up_translation(loaded):
+    if engine.supports_prompt_cache:
+        with prefix_cache_lock:
+            build_prefix_cache()
+    model, tokenizer = loaded
+    engine.generate(model, tokenizer, prompt=tokenizer.encode("Hello"), max_tokens=1)
+
+def unload_translation_model():
+    # The prefilled prompt prefix holds KV arrays of the old model
+    prefix_cache["tokens"] = None
+    prefix_cache["cache"] = None
+
+whisper_model = ModelSlot("transcription", WHISPER_MODEL_PATH, whisper_lane, engine.load_transcriber,
+                          warm_up_whisper, engine.unload_transcriber)
+translation_model = ModelSlot("translation", TRANSLATION_MODEL_PATH, translation_lane, engine.load_translator,
+                              warm_up_translation, unload_translation_model)
+model_slots = (whisper_model, translation_model)
+
+def start_model_warmup():
+    """Load both models one after the other in the background."""
+    def warm_up():
+        for slot in model_slots:
+            try:
+                slot.get()
+            except Exception:
+                pass   # Already logged; /ready shows the failure
+    threading.Thread(target=warm_up, name="model-warmup", daemon=True).start()
+
+def check_model_residency():
+    """Unload idle models, and the least recently used one under memory pressure."""
+    if MODEL_IDLE_UNLOAD_SECONDS:
+        for slot in model_slots:
+            idle = slot.idle_seconds()
+            if slot.value is not None and idle >= MODEL_IDLE_UNLOAD_SECONDS:
+                slot.unload(f"idle for {idle / 60:.0f} min")
+    free = available_memory_bytes()
+    if not MODEL_MIN_FREE_MEMORY_MB or free is None or free >= MODEL_MIN_FREE_MEMORY_MB * MB:
+        return
+    candidates = [slot for slot in model_slots
+                  if slot.value is not None and slot.idle_seconds() >= MODEL_PRESSURE_MIN_IDLE_SECONDS]
+    for slot in sorted(candidates, key=lambda slot: slot.last_used):
+        if slot.unload(f"only {free / MB:.0f} MB free"):
+            return   # One at a time; the next check sees the freed memory
+
+def start_model_residency_monitor():
+    if not MODEL_IDLE_UNLOAD_SECONDS and not MODEL_MIN_FREE_MEMORY_MB:
+        return
+    if MODEL_MIN_FREE_MEMORY_MB and available_memory_bytes() is None:
+        print("Note: free memory cannot be read; models are only unloaded when idle.")
+    def monitor():
+        while True:
+            time.sleep(MODEL_RESIDENCY_CHECK_SECONDS)
+            try:
+                check_model_residency()
+            except Exception as e:
+                print(f"Model residency check failed: {e}")
+    threading.Thread(target=monitor, name="model-residency", daemon=True).start()
+
+def whisper_transcribe(audio, **decode_options):
+    if (WHISPER_BATCH_SIZE > 1 and engine.supports_batch_transcribe
+            and len(audio) <= WHISPER_BATCH_MAX_SECONDS * SAMPLE_RATE):
+        return transcribe_in_batch(audio, decode_options)
+    with whisper_model.use(), stage("whisper_inference"):
+        whisper_audio_seconds.inc(len(audio) / SAMPLE_RATE)
+        return engine.transcribe(audio, **decode_options)
+
+# --- Whisper Micro-Batching ---
+# Whisper pads every clip to a 30 s window, so a 5 s dictation chunk costs
+# nearly as much as a full window. Clips that arrive together from different
+# requests are transcribed in one batch instead: a clip waits up to
+# WHISPER_BATCH_WAIT_MS for others to join, and clips keep joining while
+# the batch waits for the Whisper lane. Only clips with the same decode
+# options (language, prompt) share a batch; an option left as None counts
+# as not given. There is no batching thread:
+# one of the waiting requests collects the batch and runs it for the
+# others, at the priority of its most urgent clip.
+#
+# A batched clip's trace shows "whisper_batch_wait" (collecting plus the
+# lane) instead of "whisper_wait", and the batch's inference time.
+# Dictation chunks after the first carry their session's committed text as
+# initial_prompt, which no other clip shares, so they rarely batch; first
+# chunks, short uploads and windows without a prompt are what fill batches.
+WHISPER_BATCH_SIZE = 8             # Clips per batch; set to 1 to transcribe each request on its own
+WHISPER_BATCH_WAIT_MS = 10         # How long a clip waits for others before its batch starts
+WHISPER_BATCH_MAX_SECONDS = 30     # Longer audio is decoded window by window, on its own
+
+whisper_batch_changed = threading.Condition()
+whisper_batch_pending = []   # Clips waiting for a batch
+whisper_batch_state = {"collecting": False}
+whisper_batch_sequence = itertools.count()
+
+def transcribe_in_batch(audio, decode_options):
+    """Transcribe a short clip in the next batch with the same options, and return its result."""
+    decode_options = {name: value for name, value in decode_options.items() if value is not None}
+    item = {
+        "audio": audio,
+        "options": decode_options,
+        "key": tuple(sorted(decode_options.items())),
+        "order": (PRIORITY_CLASSES.index(current_priority.get()), next(whisper_batch_sequence)),
+        "queued_at": time.perf_counter(),
+        "started_at": None,
+        "finished_at": None,
+        "batch_size": None,
+        "result": None,
+        "error": None,
+        "taken": False,   # In a batch that is running
+        "done": False,
+    }
+    with whisper_batch_changed:
+        whisper_batch_pending.append(item)
+        whisper_batch_changed.notify_all()
+    while True:
+        with whisper_batch_changed:
+            while not item["done"] and (item["taken"] or whisper_batch_state["collecting"]):
+                whisper_batch_changed.wait()
+            if item["done"]:
+                break
+            whisper_batch_state["collecting"] = True
+        run_whisper_batch(item)
+    record_stage("whisper_batch_wait", item["started_at"] - item["queued_at"])
+    record_stage("whisper_inference", item["finished_at"] - item["started_at"])
+    trace_note(whisper_batch=item["batch_size"])
+    if item["error"] is not None:
+        raise item["error"]
+    return item["result"]
+
+def run_whisper_batch(leader):
+    """Collect a batch, take the Whisper lane for it and hand each clip its result.
+
+    Called by a waiting request (the leader) after it set "collecting". If
+    the lane or the model fails before the batch is taken, only the leader's
+    own clip fails and the other clips get a new leader.
+    """
+    deadline = time.perf_counter() + WHISPER_BATCH_WAIT_MS / 1000
+    with whisper_batch_changed:
+        while len(whisper_batch_pending) < WHISPER_BATCH_SIZE:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            whisper_batch_changed.wait(remaining)
+        first = min(whisper_batch_pending, key=lambda item: item["order"])
+    batch = []
+    priority_token = current_priority.set(PRIORITY_CLASSES[first["order"][0]])
+    trace_token = current_trace.set(None)   # Each clip records its own stages
+    try:
+        with whisper_model.use():
+            with whisper_batch_changed:
+                first = min(whisper_batch_pending, key=lambda item: item["order"])
+                batch = sorted((item for item in whisper_batch_pending if item["key"] == first["key"]),
+                               key=lambda item: item["order"])[:WHISPER_BATCH_SIZE]
+                for item in batch:
+                    item["taken"] = True
+                whisper_batch_pending[:] = [item for item in whisper_batch_pending if not item["taken"]]
+                whisper_batch_state["collecting"] = False
+                whisper_batch_changed.notify_all()
+            started = time.perf_counter()
+            try:
+                results = engine.transcribe_batch([item["audio"] for item in batch], **first["options"])
+                error = None
+            except Exception as e:
+                results, error = [None] * len(batch), e
+            finished = time.perf_counter()
+    except Exception as e:
+        with whisper_batch_changed:
+            if not batch:
+                whisper_batch_pending[:] = [item for item in whisper_batch_pending if item is not leader]
+                whisper_batch_state["collecting"] = False
+                batch = [leader]
+            now = time.perf_counter()
+            for item in batch:
+                item.update(done=True, error=e, started_at=now, finished_at=now, audio=None)
+            whisper_batch_changed.notify_all()
+        return
+    finally:
+        current_trace.reset(trace_token)
+        current_priority.reset(priority_token)
+    whisper_audio_seconds.inc(sum(len(item["audio"]) for item in batch) / SAMPLE_RATE)
+    whisper_batch_size.observe(len(batch))
+    with whisper_batch_changed:
+        for item, result in zip(batch, results):
+            item.update(done=True, result=result, error=error, batch_size=len(batch),
+                        started_at=started, finished_at=finished, audio=None)
+        whisper_batch_changed.notify_all()
 
 
 # --- Language Configuration Logic ---
@@ -74,12 +633,19 @@ def load_languages():
                 languages.append(line)
     return sorted(languages) if languages else sorted(DEFAULT_LANGUAGES)
 
+UPLOAD_DIR = os.path.join(os.getcwd(), "temp_user_uploads")
+# Issue #4: Whitelist extensions — never trust the client-supplied filename
+ALLOWED_EXTENSIONS = {'.wav', '.mp3', '.m4a', '.webm', '.ogg', '.flac'}
+# Uploads up to this size are kept in memory and piped straight to the
+# decoder; larger ones are written once, while they arrive, to UPLOAD_DIR
+# (see UploadSpool), where cleanup_orphaned_temp_files() also finds them.
+UPLOAD_SPILL_BYTES = 32 * 1024 * 1024
+
 def cleanup_orphaned_temp_files():
     """Delete any audio files left behind by a previous crashed session."""
-    upload_dir = os.path.join(os.getcwd(), "temp_user_uploads")
-    if not os.path.exists(upload_dir):
+    if not os.path.exists(UPLOAD_DIR):
         return
-    orphans = glob.glob(os.path.join(upload_dir, "*"))
+    orphans = glob.glob(os.path.join(UPLOAD_DIR, "*"))
     for f in orphans:
         try:
             os.remove(f)
@@ -87,29 +653,2134 @@ def cleanup_orphaned_temp_files():
         except Exception as e:
             print(f"Warning: could not remove orphaned temp file {f}: {e}")
 
+# --- Result Cache ---
+# Results are keyed by a hash of their inputs, so a file that is dropped again
+# (e.g. after Reset Form) comes back without re-running the model.
+#   "off"       - no caching
+#   "memory"    - entries live in process memory only and vanish on exit
+#   "disk"      - entries are JSON files under CACHE_DIR and survive restarts
+#   "encrypted" - like "disk", but entries are encrypted with Fernet (needs the
+#                 'cryptography' package) with the Fernet key in PAT_CACHE_KEY.
+#                 Without either, the cache falls back to memory only.
+CACHE_DIR = "cache"
+TRANSCRIPTION_CACHE_MODE = "memory"
+TRANSCRIPTION_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+class ResultCache:
+    """Thread-safe LRU cache of JSON-serializable values with a byte budget."""
+
+    def __init__(self, name, mode, max_bytes):
+        self.name = name
+        self.mode = mode
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()   # key -> stored bytes (memory) or size (disk)
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.fernet = None
+        self.directory = os.path.join(CACHE_DIR, name)
+        if mode == "encrypted":
+            if Fernet is None:
+                print(f"Warning: 'cryptography' is not installed; {name} cache falls back to memory only.")
+                self.mode = "memory"
+            elif not os.environ.get("PAT_CACHE_KEY"):
+                print(f"Warning: PAT_CACHE_KEY is not set; {name} cache falls back to memory only.")
+                self.mode = "memory"
+            else:
+                try:
+                    self.fernet = Fernet(os.environ["PAT_CACHE_KEY"])
+                except ValueError as e:
+                    print(f"Warning: PAT_CACHE_KEY is not a valid Fernet key ({e}); "
+                          f"{name} cache falls back to memory only.")
+                    self.mode = "memory"
+        if self.mode in ("disk", "encrypted"):
+            self.load_index()
+
+    def load_index(self):
+        """Rebuild the LRU order from file modification times."""
+        os.makedirs(self.directory, exist_ok=True)
+        files = glob.glob(os.path.join(self.directory, "*.bin"))
+        for path in sorted(files, key=os.path.getmtime):
+            key = os.path.splitext(os.path.basename(path))[0]
+            size = os.path.getsize(path)
+            self.entries[key] = size
+            self.total_bytes += size
+        with self.lock:
+            self.evict()
+
+    def path_for(self, key):
+        return os.path.join(self.directory, f"{key}.bin")
+
+    def get(self, key):
+        if self.mode == "off":
+            return None
+        with self.lock:
+            if key not in self.entries:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            try:
+                if self.mode == "memory":
+                    data = self.entries[key]
+                else:
+                    with open(self.path_for(key), "rb") as f:
+                        data = f.read()
+                    os.utime(self.path_for(key))
+                    if self.fernet is not None:
+                        data = self.fernet.decrypt(data)
+                value = json.loads(data)
+            except (OSError, InvalidToken, ValueError) as e:   # ValueError: truncated or corrupt JSON
+                print(f"Warning: dropping unreadable {self.name} cache entry: {e}")
+                self.remove(key)
+                self.misses += 1
+                return None
+            self.hits += 1
+        return value
+
+    def put(self, key, value):
+        if self.mode == "off":
+            return
+        data = json.dumps(value).encode("utf-8")
+        if self.fernet is not None:
+            data = self.fernet.encrypt(data)
+        if len(data) > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                self.remove(key)
+            if self.mode == "memory":
+                self.entries[key] = data
+            else:
+                temp_path = self.path_for(key) + ".tmp"
+                with open(temp_path, "wb") as f:
+                    f.write(data)
+                os.replace(temp_path, self.path_for(key))
+                self.entries[key] = len(data)
+            self.total_bytes += len(data)
+            self.evict()
+
+    def entry_size(self, key):
+        entry = self.entries[key]
+        return len(entry) if isinstance(entry, bytes) else entry
+
+    def remove(self, key):
+        """Drop one entry. Caller holds self.lock."""
+        self.total_bytes -= self.entry_size(key)
+        del self.entries[key]
+        if self.mode != "memory" and os.path.exists(self.path_for(key)):
+            os.remove(self.path_for(key))
+
+    def evict(self):
+        """Drop least recently used entries until under budget. Caller holds self.lock."""
+        while self.total_bytes > self.max_bytes and self.entries:
+            self.remove(next(iter(self.entries)))
+            self.evictions += 1
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "mode": self.mode,
+                "entries": len(self.entries),
+                "bytes": self.total_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+            }
+
+# --- Metrics ---
+# Counters, gauges and histograms served at /metrics in the Prometheus text
+# format. Each pipeline step is timed with stage(), as a `with` block or a
+# decorator, into pat_stage_seconds{stage=...}. No transcript or translation
+# text is ever recorded, only timings and counts.
+METRICS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+metrics = []
+
+class Metric:
+    """A Prometheus counter, gauge or histogram, optionally with labels.
+
+    A gauge or counter can take a collect() function that is read at scrape
+    time. It returns a number, or for a labelled metric a dict of label
+    values -> number.
+    """
+
+    def __init__(self, name, help_text, kind, labels=(), buckets=METRICS_BUCKETS, collect=None):
+        self.name = name
+        self.help_text = help_text
+        self.kind = kind
+        self.labels = labels
+        self.buckets = buckets
+        self.collect = collect
+        self.lock = threading.Lock()
+        self.values = {}   # label values -> number, or [bucket counts..., sum, count] for histograms
+        metrics.append(self)
+
+    def key(self, labels):
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        with self.lock:
+            counts = self.values.setdefault(key, [0] * (len(self.buckets) + 2))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            counts[-2] += value
+            counts[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        if self.collect is not None:
+            values = self.collect()
+            if not isinstance(values, dict):
+                values = {(): values}
+        else:
+            with self.lock:
+                values = {k: list(v) if isinstance(v, list) else v for k, v in self.values.items()}
+        for key, value in sorted(values.items()):
+            labels = [f'{name}="{label}"' for name, label in zip(self.labels, key)]
+            if self.kind != "histogram":
+                lines.append(f"{self.name}{format_labels(labels)} {value}")
+                continue
+            for bound, count in zip(self.buckets + ("+Inf",), value[:-2] + [value[-1]]):
+                bucket_labels = labels + [f'le="{bound}"']
+                lines.append(f"{self.name}_bucket{format_labels(bucket_labels)} {count}")
+            lines.append(f"{self.name}_sum{format_labels(labels)} {round(value[-2], 6)}")
+            lines.append(f"{self.name}_count{format_labels(labels)} {value[-1]}")
+        return "\n".join(lines)
+
+def format_labels(labels):
+    return "{" + ",".join(labels) + "}" if labels else ""
+
+def render_metrics():
+    return "\n".join(metric.render() for metric in metrics) + "\n"
+
+stage_seconds = Metric("pat_stage_seconds", "Time spent in each pipeline stage.", "histogram", ("stage",))
+http_requests = Metric("pat_http_requests_total", "HTTP requests by route and status.", "counter", ("route", "status"))
+http_errors = Metric("pat_http_errors_total", "HTTP responses with status >= 400, by route.", "counter",
+                     ("route", "status"))
+handled_errors = Metric("pat_handled_errors_total",
+                        "Errors reported inside a successful response (streams, live dictation), by route.",
+                        "counter", ("route",))
+requests_in_flight = Metric("pat_http_requests_in_flight", "Requests being handled, including open streams.",
+                            "gauge", ("route",))
+audio_seconds = Metric("pat_audio_seconds_total", "Seconds of audio received for transcription.", "counter",
+                       ("source",))
+whisper_audio_seconds = Metric("pat_whisper_audio_seconds_total",
+                               "Seconds of audio decoded by Whisper (after VAD, including re-decoded overlaps).",
+                               "counter")
+tokens_generated = Metric("pat_tokens_generated_total", "Tokens generated by the translation model.", "counter")
+jobs_finished = Metric("pat_jobs_finished_total", "Transcription jobs finished, by outcome.", "counter", ("status",))
+job_queue_wait = Metric("pat_job_queue_wait_seconds", "Time jobs spent queued before a worker picked them up.",
+                        "histogram")
+lane_wait_seconds = Metric("pat_lane_wait_seconds", "Time inference waited for its model's lane, by priority class.",
+                           "histogram", ("lane", "priority"))
+whisper_batch_size = Metric("pat_whisper_batch_size", "Clips transcribed together in one Whisper batch.",
+                            "histogram", buckets=(1, 2, 4, 8, 16, 32))
+lane_waiting = Metric("pat_lane_waiting", "Inferences waiting for each lane.", "gauge", ("lane",))
+lane_rejected = Metric("pat_lane_rejected_total", "Requests turned away with 429 because a queue was full.",
+                       "counter", ("lane",))
+translation_active_sequences = Metric("pat_translation_active_sequences",
+                                      "Sequences in the continuous-batching translation decode loop.", "gauge",
+                                      collect=lambda: len(decode_loop.active))
+translation_aggregate_rate = Metric("pat_translation_aggregate_tokens_per_second",
+                                    "Tokens per second decoded by the translation loop, over all requests.", "gauge",
+                                    collect=lambda: decode_loop.aggregate_tokens_per_second() or 0)
+job_queue_depth = Metric("pat_job_queue_depth", "Transcription jobs waiting for a worker.", "gauge",
+                         collect=lambda: len(job_queue))
+
+def cache_stat(field):
+    """One ResultCache.stats() field of each result cache, keyed by cache name."""
+    return {(cache.name,): cache.stats()[field] for cache in (transcription_cache, translation_cache)}
+
+cache_hits = Metric("pat_cache_hits_total", "Result cache lookups answered from the cache.", "counter", ("cache",),
+                    collect=lambda: cache_stat("hits"))
+cache_misses = Metric("pat_cache_misses_total", "Result cache lookups that found nothing usable.", "counter",
+                      ("cache",), collect=lambda: cache_stat("misses"))
+cache_evictions = Metric("pat_cache_evictions_total", "Result cache entries dropped to stay under the byte budget.",
+                         "counter", ("cache",), collect=lambda: cache_stat("evictions"))
+cache_bytes = Metric("pat_cache_bytes", "Bytes held by each result cache.", "gauge", ("cache",),
+                     collect=lambda: cache_stat("bytes"))
+
+# --- Request Tracing ---
+# Every transcription and translation request gets a trace: a request ID and
+# the time spent in each stage() it went through. The breakdown is returned
+# in a Server-Timing header (or, for streams and jobs, with the final event
+# or job status) and logged as one JSON line. Traces hold IDs, durations,
+# model names and language codes only, never transcript or translation text.
+TRACE_LOG = True   # Print one JSON line per traced request
+
+TRACED_ROUTES = {   # route -> model it runs
+    "/transcribe": "whisper",
+    "/transcribe_batch": "whisper",
+    "/jobs": "whisper",
+    "/dictation/<session_id>/finish": "whisper",
+    "/translate": "translation",
+    "/translate/stream": "translation",
+}
+
+ROUTE_PRIORITIES = {   # route -> priority class; everything else is "interactive"
+    "/dictation/<session_id>/chunk": "live",
+    "/dictation/<session_id>/finish": "live",
+    "/transcribe_batch": "batch",
+}
+
+current_trace = contextvars.ContextVar("current_trace", default=None)
+
+def new_trace(route):
+    return {
+        "request_id": uuid.uuid4().hex[:16],
+        "route": route,
+        "engine": engine.name,
+        "model": WHISPER_MODEL_PATH if TRACED_ROUTES.get(route) == "whisper" else TRANSLATION_MODEL_PATH,
+        "priority": current_priority.get(),
+        "started": time.perf_counter(),
+        "stages": {},
+    }
+
+def trace_note(**fields):
+    """Add fields to the current request's trace. Numbers and codes only, never user text."""
+    trace = current_trace.get()
+    if trace is not None:
+        trace.update(fields)
+
+def record_stage(name, seconds):
+    """Record time spent in a stage, in the metrics and in the current request's trace."""
+    stage_seconds.observe(seconds, stage=name)
+    trace = current_trace.get()
+    if trace is not None:
+        trace["stages"][name] = trace["stages"].get(name, 0.0) + seconds
+
+def trace_timings(trace):
+    """The trace's stage breakdown in milliseconds, as sent to the browser."""
+    return {
+        "request_id": trace["request_id"],
+        "total_ms": round((time.perf_counter() - trace["started"]) * 1000, 1),
+        "stages": {name: round(seconds * 1000, 1) for name, seconds in trace["stages"].items()},
+    }
+
+def server_timing_header(timings):
+    parts = [f"{name};dur={ms}" for name, ms in timings["stages"].items()]
+    parts.append(f"total;dur={timings['total_ms']}")
+    return ", ".join(parts)
+
+def log_trace(trace, event, **fields):
+    """Print the trace as one JSON log line and return its timings."""
+    timings = trace_timings(trace)
+    if TRACE_LOG:
+        line = {"event": event}
+        line.update((key, value) for key, value in trace.items() if key not in ("started", "stages"))
+        line.update(fields)
+        line["total_ms"] = timings["total_ms"]
+        line["stages_ms"] = timings["stages"]
+        print(json.dumps(line))
+    return timings
+
+@contextmanager
+def stage(name):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(name, time.perf_counter() - started)
+
+def timed_generation(steps):
+    """Pass generation steps through, timing prefill (until the first step) and generation, and counting tokens."""
+    started = time.perf_counter()
+    first_at = None
+    count = 0
+    try:
+        for step in steps:
+            if first_at is None:
+                first_at = time.perf_counter()
+                record_stage("prefill", first_at - started)
+            count += 1
+            yield step
+    finally:
+        generation_seconds = time.perf_counter() - first_at if first_at is not None else 0.0
+        if first_at is not None:
+            record_stage("generation", generation_seconds)
+        tokens_generated.inc(count)
+        trace = current_trace.get()
+        if trace is not None:
+            trace["tokens"] = trace.get("tokens", 0) + count
+            if generation_seconds:
+                trace["tokens_per_second"] = round(count / generation_seconds, 1)
+
 # --- Transcription ---
-def run_transcription(audio_path):
-    result = mlx_whisper.transcribe(
-        audio_path,
-        path_or_hf_repo="models/whisper-turbo-mlx"
-    )
+DICTATION_KEYWORDS = ['comma', 'period', 'colon', 'new paragraph', 'end of note']
+
+# Streaming mode decodes the audio window by window so each segment can be
+# sent to the browser as soon as it is ready, instead of after the whole file.
+STREAM_WINDOW_SECONDS = 30
+
+# WAV (16/32-bit PCM or 32-bit float) is decoded without starting ffmpeg:
+# memory-mapped from disk, or read straight from an upload's bytes, and
+# resampled in NumPy. So is FLAC when the optional soundfile package is
+# installed. Any other format, or WAV variant, goes through ffmpeg.
+NATIVE_DECODE = True
+RESAMPLE_ZERO_CROSSINGS = 16   # Half-length of the resampling filter; longer is sharper but slower
+RESAMPLE_BLOCK = 65536         # Output samples per matrix product
+
+WAV_SAMPLE_TYPES = {   # (format tag, bits per sample) -> dtype, scale to [-1, 1)
+    (1, 16): ("<i2", 1 / 32768.0),
+    (1, 32): ("<i4", 1 / 2147483648.0),
+    (3, 32): ("<f4", 1.0),
+}
+
+def sniff_audio_format(source):
+    """Return "wav", "flac" or None from the first bytes of a path or upload."""
+    if isinstance(source, bytes):
+        head = source[:12]
+    else:
+        with open(source, "rb") as f:
+            head = f.read(12)
+    if head[:4] == b"RIFF" and head[8:12] == b"WAVE":
+        return "wav"
+    if head[:4] == b"fLaC":
+        return "flac"
+    return None
+
+def read_wav_layout(f):
+    """Walk a WAV file's chunks. Returns (dtype, scale, channels, rate, data_offset, data_bytes) or None."""
+    f.seek(12)
+    fmt = None
+    while True:
+        header = f.read(8)
+        if len(header) < 8:
+            return None
+        chunk_id, size = header[:4], int.from_bytes(header[4:], "little")
+        if chunk_id == b"fmt ":
+            body = f.read(size)
+            if len(body) < 16:
+                return None
+            tag = int.from_bytes(body[0:2], "little")
+            if tag == 0xFFFE and len(body) >= 26:   # WAVE_FORMAT_EXTENSIBLE: the real tag starts the sub-format GUID
+                tag = int.from_bytes(body[24:26], "little")
+            fmt = (tag, int.from_bytes(body[2:4], "little"), int.from_bytes(body[4:8], "little"),
+                   int.from_bytes(body[14:16], "little"))
+        elif chunk_id == b"data":
+            if fmt is None or (fmt[0], fmt[3]) not in WAV_SAMPLE_TYPES or fmt[1] < 1:
+                return None
+            dtype, scale = WAV_SAMPLE_TYPES[(fmt[0], fmt[3])]
+            return dtype, scale, fmt[1], fmt[2], f.tell(), size
+        else:
+            f.seek(size + (size & 1), os.SEEK_CUR)   # Chunks are word-aligned
+
+def decode_wav(source):
+    if isinstance(source, bytes):
+        layout = read_wav_layout(io.BytesIO(source))
+        total_bytes = len(source)
+    else:
+        with open(source, "rb") as f:
+            layout = read_wav_layout(f)
+        total_bytes = os.path.getsize(source)
+    if layout is None:
+        return None
+    dtype, scale, channels, rate, offset, data_bytes = layout
+    frame_bytes = np.dtype(dtype).itemsize * channels
+    # Streaming recorders can leave the data size unset, so trust the file length over the header
+    frames = max(min(data_bytes, total_bytes - offset), 0) // frame_bytes
+    if frames == 0:
+        return np.zeros(0, np.float32)
+    if isinstance(source, bytes):
+        samples = np.frombuffer(source, dtype, frames * channels, offset)
+    else:
+        samples = np.memmap(source, dtype, "r", offset, (frames * channels,))
+    samples = samples.reshape(frames, channels)
+    audio = samples[:, 0] if channels == 1 else samples.mean(axis=1, dtype=np.float32)
+    audio = np.array(audio, dtype=np.float32)   # A plain in-memory array, even when read from a memmap
+    audio *= scale
+    return resample(audio, rate)
+
+def decode_flac(source):
+    if soundfile is None:
+        return None
+    audio, rate = soundfile.read(io.BytesIO(source) if isinstance(source, bytes) else source,
+                                 dtype="float32", always_2d=True)
+    return resample(audio.mean(axis=1, dtype=np.float32), rate)
+
+NATIVE_DECODERS = {"wav": decode_wav, "flac": decode_flac}
+
+def decode_native(source):
+    """Decode a WAV or FLAC in-process. Returns None when ffmpeg is needed instead."""
+    decoder = NATIVE_DECODERS.get(sniff_audio_format(source))
+    if decoder is None:
+        return None
+    try:
+        return decoder(source)
+    except (ValueError, RuntimeError) as e:
+        print(f"Native decode failed, falling back to ffmpeg: {e}")
+        return None
+
+def resample(audio, rate):
+    """Resample float32 audio to SAMPLE_RATE with a windowed-sinc polyphase filter.
+
+    For a rate ratio up/down, output sample n sits at the same offset between
+    input samples for every n with the same n % up, so each of those "phases"
+    shares one set of filter weights: its outputs are a strided window view
+    of the input times the weights, computed in blocks to bound memory.
+    """
+    if rate == SAMPLE_RATE:
+        return audio
+    divisor = math.gcd(SAMPLE_RATE, rate)
+    up, down = SAMPLE_RATE // divisor, rate // divisor
+    cutoff = min(1.0, up / down) * 0.95   # Fraction of the input Nyquist frequency kept
+    half = int(np.ceil(RESAMPLE_ZERO_CROSSINGS / cutoff))
+    taps = np.arange(-half + 1, half + 1)
+    out_len = len(audio) * up // down
+    windows = np.lib.stride_tricks.sliding_window_view(np.pad(audio, (half, half + down)), len(taps))
+    out = np.empty(out_len, np.float32)
+    for phase in range(min(up, out_len)):
+        position = phase * down / up
+        base = int(position)
+        distance = position - (base + taps)
+        weights = np.sinc(cutoff * distance) * (0.5 + 0.5 * np.cos(np.pi * distance / (half + 1)))
+        weights = (weights / weights.sum()).astype(np.float32)
+        phase_windows = windows[base + 1::down][:len(range(phase, out_len, up))]
+        out[phase::up] = np.concatenate([phase_windows[i:i + RESAMPLE_BLOCK] @ weights
+                                         for i in range(0, len(phase_windows), RESAMPLE_BLOCK)])
+    return out
+
+@stage("audio_decode")
+def load_audio(source):
+    """Decode audio to a 16 kHz mono float32 array.
+
+    source is a file path or the bytes of an upload. WAV and FLAC are
+    decoded natively (see NATIVE_DECODE); anything else is piped into
+    ffmpeg, so the audio never touches disk. An MP4/M4A whose index (the
+    moov atom) is at the end of the file cannot be read from a pipe; it
+    falls back to a temp file that is deleted as soon as it is decoded.
+    """
+    if NATIVE_DECODE:
+        audio = decode_native(source)
+        if audio is not None:
+            trace_note(decoder="native")
+            return audio
+    trace_note(decoder="ffmpeg")
+    if not isinstance(source, bytes):
+        return run_ffmpeg(source)
+    try:
+        return run_ffmpeg("pipe:0", source)
+    except RuntimeError:
+        if source[4:8] != b"ftyp":
+            raise
+    print("MP4 audio is not streamable, decoding it from a temp file")
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    with tempfile.NamedTemporaryFile(dir=UPLOAD_DIR, suffix=".m4a") as temp_audio:
+        temp_audio.write(source)
+        temp_audio.flush()
+        return run_ffmpeg(temp_audio.name)
+
+def ffmpeg_command(input_name):
+    return ["ffmpeg", "-threads", "0", "-i", input_name,
+            "-f", "s16le", "-ac", "1", "-acodec", "pcm_s16le", "-ar", str(SAMPLE_RATE), "-"]
+
+def run_ffmpeg(input_name, data=None):
+    cmd = ffmpeg_command(input_name)
+    if data is None:
+        cmd.insert(1, "-nostdin")
+    try:
+        out = subprocess.run(cmd, input=data, capture_output=True, check=True).stdout
+    except subprocess.CalledProcessError as e:
+        raise RuntimeError(f"Failed to load audio: {e.stderr.decode(errors='ignore')}") from e
+    return np.frombuffer(out, np.int16).astype(np.float32) / 32768.0
+
+class StreamingDecoder:
+    """One ffmpeg process decoding a recording that arrives in pieces (MediaRecorder chunks).
+
+    Only the first chunk carries the container header, so the pieces cannot
+    be decoded on their own; instead they are fed into ffmpeg as they arrive
+    and the PCM it has produced so far is kept. Each byte is decoded once.
+    """
+    OUTPUT_SETTLE_SECONDS = 0.03   # After a feed, output that pauses this long is taken as caught up
+    OUTPUT_WAIT_SECONDS = 0.5      # ...but don't wait longer than this for it
+
+    def __init__(self):
+        cmd = ffmpeg_command("pipe:0")
+        cmd[1:1] = ["-loglevel", "error", "-nostats"]
+        cmd[-1:-1] = ["-flush_packets", "1"]
+        self.process = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                        stderr=subprocess.PIPE)
+        self.pcm = bytearray()
+        self.errors = bytearray()
+        self.output_changed = threading.Condition()
+        self.last_output = time.perf_counter()
+        self.readers = [threading.Thread(target=self.read_output, daemon=True),
+                        threading.Thread(target=self.read_errors, daemon=True)]
+        for reader in self.readers:
+            reader.start()
+
+    def read_output(self):
+        while block := self.process.stdout.read1(65536):
+            with self.output_changed:
+                self.pcm.extend(block)
+                self.last_output = time.perf_counter()
+                self.output_changed.notify_all()
+
+    def read_errors(self):
+        while block := self.process.stderr.read1(65536):
+            self.errors.extend(block[:4096 - len(self.errors)])
+
+    def feed(self, data):
+        """Pass on the next bytes of the recording. Raises RuntimeError if ffmpeg has given up."""
+        try:
+            self.process.stdin.write(data)
+            self.process.stdin.flush()
+        except (BrokenPipeError, ValueError) as e:
+            raise RuntimeError(f"Failed to load audio: {self.errors.decode(errors='ignore')}") from e
+        self.last_output = time.perf_counter()
+
+    def audio(self):
+        """The audio decoded so far, after giving ffmpeg a moment to catch up with the last feed."""
+        deadline = time.perf_counter() + self.OUTPUT_WAIT_SECONDS
+        with self.output_changed:
+            while self.process.poll() is None:
+                now = time.perf_counter()
+                settled_at = self.last_output + self.OUTPUT_SETTLE_SECONDS
+                if now >= settled_at or now >= deadline:
+                    break
+                self.output_changed.wait(min(settled_at, deadline) - now)
+            pcm = bytes(self.pcm[:len(self.pcm) // 2 * 2])
+        return np.frombuffer(pcm, np.int16).astype(np.float32) / 32768.0
+
+    def finish(self):
+        """Close the input and return the whole recording's audio."""
+        try:
+            self.process.stdin.close()
+        except BrokenPipeError:
+            pass
+        for reader in self.readers:
+            reader.join()
+        if self.process.wait() != 0:
+            raise RuntimeError(f"Failed to load audio: {self.errors.decode(errors='ignore')}")
+        return self.audio()
+
+    def close(self):
+        if self.process.poll() is None:
+            self.process.kill()
+        self.process.wait()
+        for reader in self.readers:
+            reader.join()
+        for pipe in (self.process.stdin, self.process.stdout, self.process.stderr):
+            try:
+                pipe.close()
+            except BrokenPipeError:
+                pass
+
+@stage("keyword_postprocess")
+def highlight_dictation_keywords(text, language_code):
+    """Wrap spoken dictation commands in <...> so they stand out in English notes."""
+    if language_code != 'en':
+        return text
+    highlighted_text = text
+    for keyword in DICTATION_KEYWORDS:
+        pattern = r'\b(' + re.escape(keyword) + r')\b'
+        highlighted_text = re.sub(
+            pattern,
+            lambda match: f"<{match.group(1)}>",
+            highlighted_text,
+            flags=re.IGNORECASE
+        )
+    return highlighted_text
+
+# --- Voice Activity Detection ---
+# An energy-based pre-pass finds the speech in a recording so that Whisper
+# only decodes those parts. Long pauses in dictation cost encoder passes and
+# are where Whisper hallucinates text such as "Thank you.".
+VAD_ENABLED = True
+VAD_FRAME_MS = 30
+VAD_THRESHOLD_DB = 12          # Speech must be this far above the estimated noise floor
+VAD_MIN_LEVEL_DB = -60         # Anything quieter than this (dBFS) is never speech
+VAD_MIN_SPEECH_MS = 250        # Shorter bursts (clicks, bumps) are ignored
+VAD_MIN_SILENCE_MS = 700       # Shorter pauses are kept so sentences are not split
+VAD_PAD_MS = 200               # Margin kept around each speech region
+VAD_MIN_SKIP_SECONDS = 1.0     # Below this much silence, decode the original audio unchanged
+
+def detect_speech_regions(audio):
+    """Return a list of (start_sample, end_sample) speech regions in a 16 kHz float array."""
+    frame = SAMPLE_RATE * VAD_FRAME_MS // 1000
+    n_frames = len(audio) // frame
+    if n_frames == 0:
+        return []
+    frames = audio[:n_frames * frame].reshape(n_frames, frame)
+    level_db = 20 * np.log10(np.sqrt(np.mean(frames ** 2, axis=1)) + 1e-10)
+    noise_floor = np.percentile(level_db, 10)
+    loudest = np.percentile(level_db, 95)
+    threshold = noise_floor + VAD_THRESHOLD_DB
+    # Cap the threshold below the loud parts so a recording with no pauses
+    # (where the "noise floor" is really quiet speech) is not cut away. A
+    # recording whose loud parts are barely above its floor is steady noise,
+    # and keeps the uncapped threshold, so it has no speech at all.
+    if loudest - noise_floor >= VAD_THRESHOLD_DB:
+        threshold = min(threshold, loudest - 25)
+    threshold = max(threshold, VAD_MIN_LEVEL_DB)
+    is_speech = level_db > threshold
+
+    # Run boundaries of the speech mask, as frame indices
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], is_speech.astype(np.int8), [0]))))
+    runs = list(zip(edges[::2], edges[1::2]))
+
+    min_silence = VAD_MIN_SILENCE_MS // VAD_FRAME_MS
+    min_speech = VAD_MIN_SPEECH_MS // VAD_FRAME_MS
+    pad = VAD_PAD_MS // VAD_FRAME_MS
+    merged = []
+    for start, end in runs:
+        if merged and start - merged[-1][1] < min_silence:
+            merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+
+    regions = []
+    for start, end in merged:
+        if end - start < min_speech:
+            continue
+        start = int(max(0, start - pad) * frame)
+        end = int(min(len(audio), (end + pad) * frame))
+        if regions and start <= regions[-1][1]:
+            regions[-1] = (regions[-1][0], end)
+        else:
+            regions.append((start, end))
+    return regions
+
+def prepare_audio(source):
+    """Decode a file or upload (see load_audio) and, if VAD is on, drop its silence.
+
+    Returns (audio, speech_map, vad_report). speech_map lists
+    (compact_seconds, original_seconds, duration) for each kept region and
+    is used by map_timestamp(); it is None when the audio is unchanged.
+    """
+    audio = load_audio(source)
+    audio_seconds.inc(len(audio) / SAMPLE_RATE, source="file")
+    trace_note(audio_seconds=round(len(audio) / SAMPLE_RATE, 2))
+    if not VAD_ENABLED:
+        return audio, None, None
+    total_seconds = len(audio) / SAMPLE_RATE
+    with stage("vad"):
+        regions = detect_speech_regions(audio)
+    speech_seconds = sum(end - start for start, end in regions) / SAMPLE_RATE
+    vad_report = {
+        "audio_seconds": round(total_seconds, 2),
+        "speech_seconds": round(speech_seconds, 2),
+        "skipped_seconds": round(total_seconds - speech_seconds, 2),
+    }
+    print(f"VAD: skipping {vad_report['skipped_seconds']:.1f}s of {total_seconds:.1f}s "
+          f"({len(regions)} speech regions)")
+    if regions and total_seconds - speech_seconds < VAD_MIN_SKIP_SECONDS:
+        vad_report["skipped_seconds"] = 0.0
+        return audio, None, vad_report
+    speech_map = []
+    compact_seconds = 0.0
+    for start, end in regions:
+        duration = (end - start) / SAMPLE_RATE
+        speech_map.append((compact_seconds, start / SAMPLE_RATE, duration))
+        compact_seconds += duration
+    compact = np.concatenate([audio[start:end] for start, end in regions]) if regions else audio[:0]
+    return compact, speech_map, vad_report
+
+def map_timestamp(seconds, speech_map):
+    """Translate a time in the VAD-compacted audio back to the original recording."""
+    if not speech_map:
+        return seconds
+    i = max(bisect.bisect_right([entry[0] for entry in speech_map], seconds) - 1, 0)
+    compact_start, original_start, duration = speech_map[i]
+    return original_start + min(seconds - compact_start, duration)
+
+def run_transcription(source):
+    """Transcribe a file path or upload bytes. Returns (text, language_code, details).
+
+    details holds the optional "vad" and "long_file" reports.
+    """
+    return transcribe_prepared(*prepare_audio(source))
+
+def transcribe_prepared(audio, speech_map, vad_report):
+    """Transcribe audio returned by prepare_audio(). Returns (text, language_code, details)."""
+    details = {"vad": vad_report} if vad_report else {}
+    if len(audio) == 0:
+        return "", None, details
+    if is_long_file(audio):
+        segments = list(iter_long_file_segments(audio, speech_map, details))
+        language_code = segments[0]["language"] if segments else None
+        return " ".join(segment["text"] for segment in segments), language_code, details
+    result = whisper_transcribe(audio)
     text = result['text'].strip()
     language_code = result['language'] # This is the ISO code (e.g., 'en')
-	
-    if language_code == 'en':
-        dictation_keywords = ['comma', 'period', 'colon', 'new paragraph', 'end of note']
-        highlighted_text = text
-        for keyword in dictation_keywords:
-            pattern = r'\b(' + re.escape(keyword) + r')\b'
-            highlighted_text = re.sub(
-                pattern,
-                lambda match: f"<{match.group(1)}>",
-                highlighted_text,
-                flags=re.IGNORECASE
+    return highlight_dictation_keywords(text, language_code), language_code, details
+
+def iter_transcription_segments(audio, speech_map=None):
+    """Yield Whisper segments ({start, end, text, language}) as each window is decoded.
+
+    Like Whisper's own seek loop, the next window starts at the end of the
+    last complete segment, so words cut off at a window edge are re-decoded
+    rather than lost. The previous text is passed as the prompt to keep
+    context across windows. Timestamps are mapped back through speech_map
+    when the audio has been compacted by VAD.
+    """
+    window = STREAM_WINDOW_SECONDS * SAMPLE_RATE
+    seek = 0
+    language_code = None
+    previous_text = ""
+    while seek < len(audio):
+        chunk = audio[seek:seek + window]
+        if len(chunk) < SAMPLE_RATE // 10:
+            break
+        result = whisper_transcribe(
+            chunk,
+            language=language_code,
+            initial_prompt=previous_text[-500:] or None,
+        )
+        language_code = language_code or result['language']
+        segments = result.get('segments') or []
+        is_last_window = seek + window >= len(audio)
+        chunk_seconds = len(chunk) / SAMPLE_RATE
+        # Hold back a final segment that runs into the window edge; it is
+        # decoded again at the start of the next window.
+        if not is_last_window and len(segments) > 1 and segments[-1]['end'] > chunk_seconds - 1.0:
+            advance = segments[-1]['start']
+            segments = segments[:-1]
+        else:
+            advance = chunk_seconds
+        offset = seek / SAMPLE_RATE
+        for segment in segments:
+            text = segment['text'].strip()
+            if not text:
+                continue
+            previous_text += " " + text
+            yield {
+                "start": round(map_timestamp(offset + segment['start'], speech_map), 2),
+                "end": round(map_timestamp(offset + segment['end'], speech_map), 2),
+                "text": highlight_dictation_keywords(text, language_code),
+                "language": language_code,
+            }
+        seek += max(int(advance * SAMPLE_RATE), SAMPLE_RATE)
+
+def iter_audio_segments(audio, speech_map=None, details=None):
+    """Yield segments in order, using long-file mode when the audio is long enough.
+
+    Batch work always goes window by window: long-file mode holds the
+    Whisper lane for the whole file, which would keep live dictation waiting.
+    """
+    if is_long_file(audio) and current_priority.get() != "batch":
+        return iter_long_file_segments(audio, speech_map, details)
+    return iter_transcription_segments(audio, speech_map)
+
+# --- Long-File Mode ---
+# Long recordings are cut at pauses into chunks that are transcribed in
+# parallel by a pool of worker processes (each holds its own Whisper model),
+# then stitched back together in order.
+LONG_FILE_MIN_SECONDS = 10 * 60   # Shorter files are transcribed in one pass
+LONG_FILE_CHUNK_SECONDS = 120     # Target chunk length; the cut moves to the nearest pause
+LONG_FILE_OVERLAP_SECONDS = 2     # Overlap used only when no pause is found near the cut
+LONG_FILE_WORKERS = 2             # Set to 1 to disable long-file mode
+
+long_file_pool = None
+long_file_pool_lock = threading.Lock()
+
+def is_long_file(audio):
+    return LONG_FILE_WORKERS > 1 and len(audio) > LONG_FILE_MIN_SECONDS * SAMPLE_RATE
+
+def get_long_file_pool():
+    global long_file_pool
+    with long_file_pool_lock:
+        if long_file_pool is None:
+            # spawn, not fork: MLX and the Flask threads do not survive a fork
+            long_file_pool = ProcessPoolExecutor(
+                max_workers=LONG_FILE_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
             )
-        return highlighted_text, language_code
+        return long_file_pool
+
+def plan_long_file_chunks(audio, speech_map=None):
+    """Return (start_sample, end_sample, overlap_samples) for each chunk.
+
+    Cut points are pauses: the joins between speech regions when VAD has
+    already compacted the audio, otherwise the gaps found by
+    detect_speech_regions(). The pause nearest the target length wins. If
+    there is none within half a chunk, the cut is hard and the next chunk
+    starts LONG_FILE_OVERLAP_SECONDS early so no word is lost.
+    """
+    chunk = LONG_FILE_CHUNK_SECONDS * SAMPLE_RATE
+    if speech_map:
+        pauses = [int(entry[0] * SAMPLE_RATE) for entry in speech_map[1:]]
+    else:
+        regions = detect_speech_regions(audio)
+        pauses = [(prev_end + next_start) // 2
+                  for (_, prev_end), (next_start, _) in zip(regions, regions[1:])]
+    plan = []
+    start, overlap = 0, 0
+    while len(audio) - start > chunk * 3 // 2:
+        target = start + chunk
+        nearby = [p for p in pauses if start + chunk // 2 <= p <= start + chunk * 3 // 2]
+        if nearby:
+            cut = min(nearby, key=lambda p: abs(p - target))
+            plan.append((start, cut, overlap))
+            start, overlap = cut, 0
+        else:
+            plan.append((start, target, overlap))
+            overlap = LONG_FILE_OVERLAP_SECONDS * SAMPLE_RATE
+            start = target - overlap
+    plan.append((start, len(audio), overlap))
+    return plan
+
+def transcribe_chunk(chunk_audio):
+    """Runs in a worker process. Returns plain data so it pickles back cheaply."""
+    started = time.time()
+    result = engine.transcribe(chunk_audio)
+    return {
+        "language": result['language'],
+        "segments": [{"start": s['start'], "end": s['end'], "text": s['text'].strip()}
+                     for s in result.get('segments') or [] if s['text'].strip()],
+        "elapsed": time.time() - started,
+    }
+
+def normalize_word(word):
+    return re.sub(r'\W+', '', word.lower())
+
+def drop_repeated_words(previous_words, segments, max_words=30):
+    """Remove the words at the start of segments that repeat the end of previous_words."""
+    words = [normalize_word(w) for segment in segments for w in segment["text"].split()]
+    tail = [normalize_word(w) for w in previous_words[-max_words:]]
+    repeated = 0
+    for n in range(min(len(tail), len(words), max_words), 1, -1):
+        if tail[-n:] == words[:n]:
+            repeated = n
+            break
+    trimmed = []
+    for segment in segments:
+        segment_words = segment["text"].split()
+        drop = min(repeated, len(segment_words))
+        repeated -= drop
+        if drop < len(segment_words):
+            trimmed.append(dict(segment, text=" ".join(segment_words[drop:])))
+    return trimmed
+
+def iter_long_file_segments(audio, speech_map=None, details=None):
+    """Transcribe chunks in parallel and yield their segments in order as each completes.
+
+    Real-time factor (processing seconds per audio second) is logged per
+    chunk and overall, and stored in details["long_file"] when given.
+    """
+    plan = plan_long_file_chunks(audio, speech_map)
+    pool = get_long_file_pool()
+    # The chunk processes run their own Whisper models, so the lane is held for the whole file
+    with whisper_lane.turn():
+        started = time.time()
+        futures = [pool.submit(transcribe_chunk, audio[start:end]) for start, end, _ in plan]
+        report = {"workers": LONG_FILE_WORKERS, "chunks": []}
+        language_code = None
+        previous_words = []
+        for index, ((start, end, overlap), future) in enumerate(zip(plan, futures)):
+            result = future.result()
+            language_code = language_code or result["language"]
+            chunk_seconds = (end - start) / SAMPLE_RATE
+            record_stage("whisper_inference", result["elapsed"])
+            whisper_audio_seconds.inc(chunk_seconds)
+            rtf = result["elapsed"] / chunk_seconds
+            report["chunks"].append({"seconds": round(chunk_seconds, 2), "rtf": round(rtf, 3)})
+            print(f"Long file: chunk {index + 1}/{len(plan)} ({chunk_seconds:.0f}s) RTF {rtf:.3f}")
+            segments = result["segments"]
+            if overlap:
+                segments = drop_repeated_words(previous_words, segments)
+            offset = start / SAMPLE_RATE
+            for segment in segments:
+                previous_words.extend(segment["text"].split())
+                yield {
+                    "start": round(map_timestamp(offset + segment['start'], speech_map), 2),
+                    "end": round(map_timestamp(offset + segment['end'], speech_map), 2),
+                    "text": highlight_dictation_keywords(segment["text"], language_code),
+                    "language": language_code,
+                }
+    wall_time = time.time() - started
+    report["rtf"] = round(wall_time / (len(audio) / SAMPLE_RATE), 3)
+    print(f"Long file: {len(plan)} chunks on {LONG_FILE_WORKERS} workers, overall RTF {report['rtf']:.3f}")
+    if details is not None:
+        details["long_file"] = report
+
+transcription_cache = ResultCache("transcriptions", TRANSCRIPTION_CACHE_MODE, TRANSCRIPTION_CACHE_MAX_BYTES)
+
+def transcription_cache_key(audio):
+    """Hash of the audio (bytes or a file path) plus everything that changes the transcription."""
+    digest = hashlib.sha256()
+    if isinstance(audio, bytes):
+        digest.update(audio)
+    else:
+        with open(audio, "rb") as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(block)
+    options = {
+        "model": WHISPER_MODEL_PATH,
+        "vad": [VAD_THRESHOLD_DB, VAD_MIN_LEVEL_DB, VAD_MIN_SPEECH_MS,
+                VAD_MIN_SILENCE_MS, VAD_PAD_MS] if VAD_ENABLED else None,
+    }
+    digest.update(json.dumps(options, sort_keys=True).encode("utf-8"))
+    return digest.hexdigest()
+
+def lookup_transcription(cache_key):
+    result = transcription_cache.get(cache_key)
+    trace_note(cache="hit" if result else "miss")
+    stats = transcription_cache.stats()
+    print(f"Transcription cache {'hit' if result else 'miss'} "
+          f"(hit rate {stats['hit_rate'] or 0:.0%}, {stats['entries']} entries)")
+    return result
+
+class UploadSpool(tempfile.SpooledTemporaryFile):
+    """An upload's stream: in memory up to UPLOAD_SPILL_BYTES, then a named file in UPLOAD_DIR.
+
+    read_upload() takes over a spilled file with keep(); otherwise it is
+    deleted when the request closes the stream.
+    """
+
+    def __init__(self, suffix):
+        super().__init__(max_size=UPLOAD_SPILL_BYTES, mode="w+b")
+        self.suffix = suffix
+        self.kept = False
+
+    def rollover(self):
+        if self._rolled:
+            return
+        os.makedirs(UPLOAD_DIR, exist_ok=True)
+        memory = self._file
+        self._file = tempfile.NamedTemporaryFile(dir=UPLOAD_DIR, suffix=self.suffix, delete=False)
+        self._file.write(memory.getvalue())
+        self._file.seek(memory.tell())
+        self._rolled = True
+
+    def keep(self):
+        """Return the spilled file's path; deleting it is now up to the caller (discard_upload)."""
+        self._file.flush()
+        self.kept = True
+        return self.name
+
+    def close(self):
+        spilled = self.name if self._rolled and not self.kept else None
+        super().close()
+        if spilled is not None and os.path.exists(spilled):
+            os.remove(spilled)
+
+def upload_suffix(filename):
+    """The upload's extension if it is an allowed audio type, else .webm."""
+    raw_suffix = os.path.splitext(filename or "")[1].lower()
+    return raw_suffix if raw_suffix in ALLOWED_EXTENSIONS else '.webm'
+
+@stage("upload_buffer")
+def read_upload(audio_file):
+    """Return an uploaded file's bytes, or the path of its file in UPLOAD_DIR if it is over UPLOAD_SPILL_BYTES.
+
+    Everything downstream (load_audio, transcription_cache_key, the job
+    queue) accepts either; discard_upload() deletes the file.
+    """
+    stream = audio_file.stream
+    stream.seek(0, os.SEEK_END)
+    size = stream.tell()
+    stream.seek(0)
+    if size <= UPLOAD_SPILL_BYTES:
+        return stream.read()
+    if isinstance(stream, UploadSpool) and stream.name is not None:
+        return stream.keep()   # Already on disk; no second copy
+    return save_upload(audio_file)
+
+@stage("temp_file_write")
+def save_upload(audio_file):
+    """Write an uploaded audio file into the temp upload folder and return its path."""
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    with tempfile.NamedTemporaryFile(dir=UPLOAD_DIR, delete=False, suffix=upload_suffix(audio_file.filename)) as temp_audio:
+        audio_file.save(temp_audio.name)
+        return temp_audio.name
+
+def discard_upload(audio):
+    """Delete an upload's temp copy, if it has one."""
+    if isinstance(audio, str) and os.path.exists(audio):
+        os.remove(audio)
+
+def upload_size(audio):
+    return len(audio) if isinstance(audio, bytes) else os.path.getsize(audio)
+
+# --- Transcription Job Queue ---
+# Uploads are accepted immediately and transcribed by a background worker.
+# The browser polls (or streams) the job status instead of holding one
+# HTTP request open for the whole transcription.
+#
+# Jobs go through a two-stage pipeline: decoder threads decode the audio
+# (and run VAD) for the next jobs on the CPU while the Whisper worker is busy
+# with the current one, so a batch of files costs about its inference time.
+# At most JOB_PREFETCH decoded jobs per priority class wait for Whisper,
+# which caps the audio held in memory. Cache hits are finished by the
+# decoder without waiting for Whisper. A job reports "queued" until the
+# Whisper worker takes it, so queue_wait includes its decode time.
+#
+# Both stages hand out jobs by priority class, then submission order. A
+# decoder only takes a job whose class has a free prefetch slot, so batch
+# jobs filling their slots never hold up an interactive one. Batch jobs are
+# transcribed window by window: between windows the worker first runs any
+# more urgent decoded job, and gives up the Whisper lane (see Inference
+# Scheduler), so a single file waits for about one window of batch work.
+JOB_WORKERS = 1                   # Whisper runs on one accelerator; more workers only contend
+JOB_DECODE_WORKERS = 2            # CPU threads decoding upcoming jobs
+JOB_PREFETCH = 2                  # Decoded jobs of each priority class allowed to wait for Whisper
+JOB_MAX_QUEUED = 200              # More waiting jobs than this are turned away with 429
+JOB_RETENTION_SECONDS = 15 * 60   # Finished results are dropped from memory after this
+
+jobs = {}
+jobs_changed = threading.Condition()
+job_queue = []        # (priority rank, sequence, job ID) waiting to be decoded; guarded by jobs_changed
+decoded_jobs = []     # (priority rank, sequence, job ID, decoded at) waiting for Whisper; guarded by jobs_changed
+# Jobs per class being decoded or waiting for Whisper. Live dictation never
+# goes through the job queue, but every class has a slot count so any
+# priority submit_job() accepts is accounted for.
+prefetched = {priority: 0 for priority in PRIORITY_CLASSES}
+job_sequence = itertools.count()
+job_stats = {
+    "submitted": 0,
+    "completed": 0,
+    "failed": 0,
+    "total_wall_time": 0.0,
+    "total_queue_wait": 0.0,
+    "last_wall_time": None,
+    "last_queue_wait": None,
+}
+
+def submit_job(audio, stream=False, trace=None, cache_key=None, priority="interactive"):
+    """Queue an upload (bytes or a temp file path) for transcription and return its job ID.
+
+    With stream=True the worker decodes window by window and publishes each
+    segment on the job as soon as it is ready. The job carries on the
+    request's trace (a copy, as the request logs its own). cache_key may be
+    passed when the caller has already hashed the audio. priority is
+    "interactive" or "batch".
+    """
+    job_id = uuid.uuid4().hex
+    trace = dict(trace, stages=dict(trace["stages"])) if trace else new_trace("/jobs")
+    trace["priority"] = priority
+    with jobs_changed:
+        prune_finished_jobs()
+        jobs[job_id] = {
+            "id": job_id,
+            "status": "queued",
+            "audio": audio,
+            "stream": stream,
+            "priority": priority,
+            "segments": [],
+            "submitted_at": time.time(),
+            "started_at": None,
+            "finished_at": None,
+            "result": None,
+            "error": None,
+            "trace": trace,
+            "timings": None,
+            "cache_key": cache_key,
+            "prepared": None,   # (audio, speech_map, vad_report) once decoded
+        }
+        job_stats["submitted"] += 1
+        job_queue.append((PRIORITY_CLASSES.index(priority), next(job_sequence), job_id))
+        jobs_changed.notify_all()
+    return job_id
+
+def admit_jobs(count=1):
+    """Raise ServerBusy if count more jobs would overflow the job queue."""
+    with jobs_changed:
+        queued = sum(1 for job in jobs.values() if job["status"] == "queued")
+        if queued + count <= JOB_MAX_QUEUED:
+            return
+        finished = job_stats["completed"] + job_stats["failed"]
+        avg_wall_time = job_stats["total_wall_time"] / finished if finished else 5.0
+    lane_rejected.inc(lane="jobs")
+    raise ServerBusy(max(1, math.ceil(queued * avg_wall_time / JOB_WORKERS)))
+
+def prune_finished_jobs():
+    """Forget finished jobs older than JOB_RETENTION_SECONDS. Caller holds jobs_changed."""
+    cutoff = time.time() - JOB_RETENTION_SECONDS
+    expired = [job_id for job_id, job in jobs.items()
+               if job["finished_at"] is not None and job["finished_at"] < cutoff]
+    for job_id in expired:
+        del jobs[job_id]
+
+def job_view(job):
+    """Return the client-facing representation of a job (never the audio or its temp file path)."""
+    view = {"job_id": job["id"], "status": job["status"]}
+    if job["started_at"] is not None:
+        view["queue_wait"] = round(job["started_at"] - job["submitted_at"], 3)
+    if job["finished_at"] is not None:
+        view["wall_time"] = round(job["finished_at"] - job["started_at"], 3)
+    if job["status"] == "queued":
+        place = (PRIORITY_CLASSES.index(job["priority"]), job["submitted_at"])
+        view["queue_position"] = sum(
+            1 for other in jobs.values()
+            if other["status"] == "queued"
+            and (PRIORITY_CLASSES.index(other["priority"]), other["submitted_at"]) <= place
+        )
+    if job["status"] == "done":
+        view.update(job["result"])
+    if job["status"] == "failed":
+        view["error"] = job["error"]
+    if job["timings"] is not None:
+        view["timings"] = job["timings"]
+    return view
+
+def job_queue_snapshot():
+    """Queue depth and timing figures for sizing the machine."""
+    with jobs_changed:
+        finished = job_stats["completed"] + job_stats["failed"]
+        return {
+            "queue_depth": sum(1 for job in jobs.values() if job["status"] == "queued"),
+            "running": sum(1 for job in jobs.values() if job["status"] == "running"),
+            "decoded_waiting": len(decoded_jobs),
+            "workers": JOB_WORKERS,
+            "decode_workers": JOB_DECODE_WORKERS,
+            "submitted": job_stats["submitted"],
+            "completed": job_stats["completed"],
+            "failed": job_stats["failed"],
+            "avg_wall_time": round(job_stats["total_wall_time"] / finished, 3) if finished else None,
+            "avg_queue_wait": round(job_stats["total_queue_wait"] / finished, 3) if finished else None,
+            "last_wall_time": job_stats["last_wall_time"],
+            "last_queue_wait": job_stats["last_queue_wait"],
+        }
+
+def prepare_job(job):
+    """Decode a job's audio ready for Whisper, or find its result in the cache.
+
+    Returns the cached result, or None after storing prepare_audio()'s output
+    on the job.
+    """
+    if job["cache_key"] is None:
+        job["cache_key"] = transcription_cache_key(job["audio"])
+    cached = lookup_transcription(job["cache_key"])
+    if cached is not None:
+        trace_note(language=cached["source_lang_code"])
+        return cached
+    job["prepared"] = prepare_audio(job["audio"])
+    return None
+
+def run_job_transcription(job):
+    """Transcribe a job's decoded audio and return the result.
+
+    Streaming jobs publish each segment on the job as soon as it is decoded.
+    Batch jobs are transcribed the same way, window by window, so that they
+    give up the Whisper lane between windows and more urgent jobs can run
+    in between.
+    """
+    audio, speech_map, vad_report = job["prepared"]
+    job["prepared"] = None
+    if job["stream"] or job["priority"] == "batch":
+        lang_code = None
+        details = {"vad": vad_report} if vad_report else {}
+        for segment in iter_audio_segments(audio, speech_map, details):
+            lang_code = segment["language"]
+            with jobs_changed:
+                job["segments"].append(segment)
+                jobs_changed.notify_all()
+            run_more_urgent_jobs(PRIORITY_CLASSES.index(job["priority"]))
+        transcribed_text = " ".join(segment["text"] for segment in job["segments"])
+    else:
+        transcribed_text, lang_code, details = transcribe_prepared(audio, speech_map, vad_report)
+    trace_note(language=lang_code)
+    result = {"transcription": transcribed_text, "source_lang_code": lang_code}
+    result.update(details)
+    transcription_cache.put(job["cache_key"], result)
+    return result
+
+def finish_job(job, result, error):
+    timings = log_trace(job["trace"], "job", job_id=job["id"][:8], status="done" if error is None else "failed")
+    with jobs_changed:
+        job["timings"] = timings
+        job["finished_at"] = time.time()
+        if job["started_at"] is None:
+            job["started_at"] = job["finished_at"]   # Answered from the cache, or failed to decode
+        job["status"] = "done" if error is None else "failed"
+        job["result"] = result
+        job["error"] = error
+        wall_time = job["finished_at"] - job["started_at"]
+        queue_wait = job["started_at"] - job["submitted_at"]
+        job_stats["completed" if error is None else "failed"] += 1
+        job_stats["total_wall_time"] += wall_time
+        job_stats["total_queue_wait"] += queue_wait
+        job_stats["last_wall_time"] = round(wall_time, 3)
+        job_stats["last_queue_wait"] = round(queue_wait, 3)
+        jobs_finished.inc(status=job["status"])
+        job_queue_wait.observe(queue_wait)
+        depth = sum(1 for other in jobs.values() if other["status"] == "queued")
+        jobs_changed.notify_all()
+    print(f"Job {job['id'][:8]} {job['status']} in {wall_time:.2f}s "
+          f"(queued {queue_wait:.2f}s, queue depth {depth})")
+
+def next_job_to_decode():
+    """Take the most urgent queued job whose class has a free prefetch slot, waiting for one.
+
+    Caller holds jobs_changed.
+    """
+    while True:
+        ready = [entry for entry in job_queue if prefetched[PRIORITY_CLASSES[entry[0]]] < JOB_PREFETCH]
+        if ready:
+            entry = min(ready)
+            job_queue.remove(entry)
+            prefetched[PRIORITY_CLASSES[entry[0]]] += 1
+            return entry
+        jobs_changed.wait()
+
+def take_decoded_job(more_urgent_than=None):
+    """Take the most urgent decoded job, or None if there is none (ranked below more_urgent_than).
+
+    Caller holds jobs_changed.
+    """
+    if not decoded_jobs:
+        return None
+    entry = min(decoded_jobs)
+    if more_urgent_than is not None and entry[0] >= more_urgent_than:
+        return None
+    decoded_jobs.remove(entry)
+    prefetched[PRIORITY_CLASSES[entry[0]]] -= 1
+    jobs_changed.notify_all()
+    return entry
+
+def job_decoder():
+    while True:
+        with jobs_changed:
+            rank, sequence, job_id = next_job_to_decode()
+            job = jobs.get(job_id)
+            if job is None:
+                prefetched[PRIORITY_CLASSES[rank]] -= 1
+                continue
+        # The job stays "queued" until it reaches Whisper (run_decoded_job)
+        trace = job["trace"]
+        trace["stages"]["queue_wait"] = time.time() - job["submitted_at"]
+        current_trace.set(trace)
+        current_priority.set(job["priority"])
+        cached, error = None, None
+        try:
+            cached = prepare_job(job)
+        except Exception as e:
+            print(f"Transcription error (job {job_id[:8]}): {e}")  # Full details stay server-side only
+            error = "Transcription failed. Please try again."
+        finally:
+            current_trace.set(None)
+            discard_upload(job["audio"])
+            job["audio"] = None   # Only the decoded audio is needed from here on
+        with jobs_changed:
+            if error is None and cached is None:
+                decoded_jobs.append((rank, sequence, job_id, time.perf_counter()))
+            else:
+                prefetched[job["priority"]] -= 1
+            jobs_changed.notify_all()
+        if error is not None or cached is not None:
+            finish_job(job, cached, error)
+
+def run_decoded_job(rank, sequence, job_id, decoded_at):
+    with jobs_changed:
+        job = jobs[job_id]
+        job["status"] = "running"
+        job["started_at"] = time.time()
+        jobs_changed.notify_all()
+    trace = job["trace"]
+    trace["stages"]["prefetch_wait"] = time.perf_counter() - decoded_at
+    trace_token = current_trace.set(trace)
+    priority_token = current_priority.set(job["priority"])
+    result, error = None, None
+    try:
+        result = run_job_transcription(job)
+    except Exception as e:
+        print(f"Transcription error (job {job_id[:8]}): {e}")  # Full details stay server-side only
+        error = "Transcription failed. Please try again."
+    finally:
+        # Also restores the batch job's context when this one ran in between its windows
+        current_trace.reset(trace_token)
+        current_priority.reset(priority_token)
+    finish_job(job, result, error)
+
+def run_more_urgent_jobs(rank):
+    """Run decoded jobs ranked ahead of rank to completion, e.g. between windows of a batch job."""
+    while True:
+        with jobs_changed:
+            entry = take_decoded_job(more_urgent_than=rank)
+        if entry is None:
+            return
+        run_decoded_job(*entry)
+
+def job_worker():
+    while True:
+        with jobs_changed:
+            entry = take_decoded_job()
+            while entry is None:
+                jobs_changed.wait()
+                entry = take_decoded_job()
+        run_decoded_job(*entry)
+
+def start_job_workers():
+    for i in range(JOB_DECODE_WORKERS):
+        threading.Thread(target=job_decoder, name=f"job-decoder-{i}", daemon=True).start()
+    for i in range(JOB_WORKERS):
+        threading.Thread(target=job_worker, name=f"job-worker-{i}", daemon=True).start()
+
+# --- Live Dictation Sessions ---
+# While the user is still recording, the browser uploads a MediaRecorder chunk
+# every few seconds. Each upload re-transcribes only the audio after the last
+# committed segment. Segments that end well before the live edge are
+# committed, and the rest is returned as tentative text. When the user
+# presses stop, only the last few seconds are left to decode.
+#
+# Each session has its own ffmpeg process (StreamingDecoder) that decodes the
+# chunks as they arrive, so a chunk costs the same late in a long recording
+# as early on. The raw bytes are kept too: if that process fails, the
+# session falls back to decoding the whole recording at once.
+DICTATION_COMMIT_LAG_SECONDS = 4      # Segments ending this close to the live edge stay tentative
+DICTATION_MAX_WINDOW_SECONDS = 25     # Force a commit before the pending audio outgrows one Whisper window
+DICTATION_MIN_NEW_AUDIO_SECONDS = 1   # Skip re-transcribing when less than this has arrived
+DICTATION_MAX_BYTES = 100 * 1024 * 1024
+DICTATION_SESSION_TIMEOUT = 30 * 60
+
+dictation_sessions = {}
+dictation_lock = threading.Lock()   # Guards dictation_sessions; each session has its own "lock"
+
+def create_dictation_session():
+    session_id = uuid.uuid4().hex
+    now = time.time()
+    with dictation_lock:
+        expired = [sid for sid, session in dictation_sessions.items()
+                   if session["updated_at"] < now - DICTATION_SESSION_TIMEOUT]
+        expired_sessions = [dictation_sessions.pop(sid) for sid in expired]
+        dictation_sessions[session_id] = {
+            "buffer": bytearray(),
+            "decoder": None,   # StreamingDecoder, started by the first chunk
+            "lock": threading.Lock(),       # Guards buffer, decoder and closed
+            "closed": False,
+            "work_lock": threading.Lock(),
+            "committed_samples": 0,
+            "transcribed_samples": 0,
+            "committed_segments": [],
+            "tentative_text": "",
+            "language": None,
+            "updated_at": now,
+        }
+    for session in expired_sessions:
+        close_dictation_session(session)
+    return session_id
+
+def add_dictation_chunk(session, data):
+    """Append a chunk to the session's recording and start decoding it."""
+    with session["lock"]:
+        if session["closed"]:
+            return   # Arrived after stop was pressed
+        session["buffer"].extend(data)
+        session["updated_at"] = time.time()
+        try:
+            if session["decoder"] is None and len(session["buffer"]) == len(data):
+                session["decoder"] = StreamingDecoder()
+            if session["decoder"] is not None:
+                session["decoder"].feed(data)
+        except (OSError, RuntimeError) as e:
+            print(f"Live decoding failed, decoding the whole recording instead: {e}")
+            drop_dictation_decoder(session)
+
+def drop_dictation_decoder(session):
+    """Stop the session's streaming decoder. Caller holds session['lock']."""
+    if session["decoder"] is not None:
+        session["decoder"].close()
+        session["decoder"] = None
+
+def close_dictation_session(session):
+    with session["lock"]:
+        session["closed"] = True
+        drop_dictation_decoder(session)
+        session["buffer"].clear()
+
+def dictation_audio(session, final):
+    """The session's audio so far; with final=True the recording has ended."""
+    with session["lock"]:
+        decoder = session["decoder"]
+        if decoder is not None:
+            try:
+                return decoder.finish() if final else decoder.audio()
+            except RuntimeError as e:
+                print(f"Live decoding failed, decoding the whole recording instead: {e}")
+                drop_dictation_decoder(session)
+        data = bytes(session["buffer"])
+    return load_audio(data)
+
+def dictation_partial(session):
+    committed = " ".join(session["committed_segments"])
+    return {
+        "committed": highlight_dictation_keywords(committed, session["language"]),
+        "tentative": highlight_dictation_keywords(session["tentative_text"], session["language"]),
+        "source_lang_code": session["language"],
+    }
+
+def update_dictation(session, final=False):
+    """Transcribe the uncommitted tail of the recording. Caller holds session['work_lock']."""
+    audio = dictation_audio(session, final)
+    if not final and (len(audio) - session["transcribed_samples"]) < DICTATION_MIN_NEW_AUDIO_SECONDS * SAMPLE_RATE:
+        return
+    audio_seconds.inc((len(audio) - session["transcribed_samples"]) / SAMPLE_RATE, source="dictation")
+    trace_note(audio_seconds=round(len(audio) / SAMPLE_RATE, 2))
+    session["transcribed_samples"] = len(audio)
+    pending = audio[session["committed_samples"]:]
+    pending_seconds = len(pending) / SAMPLE_RATE
+    if pending_seconds < 0.1:
+        session["tentative_text"] = ""
+        return
+    # Nothing but silence since the last commit: don't let Whisper invent
+    # text for it, and move the commit point past it.
+    if VAD_ENABLED and not detect_speech_regions(pending):
+        session["tentative_text"] = ""
+        if not final and pending_seconds > DICTATION_COMMIT_LAG_SECONDS:
+            session["committed_samples"] += len(pending) - DICTATION_COMMIT_LAG_SECONDS * SAMPLE_RATE
+        return
+    result = whisper_transcribe(
+        pending,
+        language=session["language"],
+        initial_prompt=" ".join(session["committed_segments"])[-500:] or None,
+    )
+    session["language"] = session["language"] or result['language']
+    segments = [s for s in (result.get('segments') or []) if s['text'].strip()]
+
+    if final:
+        stable = segments
+    else:
+        stable = [s for s in segments if s['end'] <= pending_seconds - DICTATION_COMMIT_LAG_SECONDS]
+        if not stable and pending_seconds > DICTATION_MAX_WINDOW_SECONDS and len(segments) > 1:
+            stable = segments[:-1]
+    if stable:
+        session["committed_segments"].extend(s['text'].strip() for s in stable)
+        session["committed_samples"] += int(stable[-1]['end'] * SAMPLE_RATE)
+    session["tentative_text"] = " ".join(s['text'].strip() for s in segments[len(stable):])
+
+# --- Translation ---
+TRANSLATION_SAMPLER_SETTINGS = {"temp": 0.0}
+# Repeat translations (a second click, or a standard phrase translated into
+# the same language across notes) are served from this cache. See the
+# Result Cache section for the available modes.
+TRANSLATION_CACHE_MODE = "memory"
+TRANSLATION_CACHE_MAX_BYTES = 16 * 1024 * 1024
+
+translation_cache = ResultCache("translations", TRANSLATION_CACHE_MODE, TRANSLATION_CACHE_MAX_BYTES)
+
+# The fixed instructions come first so that every request shares the same
+# token prefix, whose prefilled KV state is kept in TRANSLATION_PROMPT_CACHE.
+TRANSLATION_PROMPT_CACHE = True
+
+prefix_cache = {"tokens": None, "cache": None}
+prefix_cache_lock = threading.Lock()
+
+# Aya uses a simple prompt format. The template is part of the translation
+# cache key, so editing it retires translations cached with the old wording.
+TRANSLATION_PROMPT_TEMPLATE = """
+Output your response as json with the following keys: translation
+
+Please translate this text into {target_lang}: {text_to_translate}
+
+"""
+
+@stage("prompt_build")
+def build_translation_prompt(text_to_translate, target_lang):
+    _, tokenizer = translation_model.get()
+    prompt = TRANSLATION_PROMPT_TEMPLATE.format(target_lang=target_lang, text_to_translate=text_to_translate)
+
+    if tokenizer.chat_template is not None:
+        messages = [{"role": "user", "content": prompt}]
+        prompt = tokenizer.apply_chat_template(
+            messages, add_generation_prompt=True
+        )
+    return prompt
+
+@stage("json_extraction")
+def extract_translation(response_text):
+    """Pull the translation out of the model's JSON answer."""
+    # FIX: .split('```json')[1].split('```') returns a list, not a string.
+    # Use indexing to get the content between the fences.
+    if '```json' in response_text:
+        response_text = response_text.split('```json')[1].split('```')[0]
+
+    response_text = response_text.strip()
+
+    # Try to parse the cleaned text as JSON
+    try:
+        parsed_json = json.loads(response_text)
+        translation = parsed_json.get('translation', 'Error: "translation" key not found in model response.')
+    except json.JSONDecodeError:
+        # If it's not valid JSON, use the raw response as a fallback
+        translation = response_text
+    return translation.strip()
+
+def common_prefix(a, b):
+    n = 0
+    for x, y in zip(a, b):
+        if x != y:
+            break
+        n += 1
+    return a[:n]
+
+def build_prefix_cache():
+    """Prefill the KV cache with the token prefix shared by every translation prompt.
+
+    The prefix is found by rendering two prompts that differ in every variable
+    part and keeping their common tokens, so the chat template's header and
+    any default system preamble are included. Caller holds prefix_cache_lock.
+    """
+    model, tokenizer = translation_model.get()
+    first = build_translation_prompt("a", "Xhosa")
+    second = build_translation_prompt("b", "Yoruba")
+    if isinstance(first, str):
+        first, second = tokenizer.encode(first), tokenizer.encode(second)
+    prefix = list(common_prefix(first, second))
+    prefix_cache["tokens"] = prefix
+    prefix_cache["cache"] = engine.prefill_prompt_cache(model, prefix)
+    print(f"Translation prompt cache: prefilled {len(prefix)} shared prefix tokens")
+
+@contextmanager
+def translation_generation_args(prompt):
+    """Yield (prompt, extra generate kwargs), reusing the prefilled instruction prefix when possible.
+
+    The shared cache is used by one generation at a time. Afterwards it is
+    trimmed back to the prefix; if it can no longer be trimmed (e.g. a
+    rotating window filled up), it is rebuilt on next use.
+    """
+    _, tokenizer = translation_model.get()
+    if not (TRANSLATION_PROMPT_CACHE and engine.supports_prompt_cache):
+        yield prompt, {}
+        return
+    tokens = tokenizer.encode(prompt) if isinstance(prompt, str) else list(prompt)
+    with prefix_cache_lock:
+        if prefix_cache["cache"] is None:
+            build_prefix_cache()
+        prefix = prefix_cache["tokens"]
+        cache = prefix_cache["cache"]
+        if not prefix or tokens[:len(prefix)] != prefix or len(tokens) == len(prefix):
+            yield tokens, {}
+            return
+        try:
+            yield tokens[len(prefix):], {"prompt_cache": cache}
+        finally:
+            if not engine.trim_prompt_cache(cache, len(prefix)):
+                prefix_cache["cache"] = None
+
+def prefix_seeded_prompt(tokenizer, prompt):
+    """Return (tokens, cache) for one decode loop sequence.
+
+    When the prompt starts with the prefilled instruction prefix, tokens is
+    the rest of it and cache a copy of the prefix cache; otherwise the whole
+    prompt and None.
+    """
+    tokens = tokenizer.encode(prompt) if isinstance(prompt, str) else list(prompt)
+    if not (TRANSLATION_PROMPT_CACHE and engine.supports_prompt_cache):
+        return tokens, None
+    with prefix_cache_lock:
+        if prefix_cache["cache"] is None:
+            build_prefix_cache()
+        prefix = prefix_cache["tokens"]
+        if not prefix or tokens[:len(prefix)] != prefix or len(tokens) == len(prefix):
+            return tokens, None
+        return tokens[len(prefix):], engine.copy_prompt_cache(prefix_cache["cache"])
+
+def translation_cache_key(text_to_translate, target_lang):
+    """Hash of the whitespace-normalized text, target language, model, prompt and sampler settings."""
+    key = {
+        "text": " ".join((text_to_translate or "").split()),
+        "language": target_lang,
+        "model": TRANSLATION_MODEL_PATH,
+        "prompt": TRANSLATION_PROMPT_TEMPLATE,
+        "sampler": TRANSLATION_SAMPLER_SETTINGS,
+    }
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode("utf-8")).hexdigest()
+
+def lookup_translation(cache_key):
+    cached = translation_cache.get(cache_key)
+    trace_note(cache="hit" if cached else "miss")
+    stats = translation_cache.stats()
+    print(f"Translation cache {'hit' if cached else 'miss'} "
+          f"(hit rate {stats['hit_rate'] or 0:.0%}, {stats['entries']} entries)")
+    return cached["translation"] if cached is not None else None
+
+def run_translation(text_to_translate, target_lang):
+    cache_key = translation_cache_key(text_to_translate, target_lang)
+    cached = lookup_translation(cache_key)
+    if cached is not None:
+        return cached
+
+    chunks, layout = split_for_translation(text_to_translate)
+    if len(chunks) > 1 or continuous_batching_enabled():
+        responses = generate_batch(
+            [build_translation_prompt(chunk, target_lang) for chunk in chunks],
+            [translation_max_tokens(chunk) for chunk in chunks],
+        )
+        translation = assemble_translation(layout, [extract_translation(r) for r in responses])
     else:
-        return text, language_code
+        prompt = build_translation_prompt(text_to_translate, target_lang)
+        sampler = engine.make_sampler(**TRANSLATION_SAMPLER_SETTINGS)
+        with translation_model.use() as (model, tokenizer), \
+                translation_generation_args(prompt) as (prompt, extra_args):
+            steps = engine.stream_generate(model, tokenizer, prompt=prompt, sampler=sampler,
+                                           max_tokens=translation_max_tokens(text_to_translate), **extra_args)
+            response_text = "".join(step.text for step in timed_generation(steps))
+        translation = extract_translation(response_text)
+    translation_cache.put(cache_key, {"translation": translation})
+    return translation
+
+def run_translations(text_to_translate, target_langs):
+    """Translate one text into several languages in a single batched decode.
+
+    The text is chunked once, and every (language, chunk) prompt is decoded
+    together. Returns {language: {"translation", "seconds", "tokens",
+    "cached"}}, where seconds is when that language's last chunk finished.
+    """
+    _, tokenizer = translation_model.get()
+    started = time.time()
+    results = {}
+    pending = []
+    for lang in target_langs:
+        cache_key = translation_cache_key(text_to_translate, lang)
+        cached = lookup_translation(cache_key)
+        if cached is not None:
+            results[lang] = {"translation": cached, "seconds": 0.0, "tokens": 0, "cached": True}
+        else:
+            pending.append((lang, cache_key))
+    if not pending:
+        return results
+
+    chunks, layout = split_for_translation(text_to_translate)
+    prompts, max_tokens, owners = [], [], []
+    for lang, _ in pending:
+        for chunk in chunks:
+            prompts.append(build_translation_prompt(chunk, lang))
+            max_tokens.append(translation_max_tokens(chunk))
+            owners.append(lang)
+    tokens = [[] for _ in prompts]
+    finished_at = {}
+    for index, token, finish_reason in iter_batch_tokens(prompts, max_tokens):
+        if token is not None and finish_reason != "stop":
+            tokens[index].append(token)
+        if finish_reason is not None:
+            finished_at[index] = time.time()
+
+    for lang, cache_key in pending:
+        indices = [i for i, owner in enumerate(owners) if owner == lang]
+        translation = assemble_translation(
+            layout, [extract_translation(tokenizer.decode(tokens[i])) for i in indices])
+        translation_cache.put(cache_key, {"translation": translation})
+        results[lang] = {
+            "translation": translation,
+            "seconds": round(max(finished_at.get(i, time.time()) for i in indices) - started, 3),
+            "tokens": sum(len(tokens[i]) for i in indices),
+            "cached": False,
+        }
+        print(f"Fan-out translation: {lang} done in {results[lang]['seconds']:.2f}s "
+              f"({results[lang]['tokens']} tokens)")
+    return results
+
+JSON_ESCAPES = {'"': '"', '\\': '\\', '/': '/', 'n': '\n', 't': '\t', 'r': '\r', 'b': '\b', 'f': '\f'}
+
+def partial_translation(response_text):
+    """Best-effort view of the "translation" value while the JSON answer is still being generated."""
+    match = re.search(r'"translation"\s*:\s*"', response_text)
+    if match is None:
+        return ""
+    chars = []
+    i = match.end()
+    while i < len(response_text):
+        ch = response_text[i]
+        if ch == '"':
+            break
+        if ch == '\\':
+            if i + 1 >= len(response_text):
+                break
+            escaped = response_text[i + 1]
+            if escaped == 'u':
+                code = response_text[i + 2:i + 6]
+                if len(code) < 4:
+                    break
+                try:
+                    chars.append(chr(int(code, 16)))
+                except ValueError:
+                    pass
+                i += 6
+                continue
+            chars.append(JSON_ESCAPES.get(escaped, escaped))
+            i += 2
+            continue
+        chars.append(ch)
+        i += 1
+    return "".join(chars)
+
+def stream_translation(text_to_translate, target_lang):
+    """Yield {"type": "token", ...} events while generating, then one {"type": "done", ...}.
+
+    Token events carry the raw text piece and a preview of the translation
+    parsed so far. The done event carries the cleaned translation from
+    extract_translation().
+    """
+    _, tokenizer = translation_model.get()
+    cache_key = translation_cache_key(text_to_translate, target_lang)
+    cached = lookup_translation(cache_key)
+    if cached is not None:
+        yield {"type": "done", "translation": cached}
+        return
+
+    chunks, layout = split_for_translation(text_to_translate)
+    if len(chunks) > 1 or continuous_batching_enabled():
+        # Long text: chunks are decoded together, so the preview is rebuilt
+        # from every chunk's partial answer every few decode steps. A single
+        # chunk in the shared decode loop gets a preview every token.
+        tokens = [[] for _ in chunks]
+        preview_every = TRANSLATION_PREVIEW_EVERY * len(chunks) if len(chunks) > 1 else 1
+        steps = 0
+        batch = iter_batch_tokens(
+            [build_translation_prompt(chunk, target_lang) for chunk in chunks],
+            [translation_max_tokens(chunk) for chunk in chunks],
+        )
+        for index, token, finish_reason in batch:
+            if token is not None and finish_reason != "stop":
+                tokens[index].append(token)
+            steps += 1
+            if steps % preview_every == 0:
+                previews = [partial_translation(tokenizer.decode(t)) for t in tokens]
+                yield {"type": "token", "preview": assemble_translation(layout, previews)}
+        translation = assemble_translation(
+            layout, [extract_translation(tokenizer.decode(t)) for t in tokens])
+    else:
+        prompt = build_translation_prompt(text_to_translate, target_lang)
+        sampler = engine.make_sampler(**TRANSLATION_SAMPLER_SETTINGS)
+        response_text = ""
+        with translation_model.use() as (model, tokenizer), \
+                translation_generation_args(prompt) as (prompt, extra_args):
+            steps = engine.stream_generate(model, tokenizer, prompt=prompt, sampler=sampler,
+                                           max_tokens=translation_max_tokens(text_to_translate), **extra_args)
+            for response in timed_generation(steps):
+                response_text += response.text
+                yield {"type": "token", "text": response.text, "preview": partial_translation(response_text)}
+        translation = extract_translation(response_text)
+    translation_cache.put(cache_key, {"translation": translation})
+    yield {"type": "done", "translation": translation}
+
+# --- Long-Text Translation ---
+# Long transcripts are split into chunks of whole sentences that are
+# translated side by side in one batch, then put back in order. Each chunk
+# gets a max_tokens budget sized from its own length, so nothing is cut off.
+TRANSLATION_CHUNK_TOKENS = 200          # Source tokens per chunk
+TRANSLATION_MAX_TOKENS_RATIO = 3.0      # Output budget per source token (some scripts need far more tokens)
+TRANSLATION_MAX_TOKENS_OVERHEAD = 48    # Room for the JSON wrapper and code fences
+TRANSLATION_BATCH_SIZE = 8              # Chunks decoded at once
+TRANSLATION_PREVIEW_EVERY = 8           # Decode steps between streamed previews
+
+SENTENCE_END = re.compile(r'(?<=[.!?。！？।])\s+')
+PARAGRAPH_BREAK = re.compile(r'(\n\s*\n|\n)')
+
+def translation_max_tokens(text):
+    _, tokenizer = translation_model.get()
+    return int(len(tokenizer.encode(text)) * TRANSLATION_MAX_TOKENS_RATIO) + TRANSLATION_MAX_TOKENS_OVERHEAD
+
+def split_for_translation(text):
+    """Split text into sentence-aligned chunks of at most TRANSLATION_CHUNK_TOKENS.
+
+    Returns (chunks, layout). layout is a list of (chunk_indices, separator),
+    one per paragraph; assemble_translation() uses it to rebuild the text.
+    """
+    _, tokenizer = translation_model.get()
+    pieces = PARAGRAPH_BREAK.split(text.strip())
+    chunks, layout = [], []
+    for i in range(0, len(pieces), 2):
+        paragraph = pieces[i].strip()
+        separator = pieces[i + 1] if i + 1 < len(pieces) else ""
+        indices = []
+        current, current_tokens = [], 0
+        for sentence in SENTENCE_END.split(paragraph):
+            if not sentence:
+                continue
+            sentence_tokens = len(tokenizer.encode(sentence))
+            if current and current_tokens + sentence_tokens > TRANSLATION_CHUNK_TOKENS:
+                indices.append(len(chunks))
+                chunks.append(" ".join(current))
+                current, current_tokens = [], 0
+            current.append(sentence)
+            current_tokens += sentence_tokens
+        if current:
+            indices.append(len(chunks))
+            chunks.append(" ".join(current))
+        layout.append((indices, separator))
+    return chunks, layout
+
+def assemble_translation(layout, translated_chunks):
+    parts = []
+    for indices, separator in layout:
+        parts.append(" ".join(translated_chunks[i] for i in indices if translated_chunks[i]))
+        parts.append(separator)
+    return "".join(parts).strip()
+
+def iter_batch_tokens(prompts, max_tokens):
+    """Decode several prompts together, yielding (prompt_index, token, finish_reason).
+
+    A token is only part of the output when it is not None and
+    finish_reason is not "stop" (that token is the end-of-sequence marker).
+    With continuous batching the prompts join the shared decode loop,
+    alongside other requests.
+    """
+    if continuous_batching_enabled():
+        yield from timed_generation(decode_loop.decode(prompts, max_tokens))
+        return
+    with translation_model.use() as (model, tokenizer):
+        yield from timed_generation(decode_batch(model, tokenizer, prompts, max_tokens))
+
+def decode_batch(model, tokenizer, prompts, max_tokens):
+    """Uses the engine's batch generator when it has one, otherwise decodes the prompts one after another."""
+    sampler = engine.make_sampler(**TRANSLATION_SAMPLER_SETTINGS)
+    prompts = [tokenizer.encode(p) if isinstance(p, str) else list(p) for p in prompts]
+    generator = engine.batch_generator(model, tokenizer, sampler, TRANSLATION_BATCH_SIZE)
+    if generator is None:
+        for index, prompt in enumerate(prompts):
+            for response in engine.stream_generate(model, tokenizer, prompt=prompt, sampler=sampler,
+                                                   max_tokens=max_tokens[index]):
+                # The final response of a "stop" repeats the end-of-sequence
+                # token; only a "length" finish carries a real last token.
+                if response.finish_reason == "stop":
+                    yield index, None, "stop"
+                else:
+                    yield index, response.token, response.finish_reason
+        return
+    uids = generator.insert(prompts, max_tokens)
+    index_of = {uid: index for index, uid in enumerate(uids)}
+    while responses := generator.next():
+        for response in responses:
+            if response.finish_reason == "length":
+                print(f"Warning: translation chunk {index_of[response.uid] + 1} reached its token budget")
+            yield index_of[response.uid], response.token, response.finish_reason
+
+def generate_batch(prompts, max_tokens):
+    """Decode several prompts together and return their texts in order."""
+    _, tokenizer = translation_model.get()
+    started = time.time()
+    tokens = [[] for _ in prompts]
+    for index, token, finish_reason in iter_batch_tokens(prompts, max_tokens):
+        if token is not None and finish_reason != "stop":
+            tokens[index].append(token)
+    generated = sum(len(t) for t in tokens)
+    elapsed = time.time() - started
+    print(f"Batch translation: {len(prompts)} chunks, {generated} tokens in {elapsed:.2f}s "
+          f"({generated / elapsed if elapsed else 0:.1f} tok/s)")
+    return [tokenizer.decode(t) for t in tokens]
+
+# --- Continuous Batching ---
+# With several users translating at once, one decode loop serves them all.
+# A background thread owns the engine's batch generator: between decode
+# steps it admits new sequences (a short request, or the chunks of a long
+# one) and retires each sequence as it finishes, so the model decodes up to
+# TRANSLATION_DECODE_SLOTS sequences per step and a short request never
+# waits for a long one to end. A free slot goes to the request with the
+# fewest sequences already decoding, and no one request may take the last
+# TRANSLATION_RESERVED_SLOTS, so a request arriving while a long text is
+# being translated starts on the next step. The loop holds the translation
+# lane only while it has work, and under memory pressure gives it up
+# between steps whenever a Whisper request of the same or a more urgent
+# class is waiting; its sequences carry on after that turn.
+#
+# Each sequence joins the loop with its own copy of the prefilled shared
+# prefix (TRANSLATION_PROMPT_CACHE), so only the text after it is prefilled.
+# Per-request tokens/sec is in each trace; the loop's aggregate rate is in
+# /scheduler/stats and /metrics.
+TRANSLATION_CONTINUOUS_BATCHING = True
+TRANSLATION_DECODE_SLOTS = 16           # Sequences decoded per step
+TRANSLATION_RESERVED_SLOTS = 2          # Slots one request cannot fill, kept for requests arriving meanwhile
+TRANSLATION_RATE_WINDOW_SECONDS = 10    # The aggregate tokens/sec covers this much recent decoding
+
+def continuous_batching_enabled():
+    return TRANSLATION_CONTINUOUS_BATCHING and engine.supports_batch_generation
+
+class DecodeLoop:
+    """The shared continuous-batching decode loop for the translation model."""
+
+    def __init__(self):
+        self.changed = threading.Condition()
+        self.submitted = []   # Sequences waiting to join the loop
+        self.active = {}      # Batch generator uid -> sequence
+        self.generator = None   # Kept while sequences are decoding, including across lane turns
+        self.generator_model = None
+        self.thread = None
+        self.steps = 0
+        self.tokens = 0
+        self.yields = 0
+        self.recent = deque()   # (finished at, seconds, tokens) per step, within the rate window
+        self.request_rates = deque(maxlen=PRIORITY_LATENCY_WINDOW)   # Tokens/sec of recent requests
+
+    def decode(self, prompts, max_tokens):
+        """Yield (prompt_index, token, finish_reason) as the loop decodes the prompts."""
+        events = queue.Queue()
+        sequences = [{"index": index, "prompt": prompt, "max_tokens": limit, "events": events, "cancelled": False}
+                     for index, (prompt, limit) in enumerate(zip(prompts, max_tokens))]
+        with self.changed:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name="translation-decode-loop", daemon=True)
+                self.thread.start()
+            self.submitted.extend(sequences)
+            self.changed.notify_all()
+        remaining = len(sequences)
+        started = time.perf_counter()
+        generated = 0
+        try:
+            while remaining:
+                index, token, finish_reason, error = events.get()
+                if error is not None:
+                    raise error
+                if finish_reason is not None:
+                    remaining -= 1
+                if token is not None and finish_reason != "stop":
+                    generated += 1
+                yield index, token, finish_reason
+        finally:
+            if remaining:   # The caller stopped early, e.g. the client disconnected
+                for sequence in sequences:
+                    sequence["cancelled"] = True
+            elif generated:
+                with self.changed:
+                    self.request_rates.append(generated / (time.perf_counter() - started))
+
+    def run(self):
+        while True:
+            with self.changed:
+                while not self.submitted and not self.active:
+                    self.changed.wait()
+            try:
+                with translation_model.use() as (model, tokenizer):
+                    self.serve(model, tokenizer)
+            except Exception as e:
+                print(f"Translation decode loop error: {e}")  # Each waiting request reports its own failure
+                with self.changed:
+                    failed = self.submitted + list(self.active.values())
+                    self.submitted, self.active = [], {}
+                    self.generator = self.generator_model = None
+                for sequence in failed:
+                    sequence["events"].put((sequence["index"], None, None, e))
+
+    def insert(self, generator, tokenizer, new):
+        """Add sequences to the batch and return their uids, in order.
+
+        Sequences seeded with the prefix cache and those starting from an
+        empty cache go in separate insert() calls, since one call takes a
+        cache for every prompt or for none.
+        """
+        seeded = [prefix_seeded_prompt(tokenizer, s["prompt"]) for s in new]
+        uids = [None] * len(new)
+        for with_cache in (True, False):
+            group = [i for i, (_, cache) in enumerate(seeded) if (cache is not None) == with_cache]
+            if not group:
+                continue
+            extra = {"caches": [seeded[i][1] for i in group]} if with_cache else {}
+            group_uids = generator.insert([seeded[i][0] for i in group], [new[i]["max_tokens"] for i in group],
+                                          **extra)
+            for i, uid in zip(group, group_uids):
+                uids[i] = uid
+        return uids
+
+    def serve(self, model, tokenizer):
+        """Decode until no sequence is left, or a more urgent lane needs the memory.
+
+        Runs on the loop thread, holding the translation lane.
+        """
+        if self.generator_model is not model:
+            if self.active:
+                raise RuntimeError("translation model was reloaded while sequences were decoding")
+            sampler = engine.make_sampler(**TRANSLATION_SAMPLER_SETTINGS)
+            self.generator = engine.batch_generator(model, tokenizer, sampler, TRANSLATION_DECODE_SLOTS)
+            self.generator_model = model
+        generator = self.generator
+        rank = PRIORITY_CLASSES.index(current_priority.get())
+        while True:
+            with self.changed:
+                if not self.submitted and not self.active:
+                    self.generator = self.generator_model = None   # Frees the batch's KV cache
+                    return
+            with scheduler_changed:
+                if translation_model.lane.should_yield(rank):
+                    self.yields += 1
+                    return   # run() takes a new turn, behind the waiting request
+            with self.changed:
+                new = self.admit(TRANSLATION_DECODE_SLOTS - len(self.active))
+            if new:
+                try:
+                    uids = self.insert(generator, tokenizer, new)
+                except Exception:
+                    with self.changed:
+                        self.submitted[:0] = new   # Failed with the rest by run()
+                    raise
+                with self.changed:
+                    self.active.update(zip(uids, new))
+            started = time.perf_counter()
+            responses = generator.next()
+            finished = time.perf_counter()
+            cancelled = []
+            with self.changed:
+                for response in responses:
+                    sequence = self.active.get(response.uid)
+                    if sequence is None:
+                        continue
+                    if sequence["cancelled"]:
+                        cancelled.append(response.uid)
+                        del self.active[response.uid]
+                        continue
+                    if response.finish_reason is not None:
+                        del self.active[response.uid]
+                        if response.finish_reason == "length":
+                            print(f"Warning: translation chunk {sequence['index'] + 1} reached its token budget")
+                    sequence["events"].put((sequence["index"], response.token, response.finish_reason, None))
+                produced = sum(1 for response in responses if response.finish_reason != "stop")
+                self.steps += 1
+                self.tokens += produced
+                self.recent.append((finished, finished - started, produced))
+                while self.recent and self.recent[0][0] < finished - TRANSLATION_RATE_WINDOW_SECONDS:
+                    self.recent.popleft()
+            if cancelled and hasattr(generator, "remove"):
+                generator.remove(cancelled)
+
+    def admit(self, free_slots):
+        """Take up to free_slots submitted sequences, fewest already decoding per request first.
+
+        Caller holds self.changed.
+        """
+        self.submitted = [s for s in self.submitted if not s["cancelled"]]
+        per_request = max(1, TRANSLATION_DECODE_SLOTS - TRANSLATION_RESERVED_SLOTS)
+        decoding = {}   # Request (its events queue) -> sequences decoding
+        for sequence in self.active.values():
+            decoding[id(sequence["events"])] = decoding.get(id(sequence["events"]), 0) + 1
+        admitted = []
+        while len(admitted) < free_slots:
+            waiting = [i for i, s in enumerate(self.submitted) if decoding.get(id(s["events"]), 0) < per_request]
+            if not waiting:
+                break
+            position = min(waiting, key=lambda i: decoding.get(id(self.submitted[i]["events"]), 0))
+            sequence = self.submitted.pop(position)
+            decoding[id(sequence["events"])] = decoding.get(id(sequence["events"]), 0) + 1
+            admitted.append(sequence)
+        return admitted
+
+    def aggregate_tokens_per_second(self):
+        """Tokens per second of decoding over the rate window; None when the loop has been idle."""
+        with self.changed:
+            seconds = sum(step[1] for step in self.recent)
+            return round(sum(step[2] for step in self.recent) / seconds, 1) if seconds else None
+
+    def status(self):
+        rate = self.aggregate_tokens_per_second()
+        with self.changed:
+            rates = sorted(self.request_rates)
+            return {
+                "enabled": continuous_batching_enabled(),
+                "slots": TRANSLATION_DECODE_SLOTS,
+                "active_sequences": len(self.active),
+                "waiting_sequences": len(self.submitted),
+                "steps": self.steps,
+                "tokens": self.tokens,
+                "lane_yields": self.yields,
+                "aggregate_tokens_per_second": rate,
+                "request_tokens_per_second_p50": round(rates[len(rates) // 2], 1) if rates else None,
+            }
+
+decode_loop = DecodeLoop()
 
 # --- Flask Application ---
 app = Flask(__name__)
@@ -133,6 +2804,84 @@ def add_security_headers(response):
     response.headers['Permissions-Policy'] = 'microphone=(self), camera=(), geolocation=(), payment=()'
     return response
 
+class InMemoryUploadRequest(Request):
+    """Keeps uploaded files in memory up to UPLOAD_SPILL_BYTES (Werkzeug's default spills at 500 KB).
+
+    Larger files spill to UPLOAD_DIR rather than the system temp folder.
+    """
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return UploadSpool(upload_suffix(filename))
+
+app.request_class = InMemoryUploadRequest
+
+def metrics_route():
+    return request.url_rule.rule if request.url_rule is not None else "unmatched"
+
+@app.before_request
+def track_request_start():
+    route = metrics_route()
+    requests_in_flight.inc(route=route)
+    g.priority_token = current_priority.set(ROUTE_PRIORITIES.get(route, "interactive"))
+    if route in TRACED_ROUTES:
+        g.trace = new_trace(route)
+        g.trace_token = current_trace.set(g.trace)
+
+@app.after_request
+def track_request_end(response):
+    route = metrics_route()
+    http_requests.inc(route=route, status=response.status_code)
+    if response.status_code >= 400:
+        http_errors.inc(route=route, status=response.status_code)
+    # Streams stay in flight until the client has received the whole body
+    response.call_on_close(lambda: requests_in_flight.dec(route=route))
+    if response.is_streamed:
+        # ...and keep their lane slots until then too, not just until teardown
+        admitted = g.pop("admitted_lanes", [])
+        response.call_on_close(lambda: [lane.release() for lane in admitted])
+    trace = g.get("trace")
+    if trace is not None:
+        response.headers["X-Request-ID"] = trace["request_id"]
+        # A stream logs its trace and sends its timings when it ends
+        if not response.is_streamed:
+            timings = log_trace(trace, "request", status=response.status_code)
+            response.headers["Server-Timing"] = server_timing_header(timings)
+    return response
+
+def requested_priority(default):
+    """The job priority asked for in the form ("interactive" or "batch"), else default.
+
+    Lets scripted uploads mark themselves as batch, and a one-file drop go
+    through the batch endpoint as interactive. "live" is kept for dictation.
+    """
+    priority = request.form.get("priority", default)
+    return priority if priority in ("interactive", "batch") else default
+
+def admit_request(lane):
+    """Admit the current request to a lane; it is counted out when the request ends.
+
+    A streamed response is counted out when its body has been sent.
+    """
+    lane.admit()
+    g.setdefault("admitted_lanes", []).append(lane)
+
+@app.errorhandler(ServerBusy)
+def server_busy(error):
+    response = jsonify({"error": "The server is busy. Please try again shortly."})
+    response.headers["Retry-After"] = str(error.retry_after)
+    return response, 429
+
+@app.teardown_request
+def reset_request_trace(error=None):
+    token = g.pop("trace_token", None)
+    if token is not None:
+        current_trace.reset(token)
+    token = g.pop("priority_token", None)
+    if token is not None:
+        current_priority.reset(token)
+    for lane in g.pop("admitted_lanes", []):
+        lane.release()
+
 def check_host(host_to_check):
     if host_to_check not in ("127.0.0.1", "localhost"):
         print(f"ERROR: Attempting to bind to a non-local host '{host_to_check}'. Aborting.")
@@ -268,6 +3017,11 @@ HTML_TEMPLATE = """
         .btn-small { padding: 0.5rem 1rem; font-size: 0.85rem; border-radius: 4px; border: 1px solid var(--border); background: white; cursor: pointer; display: flex; align-items: center; gap: 0.4rem; }
         .privacy-notice { font-size: 0.7rem; color: #6b7280; background: #111827; border: 1px solid #374151; border-radius: 4px; padding: 0.5rem 0.75rem; margin-top: 0.75rem; width: 100%; text-align: left; line-height: 1.4; }
         .privacy-notice strong { color: #9ca3af; display: block; margin-bottom: 0.2rem; }
+        #debug-panel { display: none; position: fixed; right: 1rem; bottom: 1rem; width: 360px; max-height: 50vh; overflow-y: auto; background: #111827; color: #d1d5db; border: 1px solid #374151; border-radius: 4px; padding: 0.75rem; font-size: 0.75rem; font-family: ui-monospace, monospace; z-index: 20; }
+        #debug-panel h3 { font-size: 0.75rem; text-transform: uppercase; color: #9ca3af; margin-bottom: 0.5rem; }
+        .debug-entry { border-top: 1px solid #374151; padding: 0.4rem 0; }
+        .debug-entry-title { color: white; font-weight: 600; white-space: nowrap; overflow: hidden; text-overflow: ellipsis; }
+        .debug-entry-id { color: #6b7280; }
     </style>
 </head>
 <body>
@@ -337,6 +3091,7 @@ HTML_TEMPLATE = """
         <div class="right-header">
             <span class="header-note">AI can make mistakes. Please double-check.</span>
             <div class="header-actions">
+                <button class="btn-small" onclick="toggleDebugPanel()">Timings</button>
                 <button class="btn-small" onclick="clearSession()">Reset Form</button>
             </div>
         </div>
@@ -345,6 +3100,11 @@ HTML_TEMPLATE = """
         </div>
     </main>
 
+    <div id="debug-panel">
+        <h3>Request timings (ms)</h3>
+        <div id="debug-entries">No requests yet.</div>
+    </div>
+
     <script>
         const micBtn = document.getElementById('micBtn');
         const dropZone = document.getElementById('drop-zone');
@@ -367,6 +3127,10 @@ HTML_TEMPLATE = """
         let mediaRecorder = null;
         let audioChunks = [];
         let audioBlob = null;
+        // Live dictation: chunks are uploaded every DICTATION_TIMESLICE_MS while recording
+        const DICTATION_TIMESLICE_MS = 3000;
+        let dictationSessionId = null;
+        let dictationUploads = Promise.resolve();
         // FIX: supportedLanguages is an array of plain strings (language names),
         // not objects with .language / .code properties.
         let supportedLanguages = [];
@@ -489,6 +3253,25 @@ HTML_TEMPLATE = """
             }
         });
 
+        // Models load in the background after startup; show their progress while idle
+        async function pollReadiness() {
+            try {
+                const data = await (await fetch('/ready')).json();
+                const idle = !isRecording && loader.style.display !== 'block';
+                if (data.ready) {
+                    if (statusText.innerText === 'Loading models...') statusText.innerText = 'Ready';
+                    return;
+                }
+                if (Object.values(data.models).some(m => m.state === 'failed')) {
+                    if (idle) statusText.innerText = 'A model failed to load. See the terminal window.';
+                    return;
+                }
+                if (idle) statusText.innerText = 'Loading models...';
+            } catch (e) { return; }
+            setTimeout(pollReadiness, 1000);
+        }
+        pollReadiness();
+
         function saveToSession() {
             const groups = document.querySelectorAll('.transcription-group');
             const dataToSave = Array.from(groups).map(group => {
@@ -516,19 +3299,107 @@ HTML_TEMPLATE = """
         window.addEventListener('drop', (e) => { e.preventDefault(); dropZone.classList.remove('drag-over'); handleFiles(e.dataTransfer.files); });
         fileInput.addEventListener('change', () => handleFiles(fileInput.files));
 
+        // Dropped files go to /transcribe_batch in as few requests as the server's upload limit allows.
+        // The server dedupes them, orders them by size and streams back each result as it finishes.
+        // Two requests are in flight so the next batch uploads while the current one is transcribed.
+        // A single dropped file is marked interactive so it goes ahead of other users' batches.
+        const BATCH_MAX_FILES = 50;
+        const BATCH_MAX_BYTES = 90 * 1024 * 1024;
+        const BATCH_CONCURRENCY = 2;
+
+        function splitIntoBatches(files) {
+            const batches = [];
+            let batch = [];
+            let batchBytes = 0;
+            for (const file of files) {
+                if (batch.length > 0 && (batch.length >= BATCH_MAX_FILES || batchBytes + file.size > BATCH_MAX_BYTES)) {
+                    batches.push(batch);
+                    batch = [];
+                    batchBytes = 0;
+                }
+                batch.push(file);
+                batchBytes += file.size;
+            }
+            if (batch.length > 0) batches.push(batch);
+            return batches;
+        }
+
+        async function transcribeBatch(files, priority, onFileDone) {
+            const items = files.map(file => {
+                const uniqueId = displayTranscription(file.name, '', file);
+                const textarea = document.getElementById(`textarea-${uniqueId}`);
+                textarea.placeholder = 'Transcribing...';
+                return { file, uniqueId, textarea, done: false };
+            });
+            const finish = (item, data) => {
+                item.done = true;
+                if (data.status === 'done') {
+                    item.textarea.value = data.transcription || 'Could not transcribe.';
+                    document.querySelector(`[data-id="${item.uniqueId}"]`).dataset.sourceLangCode = data.source_lang_code;
+                } else {
+                    item.textarea.value = 'ERROR: Transcription failed.';
+                }
+                item.textarea.placeholder = '';
+                onFileDone(item.file);
+            };
+            const formData = new FormData();
+            files.forEach(file => formData.append("audio_files", file, file.name));
+            formData.append("priority", priority);
+            const started = performance.now();
+            try {
+                const response = await fetchWithRetry("/transcribe_batch", {
+                    method: "POST",
+                    body: formData,
+                    headers: { "X-Requested-With": "MedicalApp" }
+                });
+                if (!response.ok) throw new Error("Batch submission failed.");
+                await readEventStream(response, (event) => {
+                    const item = items[event.index];
+                    if (!item || item.done) return;
+                    if (event.type === 'segment') {
+                        item.textarea.value += (item.textarea.value ? ' ' : '') + event.text;
+                        item.textarea.scrollTop = item.textarea.scrollHeight;
+                        return;
+                    }
+                    if (event.type !== 'file') return;
+                    finish(item, event);
+                    recordTimings(item.file.name, performance.now() - started, event.timings);
+                    saveToSession();
+                });
+            } catch (error) {
+                console.error("Batch transcription failed", error);
+            }
+            items.filter(item => !item.done).forEach(item => finish(item, { status: 'failed' }));
+            saveToSession();
+        }
+
         async function handleFiles(files) {
             if (isRecording) { alert("Please stop the recording before uploading files."); return; }
             if (files.length === 0) return;
             fileListContainer.style.display = 'block';
             loader.style.display = 'block';
-            for (const file of [...files]) {
+            const listItems = new Map();
+            for (const file of files) {
                 const li = document.createElement('li');
                 li.textContent = `Processing: ${file.name}...`;
                 fileList.appendChild(li);
-                statusText.innerText = `Transcribing ${file.name}...`;
-                await processSingleAudio(file, file.name, file);
-                li.textContent = `✓ ${file.name}`;
+                listItems.set(file, li);
             }
+            let remaining = files.length;
+            const showRemaining = () => { statusText.innerText = `Transcribing ${remaining} file${remaining === 1 ? '' : 's'}...`; };
+            showRemaining();
+            const priority = files.length === 1 ? 'interactive' : 'batch';
+            const batches = splitIntoBatches([...files]);
+            const lanes = Array.from({ length: Math.min(BATCH_CONCURRENCY, batches.length) }, async () => {
+                while (batches.length > 0) {
+                    await transcribeBatch(batches.shift(), priority, (file) => {
+                        listItems.get(file).textContent = `✓ ${file.name}`;
+                        remaining -= 1;
+                        if (remaining > 0) showRemaining();
+                    });
+                }
+            });
+            await Promise.all(lanes);
             statusText.innerText = "Processing complete.";
             loader.style.display = 'none';
             fileInput.value = ''; 
@@ -547,22 +3418,86 @@ HTML_TEMPLATE = """
                     micBtn.classList.add('recording');
                     statusText.innerText = "RECORDING LIVE";
                     audioChunks = [];
+                    const liveTextarea = await startLiveDictation();
                     mediaRecorder = new MediaRecorder(stream);
-                    mediaRecorder.ondataavailable = event => audioChunks.push(event.data);
+                    mediaRecorder.ondataavailable = event => {
+                        audioChunks.push(event.data);
+                        if (dictationSessionId) {
+                            const sessionId = dictationSessionId;
+                            dictationUploads = dictationUploads.then(() => sendDictationChunk(sessionId, event.data, liveTextarea));
+                        }
+                    };
                     mediaRecorder.onstop = async () => {
                         audioBlob = new Blob(audioChunks, { type: 'audio/webm' });
                         stream.getTracks().forEach(track => track.stop());
                         loader.style.display = 'block';
                         statusText.innerText = "Transcribing recording...";
-                        await processSingleAudio(audioBlob, "Live Recording", audioBlob);
+                        if (dictationSessionId) {
+                            await finishLiveDictation(liveTextarea, audioBlob);
+                        } else {
+                            await processSingleAudio(audioBlob, "Live Recording", audioBlob);
+                        }
                         statusText.innerText = "Ready for next note";
                         loader.style.display = 'none';
                     };
-                    mediaRecorder.start();
+                    mediaRecorder.start(dictationSessionId ? DICTATION_TIMESLICE_MS : undefined);
                 } catch (e) { alert("Microphone access denied."); }
             }
         }
         
+        // Opens a live dictation session and a result card that fills in while the user speaks.
+        // Returns the card's textarea, or null if the server could not start a session.
+        async function startLiveDictation() {
+            dictationSessionId = null;
+            dictationUploads = Promise.resolve();
+            try {
+                const response = await fetch('/dictation', { method: 'POST', headers: { 'X-Requested-With': 'MedicalApp' } });
+                if (!response.ok) return null;
+                dictationSessionId = (await response.json()).session_id;
+            } catch (e) { return null; }
+            const uniqueId = displayTranscription("Live Recording", '');
+            const textarea = document.getElementById(`textarea-${uniqueId}`);
+            textarea.placeholder = 'Listening...';
+            return textarea;
+        }
+
+        async function sendDictationChunk(sessionId, chunk, textarea) {
+            try {
+                const response = await fetch(`/dictation/${sessionId}/chunk`, {
+                    method: 'POST',
+                    body: chunk,
+                    headers: { 'Content-Type': 'application/octet-stream', 'X-Requested-With': 'MedicalApp' }
+                });
+                if (!response.ok) return;
+                const data = await response.json();
+                textarea.value = [data.committed, data.tentative].filter(Boolean).join(' ');
+                textarea.scrollTop = textarea.scrollHeight;
+            } catch (e) { console.error("Live chunk upload failed", e); }
+        }
+
+        async function finishLiveDictation(textarea, recordingBlob) {
+            const sessionId = dictationSessionId;
+            dictationSessionId = null;
+            await dictationUploads;
+            const group = textarea.closest('.transcription-group');
+            group.insertBefore(createAudioPlayer(recordingBlob), group.querySelector('.text-area-with-actions'));
+            try {
+                const started = performance.now();
+                const response = await fetch(`/dictation/${sessionId}/finish`, { method: 'POST', headers: { 'X-Requested-With': 'MedicalApp' } });
+                const data = await response.json();
+                const serverTimings = parseServerTiming(response.headers.get('Server-Timing'));
+                if (serverTimings) serverTimings.request_id = response.headers.get('X-Request-ID');
+                recordTimings('Live recording (final pass)', performance.now() - started, serverTimings);
+                if (!response.ok) throw new Error(data.error);
+                textarea.value = data.transcription || 'Could not transcribe.';
+                group.dataset.sourceLangCode = data.source_lang_code;
+            } catch (e) {
+                textarea.value = 'ERROR: Transcription failed.';
+            }
+            textarea.placeholder = '';
+            saveToSession();
+        }
+
         micBtn.addEventListener('click', toggleRecording);
         window.addEventListener('keydown', (e) => {
             if (e.code === 'Space' && e.target.tagName !== 'TEXTAREA') {
@@ -571,20 +3506,140 @@ HTML_TEMPLATE = """
             }
         });
 
+        // Reads a text/event-stream response body and calls onEvent with each parsed "data:" payload.
+        // (EventSource cannot send the X-Requested-With header, so the stream is read via fetch.)
+        async function readEventStream(response, onEvent) {
+            const reader = response.body.getReader();
+            const decoder = new TextDecoder();
+            let buffer = '';
+            while (true) {
+                const { value, done } = await reader.read();
+                if (done) break;
+                buffer += decoder.decode(value, { stream: true });
+                let boundary;
+                while ((boundary = buffer.indexOf('\\n\\n')) !== -1) {
+                    const rawEvent = buffer.slice(0, boundary);
+                    buffer = buffer.slice(boundary + 2);
+                    const dataLines = rawEvent.split('\\n').filter(line => line.startsWith('data:'));
+                    if (dataLines.length === 0) continue;
+                    onEvent(JSON.parse(dataLines.map(line => line.slice(5).trim()).join('\\n')));
+                }
+            }
+        }
+
+        // --- Timings panel ---
+        // Shows where the time went for the last few requests: the server's stage
+        // breakdown (from the Server-Timing header, or the timings sent with the
+        // finished job or translation) next to what the browser measured.
+        const DEBUG_MAX_ENTRIES = 10;
+        const debugTimings = [];
+
+        function toggleDebugPanel() {
+            const panel = document.getElementById('debug-panel');
+            panel.style.display = panel.style.display === 'block' ? 'none' : 'block';
+        }
+
+        function parseServerTiming(header) {
+            if (!header) return null;
+            const timings = { request_id: null, total_ms: null, stages: {} };
+            header.split(',').forEach(part => {
+                const [name, ...params] = part.trim().split(';');
+                const dur = params.find(p => p.trim().startsWith('dur='));
+                if (!dur) return;
+                const ms = parseFloat(dur.trim().slice(4));
+                if (name === 'total') timings.total_ms = ms; else timings.stages[name] = ms;
+            });
+            return timings;
+        }
+
+        function recordTimings(label, clientMs, server, extra = {}) {
+            debugTimings.unshift({ label, clientMs, server, extra });
+            debugTimings.length = Math.min(debugTimings.length, DEBUG_MAX_ENTRIES);
+            const container = document.getElementById('debug-entries');
+            container.innerHTML = '';
+            debugTimings.forEach(entry => {
+                const div = document.createElement('div');
+                div.className = 'debug-entry';
+                const title = document.createElement('div');
+                title.className = 'debug-entry-title';
+                title.textContent = `${entry.label}: ${Math.round(entry.clientMs)} total`;
+                div.appendChild(title);
+                const parts = Object.entries(entry.extra).map(([name, ms]) => `${name} ${Math.round(ms)}`);
+                if (entry.server) {
+                    Object.entries(entry.server.stages).forEach(([name, ms]) => parts.push(`${name} ${Math.round(ms)}`));
+                    if (entry.server.total_ms !== null) {
+                        parts.push(`server ${Math.round(entry.server.total_ms)}`);
+                        parts.push(`browser/network ${Math.round(Math.max(0, entry.clientMs - entry.server.total_ms))}`);
+                    }
+                }
+                const stages = document.createElement('div');
+                stages.textContent = parts.join(' · ');
+                div.appendChild(stages);
+                if (entry.server && entry.server.request_id) {
+                    const id = document.createElement('div');
+                    id.className = 'debug-entry-id';
+                    id.textContent = `request ${entry.server.request_id}`;
+                    div.appendChild(id);
+                }
+                container.appendChild(div);
+            });
+        }
+
+        // Retries a request the server turned away as busy (429) after the Retry-After it sent.
+        async function fetchWithRetry(url, options, attempts = 5) {
+            for (let attempt = 1; ; attempt++) {
+                const response = await fetch(url, options);
+                if (response.status !== 429 || attempt >= attempts) return response;
+                const seconds = parseInt(response.headers.get('Retry-After'), 10) || 2;
+                await new Promise(resolve => setTimeout(resolve, seconds * 1000));
+            }
+        }
+
+        // Submits the audio as a background job, then follows its status stream until it finishes.
+        // When onSegment is given the job runs in streaming mode and each decoded segment is passed to it.
+        async function transcribeAsJob(audioSource, sourceName, onSegment = null) {
+            const formData = new FormData();
+            formData.append("audio_file", audioSource, `${sourceName}.webm`);
+            if (onSegment) formData.append("stream", "1");
+            const started = performance.now();
+            const submitResponse = await fetchWithRetry("/jobs", {
+                method: "POST",
+                body: formData,
+                headers: { "X-Requested-With": "MedicalApp" }
+            });
+            if (!submitResponse.ok) throw new Error("Job submission failed.");
+            let job = await submitResponse.json();
+            const uploadMs = performance.now() - started;
+            const eventsResponse = await fetch(`/jobs/${job.job_id}/events`, {
+                headers: { "X-Requested-With": "MedicalApp" }
+            });
+            await readEventStream(eventsResponse, (update) => {
+                if (update.type === 'segment') { if (onSegment) onSegment(update); }
+                else { job = update; }
+            });
+            recordTimings(sourceName, performance.now() - started, job.timings, { upload: uploadMs });
+            return job;
+        }
+
+        // The result card is shown straight away and filled in segment by segment as Whisper decodes.
         async function processSingleAudio(audioSource, sourceName, fileObject) {
-		    const formData = new FormData();
-		    formData.append("audio_file", audioSource, `${sourceName}.webm`);
+		    const uniqueId = displayTranscription(sourceName, '', fileObject);
+		    const textarea = document.getElementById(`textarea-${uniqueId}`);
+		    const group = document.querySelector(`[data-id="${uniqueId}"]`);
+		    textarea.placeholder = 'Transcribing...';
 		    try {
-		        const response = await fetch("/transcribe", { 
-		            method: "POST", 
-		            body: formData,
-		            headers: { "X-Requested-With": "MedicalApp" } 
+		        const data = await transcribeAsJob(audioSource, sourceName, (segment) => {
+		            textarea.value += (textarea.value ? ' ' : '') + segment.text;
+		            textarea.scrollTop = textarea.scrollHeight;
 		        });
-		        const data = await response.json();
-		        displayTranscription(sourceName, data.transcription || 'Could not transcribe.', fileObject, null, null, data.source_lang_code);
+		        if (data.status !== 'done') throw new Error(data.error || "Transcription failed.");
+		        textarea.value = data.transcription || 'Could not transcribe.';
+		        group.dataset.sourceLangCode = data.source_lang_code;
 		    } catch (error) {
-		        displayTranscription(sourceName, 'ERROR: Transcription failed.', fileObject);
+		        textarea.value = 'ERROR: Transcription failed.';
 		    }
+		    textarea.placeholder = '';
+		    saveToSession();
 		}
 
         function displayTranscription(fileName, transcriptionText, fileObject = null, existingId = null, existingTranslation = null, sourceLangCode = 'auto') {
@@ -597,14 +3652,7 @@ HTML_TEMPLATE = """
             label.className = 'field-label';
             label.textContent = fileName;
             group.appendChild(label);
-            if (fileObject) {
-                const audioPlayer = document.createElement('audio');
-                audioPlayer.controls = true;
-                audioPlayer.src = URL.createObjectURL(fileObject);
-                audioPlayer.style.width = '100%';
-                audioPlayer.style.marginBottom = '0.75rem';
-                group.appendChild(audioPlayer);
-            }
+            if (fileObject) { group.appendChild(createAudioPlayer(fileObject)); }
             const container = document.createElement('div');
             container.className = 'text-area-with-actions';
             const wrapper = document.createElement('div');
@@ -644,8 +3692,18 @@ HTML_TEMPLATE = """
             if (existingTranslation) { renderTranslationUI(translationOutput, existingTranslation); }
             resultsContainer.prepend(group);
             saveToSession();
+            return uniqueId;
         }
         
+        function createAudioPlayer(fileObject) {
+            const audioPlayer = document.createElement('audio');
+            audioPlayer.controls = true;
+            audioPlayer.src = URL.createObjectURL(fileObject);
+            audioPlayer.style.width = '100%';
+            audioPlayer.style.marginBottom = '0.75rem';
+            return audioPlayer;
+        }
+
         function renderTranslationUI(outputDiv, translationText) {
             outputDiv.innerHTML = '';
             const wrapper = document.createElement('div');
@@ -677,7 +3735,8 @@ HTML_TEMPLATE = """
             if (!textToTranslate.trim()) { alert("There is no text to translate."); return; }
             outputDiv.innerHTML = `<div class="loader loader-small" style="display: block; border: 2px solid #f3f3f3; border-top: 2px solid var(--primary); width: 16px; height: 16px; margin: 8px; border-radius: 50%; animation: spin 1s linear infinite;"></div>`;
             try {
-                const response = await fetch("/translate", {
+                const started = performance.now();
+                const response = await fetch("/translate/stream", {
                     method: "POST",
                     headers: { "Content-Type": "application/json", "X-Requested-With": "MedicalApp" },
                     body: JSON.stringify({ 
@@ -687,8 +3746,25 @@ HTML_TEMPLATE = """
                     })
                 });
                 if (!response.ok) { const errData = await response.json(); throw new Error(errData.error || "Translation request failed."); }
-                const data = await response.json();
-                renderTranslationUI(outputDiv, data.translation.trim());
+                // Tokens are shown as they are generated; the final event replaces them with the cleaned translation
+                let liveTextarea = null;
+                let finished = false;
+                await readEventStream(response, (event) => {
+                    if (event.type === 'error') throw new Error(event.error);
+                    const text = event.type === 'done' ? event.translation.trim() : event.preview;
+                    if (!text) return;
+                    if (!liveTextarea) {
+                        renderTranslationUI(outputDiv, text);
+                        liveTextarea = outputDiv.querySelector('textarea.translation-textarea');
+                    } else {
+                        liveTextarea.value = text;
+                    }
+                    if (event.type === 'done') {
+                        finished = true;
+                        recordTimings(`Translation (${targetLanguage})`, performance.now() - started, event.timings);
+                    }
+                });
+                if (!finished) throw new Error("Translation request failed.");
                 saveToSession();
             } catch(error) {
                 outputDiv.innerHTML = `<textarea class="translation-textarea" readonly>Error: ${error.message}</textarea>`;
@@ -704,6 +3780,22 @@ def index():
     langs = load_languages()
     return render_template_string(HTML_TEMPLATE, languages=langs)
 
+@app.route("/ready")
+def ready():
+    models = {"whisper": whisper_model.status(), "translation": translation_model.status()}
+    return jsonify({
+        # An unloaded model is reloaded on the next request that needs it
+        "ready": all(m["state"] in ("ready", "unloaded") for m in models.values()),
+        "engine": engine.name,
+        "models": models,
+    })
+
+@app.route("/metrics")
+def get_metrics():
+    # Like /ready, readable without the app header so a Prometheus scraper
+    # can poll it. It holds timings and counts only, never text.
+    return Response(render_metrics(), mimetype="text/plain; version=0.0.4")
+
 @app.route("/get_supported_languages")
 def get_supported_languages():
     if os.path.exists(SUPPORTED_LANG_FILE):
@@ -761,82 +3853,364 @@ def remove_language():
 def transcribe():
     if request.headers.get("X-Requested-With") != "MedicalApp":
         return jsonify({"error": "Unauthorized request source"}), 403
-    if 'audio_file' not in request.files:
+    admit_request(whisper_lane)
+    with stage("upload_receive"):
+        audio_file = request.files.get('audio_file')
+    if audio_file is None:
         return jsonify({"error": "No audio file"}), 400
-    audio_file = request.files['audio_file']
-    upload_dir = os.path.join(os.getcwd(), "temp_user_uploads")
-    os.makedirs(upload_dir, exist_ok=True)
-    temp_audio_path = None
-
-    # Issue #4: Whitelist extensions — never trust the client-supplied filename
-    ALLOWED_EXTENSIONS = {'.wav', '.mp3', '.m4a', '.webm', '.ogg', '.flac'}
-    raw_suffix = os.path.splitext(audio_file.filename)[1].lower()
-    suffix = raw_suffix if raw_suffix in ALLOWED_EXTENSIONS else '.webm'
+    audio = None
 
     try:
-        with tempfile.NamedTemporaryFile(dir=upload_dir, delete=False, suffix=suffix) as temp_audio:
-            audio_file.save(temp_audio.name)
-            temp_audio_path = temp_audio.name
-        transcribed_text, lang_code = run_transcription(temp_audio_path)
-        return jsonify({
+        audio = read_upload(audio_file)
+        cache_key = transcription_cache_key(audio)
+        cached = lookup_transcription(cache_key)
+        if cached is not None:
+            trace_note(language=cached["source_lang_code"])
+            return jsonify(cached)
+        transcribed_text, lang_code, details = run_transcription(audio)
+        trace_note(language=lang_code)
+        response = {
             "transcription": transcribed_text,
             "source_lang_code": lang_code
+        }
+        response.update(details)
+        transcription_cache.put(cache_key, response)
+        return jsonify(response)
+    except Exception as e:
+        print(f"Transcription error: {e}")  # Full details stay server-side only
+        return jsonify({"error": "Transcription failed. Please try again."}), 500
+    finally:
+        discard_upload(audio)
+
+@app.route("/jobs", methods=["POST"])
+def create_job():
+    if request.headers.get("X-Requested-With") != "MedicalApp":
+        return jsonify({"error": "Unauthorized request source"}), 403
+    admit_jobs()
+    with stage("upload_receive"):
+        audio_file = request.files.get('audio_file')
+    if audio_file is None:
+        return jsonify({"error": "No audio file"}), 400
+    try:
+        audio = read_upload(audio_file)
+    except Exception as e:
+        print(f"Upload error: {e}")  # Full details stay server-side only
+        return jsonify({"error": "Upload failed. Please try again."}), 500
+    job_id = submit_job(audio, stream=request.form.get("stream") == "1", trace=g.trace,
+                        priority=requested_priority("interactive"))
+    with jobs_changed:
+        return jsonify(job_view(jobs[job_id])), 202
+
+BATCH_MAX_FILES = 50
+
+@app.route("/transcribe_batch", methods=["POST"])
+def transcribe_batch():
+    """Transcribe many files from one multipart request, streaming each result as it finishes.
+
+    Files with identical content are transcribed once, and the smallest go
+    first so results start arriving early. The jobs run at batch priority
+    unless the form asks for "interactive". Events: {"type": "accepted"},
+    then {"type": "segment", "index": ..., <segment>} as each segment of a
+    file is decoded and one {"type": "file", "index": ..., <job view>} when
+    it finishes (index is its position in the request), then {"type": "done"}.
+    """
+    if request.headers.get("X-Requested-With") != "MedicalApp":
+        return jsonify({"error": "Unauthorized request source"}), 403
+    with stage("upload_receive"):
+        audio_files = request.files.getlist('audio_files')
+    if not audio_files:
+        return jsonify({"error": "No audio files"}), 400
+    if len(audio_files) > BATCH_MAX_FILES:
+        return jsonify({"error": f"At most {BATCH_MAX_FILES} files per batch"}), 400
+    admit_jobs(len(audio_files))
+    uploads = []
+    try:
+        for audio_file in audio_files:
+            uploads.append(read_upload(audio_file))
+    except Exception as e:
+        print(f"Upload error: {e}")  # Full details stay server-side only
+        for audio in uploads:
+            discard_upload(audio)
+        return jsonify({"error": "Upload failed. Please try again."}), 500
+
+    same_content = {}   # cache key -> indices of the files with that content
+    for index, audio in enumerate(uploads):
+        key = transcription_cache_key(audio)
+        if key in same_content:
+            discard_upload(audio)
+        same_content.setdefault(key, []).append(index)
+    trace = g.trace
+    trace["priority"] = requested_priority("batch")
+    file_jobs = {}   # job ID -> indices of the files it transcribes
+    for key in sorted(same_content, key=lambda key: upload_size(uploads[same_content[key][0]])):
+        indices = same_content[key]
+        job_id = submit_job(uploads[indices[0]], stream=True, trace=trace, cache_key=key,
+                            priority=trace["priority"])
+        file_jobs[job_id] = indices
+    trace.update(files=len(uploads), unique_files=len(file_jobs))
+
+    def events():
+        pending = dict(file_jobs)
+        segments_sent = dict.fromkeys(file_jobs, 0)
+        status = "ok"
+
+        def updated_jobs():
+            """Pending jobs that have finished or decoded new segments. Caller holds jobs_changed."""
+            return [job_id for job_id in pending
+                    if jobs[job_id]["finished_at"] is not None
+                    or len(jobs[job_id]["segments"]) > segments_sent[job_id]]
+
+        try:
+            yield f"data: {json.dumps({'type': 'accepted', 'files': len(uploads), 'jobs': len(file_jobs)})}\n\n"
+            while pending:
+                with jobs_changed:
+                    updated = updated_jobs()
+                    if not updated:
+                        jobs_changed.wait(timeout=15)
+                        updated = updated_jobs()
+                    updates = [(job_id, jobs[job_id]["segments"][segments_sent[job_id]:],
+                                job_view(jobs[job_id]) if jobs[job_id]["finished_at"] is not None else None)
+                               for job_id in updated]
+                if not updates:
+                    yield ": keep-alive\n\n"
+                for job_id, new_segments, view in updates:
+                    segments_sent[job_id] += len(new_segments)
+                    for segment in new_segments:
+                        for index in pending[job_id]:
+                            yield f"data: {json.dumps(dict(segment, type='segment', index=index))}\n\n"
+                    if view is not None:
+                        for index in pending.pop(job_id):
+                            yield f"data: {json.dumps(dict(view, type='file', index=index))}\n\n"
+            yield f"data: {json.dumps({'type': 'done'})}\n\n"
+        except GeneratorExit:
+            status = "disconnected"   # The jobs still finish and land in the cache
+            raise
+        finally:
+            log_trace(trace, "stream", status=status)
+
+    return Response(events(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache"})
+
+@app.route("/jobs/stats")
+def get_job_stats():
+    if request.headers.get("X-Requested-With") != "MedicalApp":
+        return jsonify({"error": "Unauthorized request source"}), 403
+    return jsonify(job_queue_snapshot())
+
+@app.route("/scheduler/stats")
+def get_scheduler_stats():
+    if request.headers.get("X-Requested-With") != "MedicalApp":
+        return jsonify({"error": "Unauthorized request source"}), 403
+    return jsonify(scheduler_snapshot())
+
+@app.route("/cache/stats")
+def get_cache_stats():
+    if request.headers.get("X-Requested-With") != "MedicalApp":
+        return jsonify({"error": "Unauthorized request source"}), 403
+    return jsonify({
+        "transcriptions": transcription_cache.stats(),
+        "translations": translation_cache.stats(),
+    })
+
+@app.route("/jobs/<job_id>")
+def get_job(job_id):
+    if request.headers.get("X-Requested-With") != "MedicalApp":
+        return jsonify({"error": "Unauthorized request source"}), 403
+    with jobs_changed:
+        job = jobs.get(job_id)
+        if job is None:
+            return jsonify({"error": "Unknown job"}), 404
+        return jsonify(job_view(job))
+
+@app.route("/jobs/<job_id>/events")
+def stream_job(job_id):
+    if request.headers.get("X-Requested-With") != "MedicalApp":
+        return jsonify({"error": "Unauthorized request source"}), 403
+    with jobs_changed:
+        if job_id not in jobs:
+            return jsonify({"error": "Unknown job"}), 404
+
+    # Status changes are sent as the job view; streaming jobs also send one
+    # {"type": "segment", ...} event per newly decoded segment.
+    def events():
+        last_status = None
+        segments_sent = 0
+        while True:
+            with jobs_changed:
+                job = jobs.get(job_id)
+                if job is not None and job["status"] == last_status and len(job["segments"]) == segments_sent:
+                    jobs_changed.wait(timeout=15)
+                    job = jobs.get(job_id)
+                if job is None:
+                    return
+                new_segments = job["segments"][segments_sent:]
+                view = job_view(job)
+            for segment in new_segments:
+                yield f"data: {json.dumps(dict(segment, type='segment'))}\n\n"
+            segments_sent += len(new_segments)
+            if view["status"] == last_status:
+                if not new_segments:
+                    yield ": keep-alive\n\n"
+                continue
+            last_status = view["status"]
+            yield f"data: {json.dumps(dict(view, type='status'))}\n\n"
+            if last_status in ("done", "failed"):
+                return
+
+    return Response(events(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache"})
+
+@app.route("/dictation", methods=["POST"])
+def start_dictation():
+    if request.headers.get("X-Requested-With") != "MedicalApp":
+        return jsonify({"error": "Unauthorized request source"}), 403
+    return jsonify({"session_id": create_dictation_session()})
+
+@app.route("/dictation/<session_id>/chunk", methods=["POST"])
+def dictation_chunk(session_id):
+    if request.headers.get("X-Requested-With") != "MedicalApp":
+        return jsonify({"error": "Unauthorized request source"}), 403
+    with dictation_lock:
+        session = dictation_sessions.get(session_id)
+    if session is None:
+        return jsonify({"error": "Unknown dictation session"}), 404
+    if len(session["buffer"]) + (request.content_length or 0) > DICTATION_MAX_BYTES:
+        return jsonify({"error": "Recording is too long"}), 413
+    # Read the body before taking any lock, so a slow upload holds up no one
+    with stage("upload_receive"):
+        data = request.get_data()
+    if len(session["buffer"]) + len(data) > DICTATION_MAX_BYTES:
+        return jsonify({"error": "Recording is too long"}), 413
+    add_dictation_chunk(session, data)
+    # If the previous chunk is still being transcribed, or Whisper's queue is
+    # full, return what we have rather than queueing behind it; the next chunk
+    # picks up the new audio.
+    if whisper_lane.full() or not session["work_lock"].acquire(blocking=False):
+        return jsonify(dictation_partial(session))
+    try:
+        update_dictation(session)
+    except Exception as e:
+        print(f"Live transcription error: {e}")  # Full details stay server-side only
+        handled_errors.inc(route=request.url_rule.rule)
+    finally:
+        session["work_lock"].release()
+    return jsonify(dictation_partial(session))
+
+@app.route("/dictation/<session_id>/finish", methods=["POST"])
+def finish_dictation(session_id):
+    if request.headers.get("X-Requested-With") != "MedicalApp":
+        return jsonify({"error": "Unauthorized request source"}), 403
+    with dictation_lock:
+        session = dictation_sessions.pop(session_id, None)
+    if session is None:
+        return jsonify({"error": "Unknown dictation session"}), 404
+    try:
+        with session["work_lock"]:
+            update_dictation(session, final=True)
+        partial = dictation_partial(session)
+        trace_note(language=partial["source_lang_code"])
+        return jsonify({
+            "transcription": partial["committed"],
+            "source_lang_code": partial["source_lang_code"],
         })
     except Exception as e:
         print(f"Transcription error: {e}")  # Full details stay server-side only
         return jsonify({"error": "Transcription failed. Please try again."}), 500
     finally:
-        if temp_audio_path and os.path.exists(temp_audio_path): 
-            os.remove(temp_audio_path)
+        close_dictation_session(session)
+
+def translation_request_error(data, fan_out=False):
+    """Why a translation request body is unusable, or None.
+
+    The text must be a non-empty string, and so must the language unless
+    the body asks for a fan-out with "languages".
+    """
+    if not isinstance(data, dict):
+        return "Invalid request"
+    text = data.get('text')
+    if not isinstance(text, str) or not text.strip():
+        return "No text provided"
+    if fan_out and data.get('languages') is not None:
+        return None
+    language = data.get('language')
+    if not isinstance(language, str) or not language.strip():
+        return "No language provided"
+    return None
 
 @app.route("/translate", methods=["POST"])
 def translate():
     if request.headers.get("X-Requested-With") != "MedicalApp":
         return jsonify({"error": "Unauthorized request source"}), 403
-    
-    data = request.json
+    data = request.get_json(silent=True)
+    error = translation_request_error(data, fan_out=True)
+    if error is not None:
+        return jsonify({"error": error}), 400
+    admit_request(translation_lane)
+
     text_to_translate = data.get('text')
-    target_lang = data.get('language', '').strip()
+    target_lang = (data.get('language') or '').strip()
 
-    # Aya uses a simple prompt format
-    prompt = f"""
-Please translate this text into {target_lang}: {text_to_translate}
+    # Fan-out: {"languages": [...]} translates into several configured languages in one call
+    target_langs = data.get('languages')
+    if target_langs is not None:
+        if not isinstance(target_langs, list) or not target_langs \
+                or not all(isinstance(lang, str) for lang in target_langs):
+            return jsonify({"error": "No languages provided"}), 400
+        configured = set(load_languages())
+        unknown = [lang for lang in target_langs if lang not in configured]
+        if unknown:
+            return jsonify({"error": f"Language not configured: {', '.join(map(str, unknown))}"}), 400
 
-Output your response as json with the following keys: translation
+    trace_note(target_languages=target_langs if target_langs is not None else [target_lang])
+    try:
+        if target_langs is not None:
+            results = run_translations(text_to_translate, list(dict.fromkeys(target_langs)))
+            return jsonify({
+                "translations": {lang: result["translation"] for lang, result in results.items()},
+                "timings": {lang: {k: v for k, v in result.items() if k != "translation"}
+                            for lang, result in results.items()},
+            })
+        return jsonify({"translation": run_translation(text_to_translate, target_lang)})
+    except Exception as e:
+        print(f"Translation error: {e}")  # Full details stay server-side only
+        return jsonify({"error": "Translation failed. Please try again."}), 500
 
-"""
+@app.route("/translate/stream", methods=["POST"])
+def translate_stream():
+    if request.headers.get("X-Requested-With") != "MedicalApp":
+        return jsonify({"error": "Unauthorized request source"}), 403
+    data = request.get_json(silent=True)
+    error = translation_request_error(data)
+    if error is not None:
+        return jsonify({"error": error}), 400
+    admit_request(translation_lane)
 
-    if tokenizer.chat_template is not None:
-        messages = [{"role": "user", "content": prompt}]
-        prompt = tokenizer.apply_chat_template(
-            messages, add_generation_prompt=True
-        )
-    
-    try:
-		
-        sampler = make_sampler(temp=0.0)
-		
-        response_text = generate(model, tokenizer, prompt=prompt, verbose=False, sampler=sampler)
-        
-        # FIX: .split('```json')[1].split('```') returns a list, not a string.
-        # Use indexing to get the content between the fences.
-        if '```json' in response_text:
-            response_text = response_text.split('```json')[1].split('```')[0]
-        
-        response_text = response_text.strip()
+    text_to_translate = data.get('text')
+    target_lang = data.get('language').strip()
 
-        # Try to parse the cleaned text as JSON
+    trace = g.trace
+    trace["target_languages"] = [target_lang]
+
+    def events():
+        # The body is generated after the request has ended, so the trace is set again here
+        current_trace.set(trace)
+        status = "ok"
         try:
-            parsed_json = json.loads(response_text)
-            translation = parsed_json.get('translation', 'Error: "translation" key not found in model response.')
-        except json.JSONDecodeError:
-            # If it's not valid JSON, use the raw response as a fallback
-            translation = response_text
+            for event in stream_translation(text_to_translate, target_lang):
+                if event["type"] == "done":
+                    event = dict(event, timings=trace_timings(trace))
+                yield f"data: {json.dumps(event)}\n\n"
+        except Exception as e:
+            print(f"Translation error: {e}")  # Full details stay server-side only
+            handled_errors.inc(route="/translate/stream")
+            status = "error"
+            yield f"data: {json.dumps({'type': 'error', 'error': 'Translation failed. Please try again.'})}\n\n"
+        finally:
+            log_trace(trace, "stream", status=status)
+            current_trace.set(None)
 
-        return jsonify({"translation": translation.strip()})
-    except Exception as e:
-        print(f"Translation error: {e}")  # Full details stay server-side only
-        return jsonify({"error": "Translation failed. Please try again."}), 500
+    return Response(events(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache"})
 
 def open_browser(host, port):
     webbrowser.open_new(f'http://{host}:{port}')
@@ -847,5 +4221,10 @@ if __name__ == "__main__":
     check_host(host)
     load_languages()
     cleanup_orphaned_temp_files()
+    print(f"Inference engine: {engine.name}")
+    start_job_workers()
+    if MODEL_WARMUP_AT_STARTUP:
+        start_model_warmup()
+    start_model_residency_monitor()
     Timer(1, lambda: open_browser(host, port)).start()
     app.run(host=host, port=port, debug=False)
@@ -0,0 +1,314 @@
+#----------------------
+# Private Audio Transcriber (PAT) - Benchmarks
+# Run from this folder, e.g.:  uv run python bench.py prompt-cache
+#                               PAT_ENGINE=fake python bench.py suite
+#                               python bench.py decode
+#                               python bench.py whisper-batch --users 8
+#                               python bench.py concurrency --clients 1,2,4,8,16
+# Results are printed as JSON (and written to --output if given) so runs can
+# be diffed between commits. The app's own log lines go to stderr.
+#----------------------
+
+import os
+import sys
+import json
+import glob
+import time
+import hashlib
+import platform
+import argparse
+import resource
+import shutil
+import threading
+import statistics
+import subprocess
+from contextlib import redirect_stdout
+
+import app
+
+SAMPLES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "sample-audio-files-for-testing")
+
+SAMPLE_NOTES = [
+    "Patient is a 54 year old male presenting with chest pain radiating to the left arm.",
+    "Blood pressure 130 over 85. Heart rate 72. No known drug allergies.",
+    "Follow up in two weeks. Continue current medication and return if symptoms worsen.",
+    "The client signed the agreement on the first of March in the presence of two witnesses.",
+]
+
+def time_to_first_token(prompt, extra_args):
+    """Seconds until mlx_lm yields the first generated token."""
+    model, tokenizer = app.translation_model.get()
+    sampler = app.engine.make_sampler(**app.TRANSLATION_SAMPLER_SETTINGS)
+    started = time.perf_counter()
+    for _ in app.engine.stream_generate(model, tokenizer, prompt=prompt, max_tokens=1,
+                                        sampler=sampler, **extra_args):
+        return time.perf_counter() - started
+    return time.perf_counter() - started
+
+def bench_prompt_cache(args):
+    """Time-to-first-token for translation prompts with and without the shared-prefix KV cache."""
+    if not app.engine.supports_prompt_cache:
+        sys.exit(f"The {app.engine.name} engine has no prompt cache to benchmark.")
+    results = {"runs": args.runs, "language": args.language, "without_cache": [], "with_cache": []}
+    # Warm up kernels and build the prefix cache outside the timed runs
+    app.TRANSLATION_PROMPT_CACHE = True
+    warm_prompt = app.build_translation_prompt(SAMPLE_NOTES[0], args.language)
+    with app.translation_generation_args(warm_prompt) as (prompt, extra_args):
+        time_to_first_token(prompt, extra_args)
+    results["prefix_tokens"] = len(app.prefix_cache["tokens"])
+
+    for _ in range(args.runs):
+        for note in SAMPLE_NOTES:
+            full_prompt = app.build_translation_prompt(note, args.language)
+            app.TRANSLATION_PROMPT_CACHE = False
+            with app.translation_generation_args(full_prompt) as (prompt, extra_args):
+                results["without_cache"].append(time_to_first_token(prompt, extra_args))
+            app.TRANSLATION_PROMPT_CACHE = True
+            with app.translation_generation_args(full_prompt) as (prompt, extra_args):
+                results["with_cache"].append(time_to_first_token(prompt, extra_args))
+
+    summary = {}
+    for key in ("without_cache", "with_cache"):
+        timings = results.pop(key)
+        summary[key] = {
+            "median_ttft_ms": round(statistics.median(timings) * 1000, 2),
+            "min_ttft_ms": round(min(timings) * 1000, 2),
+        }
+    results["summary"] = summary
+    return results
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)   # bytes on macOS, KB on Linux
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def timed(fn, *args):
+    started = time.perf_counter()
+    value = fn(*args)
+    return time.perf_counter() - started, value
+
+def timing_summary(first, warm):
+    summary = {"first_seconds": round(first, 3)}
+    if warm:
+        summary["warm_median_seconds"] = round(statistics.median(warm), 3)
+        summary["warm_min_seconds"] = round(min(warm), 3)
+    return summary
+
+def bench_suite(args):
+    """Transcribe and translate every sample file: wall time, RTF, tokens/sec and peak RSS, cold and warm.
+
+    The first run of the first file is the cold start and includes loading
+    the models; every file is then run --runs more times warm. Result caches
+    are turned off so every run does the work.
+    """
+    app.translation_cache = app.ResultCache("translations", "off", 0)
+    files = sorted(glob.glob(os.path.join(args.samples, "*.wav")))
+    if not files:
+        sys.exit(f"No sample files found in {args.samples}")
+    results = {
+        "engine": app.engine.name,
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "machine": f"{platform.system()} {platform.machine()}",
+        "runs": args.runs,
+        "language": args.language,
+        "settings": {
+            "vad": app.VAD_ENABLED,
+            "long_file_workers": app.LONG_FILE_WORKERS,
+            "translation_prompt_cache": app.TRANSLATION_PROMPT_CACHE and app.engine.supports_prompt_cache,
+            "translation_batch_size": app.TRANSLATION_BATCH_SIZE,
+        },
+        "files": [],
+    }
+
+    for number, path in enumerate(files):
+        audio_seconds = len(app.load_audio(path)) / app.SAMPLE_RATE
+        first, (text, language_code, _) = timed(app.run_transcription, path)
+        warm = [timed(app.run_transcription, path)[0] for _ in range(args.runs)]
+        transcription = timing_summary(first, warm)
+        transcription["rtf"] = round(statistics.median(warm or [first]) / audio_seconds, 4)
+
+        translate = lambda: app.run_translations(text, [args.language])[args.language]
+        first, outcome = timed(translate)
+        warm_runs = [timed(translate) for _ in range(args.runs)]
+        translation = timing_summary(first, [seconds for seconds, _ in warm_runs])
+        translation["tokens"] = outcome["tokens"]
+        decode_seconds = statistics.median([o["seconds"] for _, o in warm_runs] or [outcome["seconds"]])
+        translation["tokens_per_second"] = round(outcome["tokens"] / decode_seconds, 1) if decode_seconds else None
+
+        if number == 0:
+            results["cold_start"] = {
+                "transcription_seconds": transcription["first_seconds"],
+                "translation_seconds": translation["first_seconds"],
+                "models": {"whisper": app.whisper_model.status(), "translation": app.translation_model.status()},
+            }
+        results["files"].append({
+            "file": os.path.basename(path),
+            "audio_seconds": round(audio_seconds, 2),
+            "language": language_code,
+            # Changes when the output changes, without putting the text in the results
+            "transcript_sha256": hashlib.sha256(text.encode("utf-8")).hexdigest()[:12],
+            "transcription": transcription,
+            "translation": translation,
+            "peak_rss_mb": peak_rss_mb(),
+        })
+
+    audio_total = sum(f["audio_seconds"] for f in results["files"])
+    warm_total = sum(f["transcription"].get("warm_median_seconds", f["transcription"]["first_seconds"])
+                     for f in results["files"])
+    results["summary"] = {
+        "audio_seconds": round(audio_total, 2),
+        "transcription_rtf": round(warm_total / audio_total, 4),
+        "translation_tokens_per_second": round(statistics.median(
+            f["translation"]["tokens_per_second"] or 0 for f in results["files"]), 1),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+    return results
+
+def bench_decode(args):
+    """Decode time per minute of audio for each sample file: native WAV decoder vs. ffmpeg."""
+    files = sorted(glob.glob(os.path.join(args.samples, "*.wav")))
+    if not files:
+        sys.exit(f"No sample files found in {args.samples}")
+    has_ffmpeg = shutil.which("ffmpeg") is not None
+    results = {"runs": args.runs, "ffmpeg": has_ffmpeg, "files": []}
+
+    def ms_per_minute(fn, source, minutes):
+        fn(source)   # Warm the page cache and NumPy
+        timings = [timed(fn, source)[0] for _ in range(args.runs)]
+        return round(statistics.median(timings) * 1000 / minutes, 2)
+
+    for path in files:
+        with open(path, "rb") as f:
+            data = f.read()
+        minutes = len(app.decode_native(path)) / app.SAMPLE_RATE / 60
+        entry = {
+            "file": os.path.basename(path),
+            "audio_seconds": round(minutes * 60, 2),
+            "native_path_ms_per_min": ms_per_minute(app.decode_native, path, minutes),
+            "native_bytes_ms_per_min": ms_per_minute(app.decode_native, data, minutes),
+        }
+        if has_ffmpeg:
+            entry["ffmpeg_path_ms_per_min"] = ms_per_minute(app.run_ffmpeg, path, minutes)
+            entry["ffmpeg_pipe_ms_per_min"] = ms_per_minute(lambda d: app.run_ffmpeg("pipe:0", d), data, minutes)
+        results["files"].append(entry)
+    return results
+
+def bench_whisper_batch(args):
+    """Short clips from --users concurrent users, transcribed one at a time and with micro-batching.
+
+    Each user sends --runs clips of --clip-seconds back to back, cut from the
+    sample files. Reports clips per second and per-clip latency for each
+    WHISPER_BATCH_SIZE.
+    """
+    files = sorted(glob.glob(os.path.join(args.samples, "*.wav")))
+    if not files:
+        sys.exit(f"No sample files found in {args.samples}")
+    clip_samples = int(args.clip_seconds * app.SAMPLE_RATE)
+    clips = [audio[start:start + clip_samples]
+             for audio in (app.load_audio(path) for path in files)
+             for start in range(0, len(audio) - clip_samples + 1, clip_samples)]
+    if not clips:
+        sys.exit(f"No sample file is {args.clip_seconds}s long")
+    app.whisper_transcribe(clips[0])   # Load and warm up the model outside the timed runs
+    results = {"engine": app.engine.name, "users": args.users, "clips_per_user": args.runs,
+               "clip_seconds": args.clip_seconds, "batch_wait_ms": app.WHISPER_BATCH_WAIT_MS, "runs": []}
+
+    for batch_size in sorted({1, app.WHISPER_BATCH_SIZE}):
+        app.WHISPER_BATCH_SIZE = batch_size
+        latencies = []
+        def user(number):
+            for i in range(args.runs):
+                seconds, _ = timed(app.whisper_transcribe, clips[(number * args.runs + i) % len(clips)])
+                latencies.append(seconds)
+        threads = [threading.Thread(target=user, args=(number,)) for number in range(args.users)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        wall = time.perf_counter() - started
+        latencies.sort()
+        results["runs"].append({
+            "batch_size": batch_size,
+            "clips_per_second": round(len(latencies) / wall, 2),
+            "p50_ms": round(statistics.median(latencies) * 1000, 1),
+            "p95_ms": round(latencies[int(0.95 * (len(latencies) - 1))] * 1000, 1),
+        })
+    return results
+
+def bench_concurrency(args):
+    """Translation throughput with 1 to 16 concurrent clients, per client and in aggregate.
+
+    Each client translates the sample notes --runs times, back to back. Every
+    level runs with continuous batching and, when the engine has a batch
+    generator, again without it for comparison. The translation cache is off.
+    """
+    app.translation_cache = app.ResultCache("translations", "off", 0)
+    app.run_translations(SAMPLE_NOTES[0], [args.language])   # Load and warm up the model outside the timed runs
+    modes = [True, False] if app.engine.supports_batch_generation else [False]
+    results = {"engine": app.engine.name, "language": args.language, "runs": args.runs,
+               "decode_slots": app.TRANSLATION_DECODE_SLOTS, "levels": []}
+
+    for clients in (int(n) for n in args.clients.split(",")):
+        for continuous in modes:
+            app.TRANSLATION_CONTINUOUS_BATCHING = continuous
+            outcomes = []
+            def client(number):
+                for i in range(args.runs):
+                    note = f"{SAMPLE_NOTES[(number + i) % len(SAMPLE_NOTES)]} (Note {number}-{i}.)"
+                    outcomes.append(app.run_translations(note, [args.language])[args.language])
+            threads = [threading.Thread(target=client, args=(number,)) for number in range(clients)]
+            started = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            wall = time.perf_counter() - started
+            results["levels"].append({
+                "clients": clients,
+                "continuous_batching": continuous,
+                "aggregate_tokens_per_second": round(sum(o["tokens"] for o in outcomes) / wall, 1),
+                "client_tokens_per_second_median": round(statistics.median(
+                    o["tokens"] / o["seconds"] for o in outcomes if o["seconds"]), 1),
+                "latency_p50_seconds": round(statistics.median(o["seconds"] for o in outcomes), 3),
+            })
+    return results
+
+BENCHMARKS = {
+    "concurrency": bench_concurrency,
+    "decode": bench_decode,
+    "prompt-cache": bench_prompt_cache,
+    "suite": bench_suite,
+    "whisper-batch": bench_whisper_batch,
+}
+
+def main():
+    parser = argparse.ArgumentParser(description="PAT benchmarks")
+    parser.add_argument("benchmark", choices=sorted(BENCHMARKS))
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--language", default="French", help="Translation target language")
+    parser.add_argument("--samples", default=SAMPLES_DIR, help="Folder of .wav files for the suite")
+    parser.add_argument("--users", type=int, default=8, help="Concurrent users for whisper-batch")
+    parser.add_argument("--clip-seconds", type=float, default=10, help="Clip length for whisper-batch")
+    parser.add_argument("--clients", default="1,2,4,8,16", help="Concurrent client counts for concurrency")
+    parser.add_argument("--output", help="Also write the JSON results to this file")
+    args = parser.parse_args()
+
+    with redirect_stdout(sys.stderr):
+        results = BENCHMARKS[args.benchmark](args)
+    text = json.dumps(results, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,482 @@
+#----------------------
+# Private Audio Transcriber (PAT) - Inference engines
+# The app talks to Whisper and the translation LLM only through an engine,
+# chosen at startup with the PAT_ENGINE environment variable:
+#   mlx   Apple Silicon, mlx-whisper + mlx-lm (the default)
+#   cpu   Any machine, faster-whisper (CTranslate2 int8) + llama-cpp-python (GGUF)
+#   fake  No models: deterministic output with configurable latency, for tests and benchmarks
+# Backend libraries are imported by the engine that uses them, so only the
+# selected engine's packages need to be installed.
+#----------------------
+
+import os
+import re
+import copy
+import json
+import time
+import zlib
+import itertools
+import codecs
+import threading
+import numpy as np
+
+SAMPLE_RATE = 16000   # Whisper's input rate; every engine takes 16 kHz mono float32
+
+class Generation:
+    """One step of stream_generate(), shaped like mlx_lm's GenerationResponse."""
+
+    def __init__(self, text, token, finish_reason=None):
+        self.text = text
+        self.token = token
+        self.finish_reason = finish_reason
+
+class Engine:
+    """The interface the app uses. Subclasses provide the model-specific parts.
+
+    transcribe() returns a Whisper-style {"text", "language", "segments"}
+    dict; transcribe_batch() returns one per clip. stream_generate() yields Generation-like steps with mlx_lm's
+    conventions: the final step has a finish_reason ("stop" or "length")
+    and, for "stop", carries the end-of-sequence token rather than output.
+    """
+
+    name = None
+    supports_prompt_cache = False   # prefill_prompt_cache()/trim_prompt_cache() are implemented
+    supports_batch_transcribe = False   # transcribe_batch() decodes the clips together, not one by one
+    supports_batch_generation = False   # batch_generator() returns a generator rather than None
+
+    def __init__(self, whisper_path, translation_path):
+        self.whisper_path = whisper_path
+        self.translation_path = translation_path
+
+    def load_transcriber(self):
+        raise NotImplementedError
+
+    def unload_transcriber(self):
+        pass
+
+    def transcribe(self, audio, **options):
+        raise NotImplementedError
+
+    def transcribe_batch(self, audios, **options):
+        """Transcribe several clips of at most 30 s with the same options."""
+        return [self.transcribe(audio, **options) for audio in audios]
+
+    def load_translator(self):
+        """Return (model, tokenizer)."""
+        raise NotImplementedError
+
+    def make_sampler(self, **settings):
+        return dict(settings)
+
+    def stream_generate(self, model, tokenizer, prompt, max_tokens=256, sampler=None, **kwargs):
+        raise NotImplementedError
+
+    def generate(self, model, tokenizer, prompt, max_tokens=256, sampler=None, **kwargs):
+        return "".join(step.text for step in self.stream_generate(
+            model, tokenizer, prompt, max_tokens=max_tokens, sampler=sampler, **kwargs))
+
+    def prefill_prompt_cache(self, model, tokens):
+        raise NotImplementedError
+
+    def trim_prompt_cache(self, cache, keep):
+        """Trim the cache back to its first `keep` tokens. Returns False if it cannot be trimmed."""
+        return False
+
+    def copy_prompt_cache(self, cache):
+        """An independent copy of a prefilled cache, for one sequence of a batch generator to extend."""
+        raise NotImplementedError
+
+    def batch_generator(self, model, tokenizer, sampler, batch_size):
+        """An object with mlx_lm BatchGenerator's insert()/next(), or None to decode one prompt at a time.
+
+        insert() takes an optional list of per-prompt caches (see copy_prompt_cache()).
+        """
+        return None
+
+    def resident_bytes(self, model):
+        return 0
+
+    def release_memory(self):
+        pass
+
+# --- MLX (Apple Silicon) ---
+
+# Batched clips are decoded greedily in one pass; a clip whose output looks
+# like a failed decode by mlx_whisper's own thresholds is transcribed again
+# on its own, with its temperature fallback.
+MLX_BATCH_COMPRESSION_RATIO_THRESHOLD = 2.4
+MLX_BATCH_LOGPROB_THRESHOLD = -1.0
+MLX_BATCH_NO_SPEECH_THRESHOLD = 0.6
+
+class MLXEngine(Engine):
+    name = "mlx"
+    supports_prompt_cache = True
+    supports_batch_transcribe = True
+
+    def __init__(self, whisper_path, translation_path):
+        super().__init__(whisper_path, translation_path)
+        import mlx.core, mlx_lm, mlx_whisper  # noqa: F401 - fail at startup, not on the first request
+        try:
+            from mlx_lm.generate import BatchGenerator  # noqa: F401
+            self.supports_batch_generation = True
+        except ImportError:
+            pass   # Older mlx_lm
+
+    def load_transcriber(self):
+        # mlx_whisper keeps the model it loads in ModelHolder and reuses it for
+        # every transcribe() call with the same path and dtype (fp16 by default).
+        import mlx.core as mx
+        from mlx_whisper.transcribe import ModelHolder
+        return ModelHolder.get_model(self.whisper_path, mx.float16)
+
+    def unload_transcriber(self):
+        from mlx_whisper.transcribe import ModelHolder
+        ModelHolder.model = None
+        ModelHolder.model_path = None
+
+    def transcribe(self, audio, **options):
+        import mlx_whisper
+        return mlx_whisper.transcribe(audio, path_or_hf_repo=self.whisper_path, **options)
+
+    def transcribe_batch(self, audios, language=None, initial_prompt=None, **options):
+        # Each clip is padded to Whisper's 30 s window, so the encoder and
+        # decoder run on all of them in one pass.
+        import mlx.core as mx
+        from mlx_whisper.audio import N_FRAMES, N_SAMPLES, log_mel_spectrogram
+        from mlx_whisper.decoding import DecodingOptions, decode
+        from mlx_whisper.tokenizer import get_tokenizer
+        model = self.load_transcriber()
+        # Padded with silence before the mel transform, as mlx_whisper.transcribe() does
+        mel = mx.stack([log_mel_spectrogram(audio, n_mels=model.dims.n_mels, padding=N_SAMPLES)[:N_FRAMES]
+                        for audio in audios]).astype(mx.float16)
+        decoded = decode(model, mel, DecodingOptions(language=language, prompt=initial_prompt, temperature=0.0))
+        results = []
+        for audio, result in zip(audios, decoded):
+            no_speech = (result.no_speech_prob > MLX_BATCH_NO_SPEECH_THRESHOLD
+                         and result.avg_logprob < MLX_BATCH_LOGPROB_THRESHOLD)
+            if no_speech:
+                results.append({"text": "", "language": result.language, "segments": []})
+            elif (result.compression_ratio > MLX_BATCH_COMPRESSION_RATIO_THRESHOLD
+                  or result.avg_logprob < MLX_BATCH_LOGPROB_THRESHOLD):
+                results.append(self.transcribe(audio, language=language, initial_prompt=initial_prompt, **options))
+            else:
+                tokenizer = get_tokenizer(model.is_multilingual, num_languages=model.num_languages,
+                                          language=result.language, task="transcribe")
+                segments = timestamped_segments(tokenizer, result.tokens, len(audio) / SAMPLE_RATE)
+                results.append({"text": result.text, "language": result.language, "segments": segments})
+        return results
+
+    def load_translator(self):
+        from mlx_lm import load
+        return load(self.translation_path)
+
+    def make_sampler(self, **settings):
+        from mlx_lm.sample_utils import make_sampler
+        return make_sampler(**settings)
+
+    def stream_generate(self, model, tokenizer, prompt, max_tokens=256, sampler=None, **kwargs):
+        from mlx_lm import stream_generate
+        return stream_generate(model, tokenizer, prompt=prompt, max_tokens=max_tokens, sampler=sampler, **kwargs)
+
+    def generate(self, model, tokenizer, prompt, max_tokens=256, sampler=None, **kwargs):
+        from mlx_lm import generate
+        return generate(model, tokenizer, prompt=prompt, max_tokens=max_tokens, sampler=sampler,
+                        verbose=False, **kwargs)
+
+    def prefill_prompt_cache(self, model, tokens):
+        import mlx.core as mx
+        from mlx_lm.models.cache import make_prompt_cache
+        cache = make_prompt_cache(model)
+        if tokens:
+            model(mx.array(tokens)[None], cache=cache)
+            mx.eval([c.state for c in cache])
+        return cache
+
+    def trim_prompt_cache(self, cache, keep):
+        from mlx_lm.models.cache import can_trim_prompt_cache, trim_prompt_cache
+        if not can_trim_prompt_cache(cache):
+            return False
+        trim_prompt_cache(cache, cache[0].offset - keep)
+        return True
+
+    def copy_prompt_cache(self, cache):
+        return copy.deepcopy(cache)   # As mlx_lm's server does before handing a cached prefix to BatchGenerator
+
+    def batch_generator(self, model, tokenizer, sampler, batch_size):
+        try:
+            from mlx_lm.generate import BatchGenerator
+        except ImportError:
+            return None   # Older mlx_lm
+        return BatchGenerator(model, stop_tokens=tokenizer.eos_token_ids, sampler=sampler,
+                              completion_batch_size=batch_size)
+
+    def resident_bytes(self, model):
+        from mlx.utils import tree_flatten
+        return sum(v.nbytes for _, v in tree_flatten(model.parameters()))
+
+    def release_memory(self):
+        import mlx.core as mx
+        mx.clear_cache()
+
+def timestamped_segments(tokenizer, tokens, duration):
+    """Split Whisper output tokens into {start, end, text} segments at its timestamp tokens."""
+    segments, text_tokens, start = [], [], None
+    for token in tokens:
+        if token < tokenizer.timestamp_begin:
+            text_tokens.append(token)
+            continue
+        seconds = (token - tokenizer.timestamp_begin) * 0.02
+        if start is not None and text_tokens:
+            segments.append({"start": start, "end": min(seconds, duration), "text": tokenizer.decode(text_tokens)})
+            text_tokens, start = [], None
+        else:
+            start = seconds
+    if text_tokens:   # Cut off before its closing timestamp
+        segments.append({"start": start or 0.0, "end": duration, "text": tokenizer.decode(text_tokens)})
+    return segments
+
+# --- CPU (faster-whisper + llama.cpp) ---
+CPU_WHISPER_COMPUTE_TYPE = "int8"
+CPU_WHISPER_BEAM_SIZE = 1      # Greedy, like mlx_whisper's default
+CPU_LLM_CONTEXT_TOKENS = 4096
+CPU_THREADS = os.cpu_count() or 4
+
+def path_bytes(path):
+    """Size on disk of a model file or directory; the weights are memory-mapped at about this size."""
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum(os.path.getsize(os.path.join(root, name))
+               for root, _, names in os.walk(path) for name in names)
+
+class LlamaCppTokenizer:
+    """The parts of the mlx_lm tokenizer the app uses, over a llama_cpp.Llama."""
+
+    def __init__(self, llm):
+        self.llm = llm
+        self.eos_token_ids = {llm.token_eos()}
+        self.chat_template = llm.metadata.get("tokenizer.chat_template")
+
+    def encode(self, text, add_special_tokens=True):
+        return self.llm.tokenize(text.encode("utf-8"), add_bos=add_special_tokens, special=True)
+
+    def decode(self, tokens):
+        return self.llm.detokenize(tokens).decode("utf-8", errors="ignore")
+
+    def token_text(self, token):
+        return self.llm.detokenize([token], special=True).decode("utf-8", errors="ignore")
+
+    def apply_chat_template(self, messages, add_generation_prompt=True):
+        from llama_cpp.llama_chat_format import Jinja2ChatFormatter
+        formatter = Jinja2ChatFormatter(
+            self.chat_template,
+            eos_token=self.token_text(self.llm.token_eos()),
+            bos_token=self.token_text(self.llm.token_bos()),
+            add_generation_prompt=add_generation_prompt,
+        )
+        # The rendered template already starts with the BOS token
+        return self.encode(formatter(messages=messages).prompt, add_special_tokens=False)
+
+class CPUEngine(Engine):
+    name = "cpu"
+    # llama.cpp reuses the longest matching prefix of the previous prompt by itself
+
+    def __init__(self, whisper_path, translation_path):
+        super().__init__(whisper_path, translation_path)
+        import faster_whisper, llama_cpp  # noqa: F401 - fail at startup, not on the first request
+        self.whisper = None
+        self.llm_lock = threading.Lock()   # A llama_cpp.Llama decodes one sequence at a time
+
+    def load_transcriber(self):
+        from faster_whisper import WhisperModel
+        self.whisper = WhisperModel(self.whisper_path, device="cpu",
+                                    compute_type=CPU_WHISPER_COMPUTE_TYPE, cpu_threads=CPU_THREADS)
+        return self.whisper
+
+    def unload_transcriber(self):
+        self.whisper = None
+
+    def transcribe(self, audio, language=None, initial_prompt=None, **options):
+        whisper = self.whisper or self.load_transcriber()
+        segments, info = whisper.transcribe(
+            np.asarray(audio, dtype=np.float32),
+            language=language,
+            initial_prompt=initial_prompt,
+            beam_size=CPU_WHISPER_BEAM_SIZE,
+            vad_filter=False,   # The app runs its own VAD
+        )
+        segments = [{"start": s.start, "end": s.end, "text": s.text} for s in segments]
+        return {"text": "".join(s["text"] for s in segments), "language": info.language, "segments": segments}
+
+    def load_translator(self):
+        from llama_cpp import Llama
+        llm = Llama(model_path=self.translation_path, n_ctx=CPU_LLM_CONTEXT_TOKENS,
+                    n_threads=CPU_THREADS, verbose=False)
+        return llm, LlamaCppTokenizer(llm)
+
+    def stream_generate(self, model, tokenizer, prompt, max_tokens=256, sampler=None, **kwargs):
+        tokens = tokenizer.encode(prompt) if isinstance(prompt, str) else list(prompt)
+        settings = sampler or {}
+        # Tokens can end partway through a UTF-8 character
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="ignore")
+        token, finish_reason, last_text = None, "length", ""
+        with self.llm_lock:
+            steps = model.generate(tokens, temp=settings.get("temp", 0.0), top_p=settings.get("top_p", 1.0),
+                                   min_p=settings.get("min_p", 0.0), top_k=settings.get("top_k", 0))
+            for n, token in enumerate(steps, start=1):
+                if token in tokenizer.eos_token_ids:
+                    finish_reason = "stop"
+                    last_text = decoder.decode(b"", final=True)
+                    break
+                text = decoder.decode(model.detokenize([token]))
+                if n >= max_tokens:
+                    last_text = text + decoder.decode(b"", final=True)
+                    break
+                yield Generation(text, token)
+        yield Generation(last_text, token, finish_reason)
+
+    def resident_bytes(self, model):
+        return path_bytes(self.whisper_path if model is self.whisper else self.translation_path)
+
+# --- Fake (tests and benchmarks) ---
+FAKE_LOAD_SECONDS = float(os.environ.get("PAT_FAKE_LOAD_SECONDS", 0))
+FAKE_TRANSCRIBE_RTF = float(os.environ.get("PAT_FAKE_RTF", 0.05))              # Seconds of work per second of audio
+FAKE_BATCH_ITEM_COST = float(os.environ.get("PAT_FAKE_BATCH_ITEM_COST", 0.15))  # Extra batch item, relative to one
+FAKE_TOKEN_SECONDS = float(os.environ.get("PAT_FAKE_TOKEN_SECONDS", 0.005))    # Per generated token
+FAKE_SEGMENT_SECONDS = 5
+FAKE_PROMPT = re.compile(r"translate this text into (?P<lang>[^:]+): (?P<text>.*)", re.DOTALL)
+
+class FakeResponse:
+    """One sequence's step from FakeBatchGenerator.next(), shaped like mlx_lm's BatchGenerator.Response."""
+
+    def __init__(self, uid, token, finish_reason=None):
+        self.uid = uid
+        self.token = token
+        self.finish_reason = finish_reason
+
+class FakeBatchGenerator:
+    """Continuous batching like mlx_lm's BatchGenerator, over the fake replies.
+
+    Up to batch_size sequences decode per step. A step costs
+    FAKE_TOKEN_SECONDS plus FAKE_BATCH_ITEM_COST of that for every sequence
+    after the first.
+    """
+
+    def __init__(self, engine, tokenizer, batch_size):
+        self.engine = engine
+        self.tokenizer = tokenizer
+        self.batch_size = batch_size
+        self.uids = itertools.count()
+        self.queued = []    # (uid, reply tokens, max_tokens) not yet decoding
+        self.active = {}    # uid -> [reply tokens, max_tokens, tokens produced]
+
+    def insert(self, prompts, max_tokens):
+        uids = []
+        for prompt, limit in zip(prompts, max_tokens):
+            uid = next(self.uids)
+            reply = self.engine.fake_reply(self.tokenizer.decode(prompt))
+            self.queued.append((uid, [ord(c) for c in reply], limit))
+            uids.append(uid)
+        return uids
+
+    def remove(self, uids):
+        self.queued = [entry for entry in self.queued if entry[0] not in uids]
+        for uid in uids:
+            self.active.pop(uid, None)
+
+    def next(self):
+        while self.queued and len(self.active) < self.batch_size:
+            uid, reply, limit = self.queued.pop(0)
+            self.active[uid] = [reply, limit, 0]
+        if not self.active:
+            return []
+        time.sleep(FAKE_TOKEN_SECONDS * (1 + FAKE_BATCH_ITEM_COST * (len(self.active) - 1)))
+        responses = []
+        for uid, state in list(self.active.items()):
+            reply, limit, produced = state
+            if produced == len(reply):
+                responses.append(FakeResponse(uid, 0, "stop"))
+            else:
+                state[2] += 1
+                responses.append(FakeResponse(uid, reply[produced], "length" if state[2] >= limit else None))
+            if responses[-1].finish_reason is not None:
+                del self.active[uid]
+        return responses
+
+class FakeTokenizer:
+    """One token per character."""
+    chat_template = None
+    eos_token_ids = {0}
+
+    def encode(self, text, add_special_tokens=True):
+        return [ord(c) for c in text]
+
+    def decode(self, tokens):
+        return "".join(chr(t) for t in tokens)
+
+class FakeEngine(Engine):
+    """Transcribes to numbered segments and "translates" by tagging the text with the language.
+
+    A batch costs as much as its longest clip plus FAKE_BATCH_ITEM_COST of
+    that for every other clip, roughly how a padded batch behaves on a GPU.
+    """
+    name = "fake"
+    supports_batch_transcribe = True
+    supports_batch_generation = True
+
+    def load_transcriber(self):
+        time.sleep(FAKE_LOAD_SECONDS)
+        return "fake-whisper"
+
+    def transcribe(self, audio, language=None, **options):
+        audio = np.asarray(audio, dtype=np.float32)
+        time.sleep(len(audio) / SAMPLE_RATE * FAKE_TRANSCRIBE_RTF)
+        return self.fake_transcription(audio, language)
+
+    def transcribe_batch(self, audios, language=None, **options):
+        audios = [np.asarray(audio, dtype=np.float32) for audio in audios]
+        longest = max(len(audio) for audio in audios) / SAMPLE_RATE
+        time.sleep(longest * FAKE_TRANSCRIBE_RTF * (1 + FAKE_BATCH_ITEM_COST * (len(audios) - 1)))
+        return [self.fake_transcription(audio, language) for audio in audios]
+
+    def fake_transcription(self, audio, language):
+        seconds = len(audio) / SAMPLE_RATE
+        segments = []
+        if len(audio) and np.abs(audio).max() > 1e-4:   # Silence transcribes to nothing
+            digest = zlib.crc32(audio.tobytes())
+            for i, start in enumerate(range(0, int(np.ceil(seconds)), FAKE_SEGMENT_SECONDS)):
+                segments.append({
+                    "start": float(start),
+                    "end": float(min(start + FAKE_SEGMENT_SECONDS, seconds)),
+                    "text": f" Segment {i + 1} of audio {digest:08x}.",
+                })
+        return {"text": "".join(s["text"] for s in segments), "language": language or "en", "segments": segments}
+
+    def load_translator(self):
+        time.sleep(FAKE_LOAD_SECONDS)
+        return "fake-aya", FakeTokenizer()
+
+    def fake_reply(self, prompt):
+        match = FAKE_PROMPT.search(prompt)
+        lang, text = (match["lang"], match["text"].strip()) if match else ("?", prompt.strip())
+        return "```json\n" + json.dumps({"translation": f"[{lang}] {text}"}, ensure_ascii=False) + "\n```"
+
+    def stream_generate(self, model, tokenizer, prompt, max_tokens=256, sampler=None, **kwargs):
+        prompt = tokenizer.decode(prompt) if not isinstance(prompt, str) else prompt
+        reply = self.fake_reply(prompt)
+        for n, char in enumerate(reply, start=1):
+            time.sleep(FAKE_TOKEN_SECONDS)
+            if n >= max_tokens:
+                yield Generation(char, ord(char), "length")
+                return
+            yield Generation(char, ord(char))
+        yield Generation("", 0, "stop")
+
+    def batch_generator(self, model, tokenizer, sampler, batch_size):
+        return FakeBatchGenerator(self, tokenizer, batch_size)
+
+ENGINES = {"mlx": MLXEngine, "cpu": CPUEngine, "fake": FakeEngine}
+
+def create_engine(name, whisper_path, translation_path):
+    if name not in ENGINES:
+        raise ValueError(f"Unknown inference engine '{name}'. Choose one of: {', '.join(ENGINES)}")
+    return ENGINES[name](whisper_path, translation_path)
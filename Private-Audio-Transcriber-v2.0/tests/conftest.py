@@ -0,0 +1,11 @@
+# The tests run against the fake engine, so no models or Apple Silicon are needed:
+#   cd Private-Audio-Transcriber-v2.0 && python -m pytest
+import os
+import sys
+import tempfile
+
+os.environ["PAT_ENGINE"] = "fake"
+os.environ.pop("PAT_CACHE_KEY", None)
+# app.py keeps uploads and caches under the working directory
+os.chdir(tempfile.mkdtemp(prefix="pat-tests-"))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
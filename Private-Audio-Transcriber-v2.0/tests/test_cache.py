@@ -0,0 +1,81 @@
+import os
+
+import pytest
+
+import app
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(app, "CACHE_DIR", str(tmp_path))
+    return tmp_path
+
+def test_memory_cache_evicts_least_recently_used():
+    cache = app.ResultCache("results", "memory", 100)
+    for n in range(5):
+        cache.put(f"k{n}", {"v": "x" * 20})   # 29 bytes each
+    cache.get("k2")
+    cache.put("k5", {"v": "y" * 20})
+    assert list(cache.entries) == ["k4", "k2", "k5"]
+    stats = cache.stats()
+    assert (stats["hits"], stats["evictions"], stats["bytes"]) == (1, 3, 87)
+
+def test_disk_cache_survives_a_restart():
+    app.ResultCache("results", "disk", 10_000).put("k", {"v": 1})
+    assert app.ResultCache("results", "disk", 10_000).get("k") == {"v": 1}
+
+def test_corrupt_disk_entry_is_dropped(cache_dir):
+    cache = app.ResultCache("results", "disk", 10_000)
+    cache.put("k", {"v": "value"})
+    path = cache.path_for("k")
+    with open(path, "wb") as f:
+        f.write(b'{"v": "val')   # Truncated write
+    assert cache.get("k") is None
+    assert not os.path.exists(path)
+    assert "k" not in cache.entries
+    assert cache.get("k") is None
+
+def test_encrypted_cache_round_trip(monkeypatch):
+    fernet = pytest.importorskip("cryptography.fernet")
+    monkeypatch.setenv("PAT_CACHE_KEY", fernet.Fernet.generate_key().decode())
+    cache = app.ResultCache("results", "encrypted", 10_000)
+    cache.put("k", {"v": "patient notes"})
+    with open(cache.path_for("k"), "rb") as f:
+        assert b"patient notes" not in f.read()
+    assert app.ResultCache("results", "encrypted", 10_000).get("k") == {"v": "patient notes"}
+
+def test_encrypted_entry_from_another_key_is_dropped(monkeypatch):
+    fernet = pytest.importorskip("cryptography.fernet")
+    monkeypatch.setenv("PAT_CACHE_KEY", fernet.Fernet.generate_key().decode())
+    app.ResultCache("results", "encrypted", 10_000).put("k", {"v": 1})
+    monkeypatch.setenv("PAT_CACHE_KEY", fernet.Fernet.generate_key().decode())
+    cache = app.ResultCache("results", "encrypted", 10_000)
+    assert cache.get("k") is None
+    assert "k" not in cache.entries
+
+@pytest.mark.parametrize("key", [None, "", "not-a-fernet-key", "c2hvcnQ="])
+def test_missing_or_malformed_key_falls_back_to_memory(monkeypatch, key):
+    pytest.importorskip("cryptography.fernet")
+    if key is None:
+        monkeypatch.delenv("PAT_CACHE_KEY", raising=False)
+    else:
+        monkeypatch.setenv("PAT_CACHE_KEY", key)
+    cache = app.ResultCache("results", "encrypted", 10_000)
+    assert cache.mode == "memory"
+    cache.put("k", {"v": 1})
+    assert cache.get("k") == {"v": 1}
+
+def test_cache_counters_are_exported(monkeypatch):
+    cache = app.ResultCache("translations", "memory", 60)
+    monkeypatch.setattr(app, "translation_cache", cache)
+    monkeypatch.setattr(app, "transcription_cache", app.ResultCache("transcriptions", "memory", 60))
+    cache.put("a", {"v": "x" * 20})
+    cache.put("b", {"v": "x" * 20})
+    cache.put("c", {"v": "x" * 20})
+    cache.get("c")
+    cache.get("a")
+    text = app.app.test_client().get("/metrics").text
+    assert 'pat_cache_hits_total{cache="translations"} 1' in text
+    assert 'pat_cache_misses_total{cache="translations"} 1' in text
+    assert 'pat_cache_evictions_total{cache="translations"} 1' in text
+    assert 'pat_cache_bytes{cache="translations"} 58' in text
+    assert 'pat_cache_hits_total{cache="transcriptions"} 0' in text
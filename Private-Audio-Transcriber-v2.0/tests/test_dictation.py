@@ -0,0 +1,113 @@
+import io
+import shutil
+import subprocess
+import threading
+
+import numpy as np
+import pytest
+
+import app
+
+H = {"X-Requested-With": "MedicalApp"}
+needs_ffmpeg = pytest.mark.skipif(shutil.which("ffmpeg") is None, reason="ffmpeg is not installed")
+
+@pytest.fixture
+def client():
+    return app.app.test_client()
+
+@pytest.fixture(scope="module")
+def recording(tmp_path_factory):
+    """12 s of WebM/Opus, like a MediaRecorder recording."""
+    if shutil.which("ffmpeg") is None:
+        pytest.skip("ffmpeg is not installed")
+    path = tmp_path_factory.mktemp("dictation") / "recording.webm"
+    subprocess.run(["ffmpeg", "-loglevel", "error", "-f", "lavfi", "-i",
+                    "sine=frequency=220:duration=12,tremolo=f=4:d=0.9", "-c:a", "libopus", "-f", "webm", str(path)],
+                   check=True)
+    return path.read_bytes()
+
+def chunks(data, count):
+    step = len(data) // count + 1
+    return [data[i:i + step] for i in range(0, len(data), step)]
+
+@needs_ffmpeg
+def test_streaming_decoder_matches_decoding_the_whole_recording(recording):
+    decoder = app.StreamingDecoder()
+    try:
+        lengths = []
+        for chunk in chunks(recording, 6):
+            decoder.feed(chunk)
+            lengths.append(len(decoder.audio()))
+        audio = decoder.finish()
+    finally:
+        decoder.close()
+    assert lengths == sorted(lengths) and lengths[0] > 0
+    np.testing.assert_array_equal(audio, app.load_audio(recording))
+
+@needs_ffmpeg
+def test_dictation_decodes_each_chunk_once(client, recording, monkeypatch):
+    fed = []
+    feed = app.StreamingDecoder.feed
+    monkeypatch.setattr(app.StreamingDecoder, "feed", lambda self, data: (fed.append(len(data)), feed(self, data)))
+    monkeypatch.setattr(app, "load_audio", lambda source: pytest.fail("the whole recording was decoded again"))
+    sid = client.post("/dictation", headers=H).json["session_id"]
+    parts = chunks(recording, 6)
+    for part in parts:
+        assert client.post(f"/dictation/{sid}/chunk", data=part, headers=H).status_code == 200
+    result = client.post(f"/dictation/{sid}/finish", headers=H).json
+    assert fed == [len(part) for part in parts]
+    assert result["transcription"]
+
+def test_dictation_falls_back_to_whole_recording_decoding(client, monkeypatch):
+    def broken_decoder():
+        raise OSError("ffmpeg not found")
+    monkeypatch.setattr(app, "StreamingDecoder", broken_decoder)
+    decoded = []
+    def load_audio(source):
+        decoded.append(source)
+        t = np.arange(len(source) * 1600) / app.SAMPLE_RATE
+        return (np.sin(2 * np.pi * 220 * t) * (0.55 + 0.45 * np.sin(2 * np.pi * 4 * t)) * 0.1).astype(np.float32)
+    monkeypatch.setattr(app, "load_audio", load_audio)
+    sid = client.post("/dictation", headers=H).json["session_id"]
+    client.post(f"/dictation/{sid}/chunk", data=b"a" * 30, headers=H)
+    client.post(f"/dictation/{sid}/chunk", data=b"b" * 30, headers=H)
+    result = client.post(f"/dictation/{sid}/finish", headers=H).json
+    assert decoded[-1] == b"a" * 30 + b"b" * 30
+    assert result["transcription"]
+
+class SlowBody(io.BytesIO):
+    """A request body that arrives only when released."""
+
+    def __init__(self, data):
+        super().__init__(data)
+        self.reading = threading.Event()
+        self.release = threading.Event()
+
+    def readinto(self, buffer):
+        self.reading.set()
+        self.release.wait(5)
+        return super().readinto(buffer)
+
+class NullDecoder:
+    def feed(self, data):
+        pass
+
+    def close(self):
+        pass
+
+def test_slow_chunk_upload_does_not_block_other_sessions(client, monkeypatch):
+    monkeypatch.setattr(app, "StreamingDecoder", NullDecoder)
+    monkeypatch.setattr(app, "update_dictation", lambda session, final=False: None)
+    slow_sid = client.post("/dictation", headers=H).json["session_id"]
+    other_sid = client.post("/dictation", headers=H).json["session_id"]
+    body = SlowBody(b"x" * 10)
+    slow = threading.Thread(target=lambda: app.app.test_client().post(
+        f"/dictation/{slow_sid}/chunk", input_stream=body, headers=H))
+    slow.start()
+    try:
+        assert body.reading.wait(5)
+        assert app.app.test_client().post(f"/dictation/{other_sid}/chunk", data=b"", headers=H).status_code == 200
+        assert client.post("/dictation", headers=H).status_code == 200
+    finally:
+        body.release.set()
+        slow.join()
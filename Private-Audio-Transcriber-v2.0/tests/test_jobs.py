@@ -0,0 +1,66 @@
+import time
+
+import pytest
+
+import app
+
+@pytest.fixture(autouse=True)
+def empty_queue(monkeypatch):
+    monkeypatch.setattr(app, "jobs", {})
+    monkeypatch.setattr(app, "job_queue", [])
+    monkeypatch.setattr(app, "decoded_jobs", [])
+    monkeypatch.setattr(app, "prefetched", {priority: 0 for priority in app.PRIORITY_CLASSES})
+    monkeypatch.setattr(app, "job_stats", dict(app.job_stats, completed=0, failed=0))
+
+def decode_next():
+    with app.jobs_changed:
+        entry = app.next_job_to_decode()
+        app.decoded_jobs.append(entry + (time.perf_counter(),))
+    return entry[2]
+
+def test_decoders_take_urgent_jobs_first_within_prefetch_slots():
+    batch = [app.submit_job(b"audio", priority="batch") for _ in range(app.JOB_PREFETCH + 1)]
+    urgent = app.submit_job(b"audio")
+    order = [decode_next() for _ in range(app.JOB_PREFETCH + 1)]
+    assert order == [urgent] + batch[:app.JOB_PREFETCH]
+    assert app.prefetched == {"live": 0, "interactive": 1, "batch": app.JOB_PREFETCH}
+    # The last batch job waits for a batch slot, which Whisper frees by taking the oldest one
+    with app.jobs_changed:
+        assert app.take_decoded_job()[2] == urgent
+        assert app.take_decoded_job()[2] == batch[0]
+    assert decode_next() == batch[-1]
+
+def test_job_reports_running_only_once_whisper_takes_it(monkeypatch):
+    seen = []
+    def run_job_transcription(job):
+        seen.append(job["status"])
+        return {"transcription": "hello", "source_lang_code": "en"}
+    monkeypatch.setattr(app, "run_job_transcription", run_job_transcription)
+    job_id = app.submit_job(b"audio")
+    decode_next()
+    assert app.jobs[job_id]["status"] == "queued"
+    with app.jobs_changed:
+        entry = app.take_decoded_job()
+    app.run_decoded_job(*entry)
+    view = app.job_view(app.jobs[job_id])
+    assert seen == ["running"]
+    assert view["status"] == "done" and view["transcription"] == "hello"
+    assert view["queue_wait"] >= 0 and view["wall_time"] >= 0
+
+def test_cached_job_finishes_without_running():
+    job_id = app.submit_job(b"audio")
+    job = app.jobs[job_id]
+    app.finish_job(job, {"transcription": "cached", "source_lang_code": "en"}, None)
+    view = app.job_view(job)
+    assert view["status"] == "done" and view["wall_time"] == 0
+
+def test_batch_job_lets_more_urgent_decoded_jobs_run(monkeypatch):
+    ran = []
+    monkeypatch.setattr(app, "run_decoded_job", lambda rank, sequence, job_id, decoded_at: ran.append(job_id))
+    batch = app.submit_job(b"audio", priority="batch")
+    urgent = app.submit_job(b"audio")
+    decode_next()
+    decode_next()
+    app.run_more_urgent_jobs(app.PRIORITY_CLASSES.index("batch"))
+    assert ran == [urgent]
+    assert [entry[2] for entry in app.decoded_jobs] == [batch]
@@ -0,0 +1,38 @@
+import json
+
+import pytest
+
+import app
+
+H = {"X-Requested-With": "MedicalApp"}
+BODY = {"text": "Hello there.", "language": "French"}
+
+@pytest.fixture
+def lane(monkeypatch):
+    monkeypatch.setattr(app.translation_lane, "max_pending", 1)
+    monkeypatch.setattr(app.translation_lane, "pending", 0)
+    return app.translation_lane
+
+def test_full_lane_turns_requests_away_with_429(lane):
+    lane.pending = 1
+    response = app.app.test_client().post("/translate", json=BODY, headers=H)
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) >= 1
+    assert lane.pending == 1
+
+def test_request_releases_its_slot_when_answered(lane):
+    client = app.app.test_client()
+    for _ in range(2):
+        assert client.post("/translate", json=BODY, headers=H).status_code == 200
+    assert lane.pending == 0
+
+def test_stream_keeps_its_slot_until_the_body_is_sent(lane):
+    client = app.app.test_client()
+    response = client.post("/translate/stream", json=BODY, headers=H, buffered=False)
+    assert lane.pending == 1
+    assert client.post("/translate", json=BODY, headers=H).status_code == 429
+    events = [json.loads(line[len("data: "):]) for line in response.get_data(as_text=True).splitlines()
+              if line.startswith("data: ")]
+    response.close()
+    assert events[-1]["translation"] == "[French] Hello there."
+    assert lane.pending == 0
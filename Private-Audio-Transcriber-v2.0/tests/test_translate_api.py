@@ -0,0 +1,48 @@
+import json
+
+import pytest
+
+import app
+
+H = {"X-Requested-With": "MedicalApp"}
+
+@pytest.fixture
+def client():
+    return app.app.test_client()
+
+@pytest.mark.parametrize("route", ["/translate", "/translate/stream"])
+@pytest.mark.parametrize("body", [
+    {"language": "French"},
+    {"text": None, "language": "French"},
+    {"text": 42, "language": "French"},
+    {"text": ["Hello"], "language": "French"},
+    {"text": "   ", "language": "French"},
+    {"text": "Hello"},
+    {"text": "Hello", "language": 7},
+    ["Hello", "French"],
+])
+def test_invalid_body_is_a_bad_request(client, route, body):
+    response = client.post(route, json=body, headers=H)
+    assert response.status_code == 400
+    assert "error" in response.json
+
+@pytest.mark.parametrize("route", ["/translate", "/translate/stream"])
+def test_body_that_is_not_json_is_a_bad_request(client, route):
+    response = client.post(route, data="text=Hello", headers=H)
+    assert response.status_code == 400
+
+@pytest.mark.parametrize("languages", [[], "French", [["French"]], ["Klingon"]])
+def test_invalid_fan_out_languages_are_a_bad_request(client, languages):
+    response = client.post("/translate", json={"text": "Hello", "languages": languages}, headers=H)
+    assert response.status_code == 400
+
+def test_translate(client):
+    response = client.post("/translate", json={"text": "Hello there.", "language": "French"}, headers=H)
+    assert response.status_code == 200
+    assert response.json["translation"] == "[French] Hello there."
+
+def test_translate_stream(client):
+    response = client.post("/translate/stream", json={"text": "Hello there.", "language": "French"}, headers=H)
+    events = [json.loads(line[6:]) for line in response.data.decode().splitlines() if line.startswith("data: ")]
+    assert events[-1]["type"] == "done"
+    assert events[-1]["translation"] == "[French] Hello there."
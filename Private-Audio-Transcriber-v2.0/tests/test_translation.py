@@ -0,0 +1,50 @@
+import app
+
+def test_cache_key_ignores_whitespace_only_differences():
+    assert app.translation_cache_key("Hello  there.\n", "French") == app.translation_cache_key("Hello there.", "French")
+
+def test_cache_key_depends_on_language_and_prompt_template(monkeypatch):
+    key = app.translation_cache_key("Hello there.", "French")
+    assert app.translation_cache_key("Hello there.", "German") != key
+    monkeypatch.setattr(app, "TRANSLATION_PROMPT_TEMPLATE", app.TRANSLATION_PROMPT_TEMPLATE + "Be brief.\n")
+    assert app.translation_cache_key("Hello there.", "French") != key
+
+def test_translation_cached_with_an_older_prompt_is_not_served(monkeypatch):
+    cache = app.ResultCache("translations", "memory", 1024 * 1024)
+    monkeypatch.setattr(app, "translation_cache", cache)
+    template = app.TRANSLATION_PROMPT_TEMPLATE
+    monkeypatch.setattr(app, "TRANSLATION_PROMPT_TEMPLATE", "Old wording: {target_lang} {text_to_translate}")
+    cache.put(app.translation_cache_key("Hello there.", "French"), {"translation": "stale"})
+    monkeypatch.setattr(app, "TRANSLATION_PROMPT_TEMPLATE", template)
+    assert app.run_translation("Hello there.", "French") == "[French] Hello there."
+    assert app.run_translation("Hello there.", "French") == "[French] Hello there."   # Now from the cache
+    assert cache.stats()["hits"] == 1
+
+class RecordingGenerator:
+    def __init__(self):
+        self.calls = []
+        self.uids = iter(range(100))
+
+    def insert(self, prompts, max_tokens, caches=None):
+        self.calls.append((prompts, caches))
+        return [next(self.uids) for _ in prompts]
+
+def test_seeded_and_unseeded_prompts_are_inserted_separately(monkeypatch):
+    def prefix_seeded_prompt(tokenizer, prompt):
+        return (prompt[len("seed "):], "cache") if prompt.startswith("seed ") else (prompt, None)
+    monkeypatch.setattr(app, "prefix_seeded_prompt", prefix_seeded_prompt)
+    generator = RecordingGenerator()
+    new = [{"prompt": prompt, "max_tokens": 10} for prompt in ("seed a", "b", "seed c")]
+    uids = app.decode_loop.insert(generator, None, new)
+    assert generator.calls == [(["a", "c"], ["cache", "cache"]), (["b"], None)]
+    assert uids == [0, 2, 1]
+
+def test_long_text_is_split_on_sentences_and_put_back_in_order(monkeypatch):
+    monkeypatch.setattr(app, "TRANSLATION_CHUNK_TOKENS", 20)   # One token per character
+    text = "First sentence. Second one here.\n\nThird."
+    chunks, layout = app.split_for_translation(text)
+    assert chunks == ["First sentence.", "Second one here.", "Third."]
+    assert layout == [([0, 1], "\n\n"), ([2], "")]
+    monkeypatch.setattr(app, "translation_cache", app.ResultCache("translations", "memory", 10_000))
+    assert app.run_translation(text, "French") == (
+        "[French] First sentence. [French] Second one here.\n\n[French] Third.")
@@ -0,0 +1,46 @@
+import io
+import os
+import tempfile
+
+import pytest
+from flask import request
+
+import app
+
+H = {"X-Requested-With": "MedicalApp"}
+
+@pytest.fixture
+def upload_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(app, "UPLOAD_DIR", str(tmp_path / "uploads"))
+    monkeypatch.setattr(app, "UPLOAD_SPILL_BYTES", 4096)
+    return tmp_path / "uploads"
+
+def upload(data, filename="note.wav"):
+    return app.app.test_request_context("/transcribe", method="POST", headers=H,
+                                        data={"audio_file": (io.BytesIO(data), filename)})
+
+def test_small_upload_stays_in_memory(upload_dir):
+    with upload(b"x" * 4096):
+        assert app.read_upload(request.files["audio_file"]) == b"x" * 4096
+    assert not upload_dir.exists() or not os.listdir(upload_dir)
+
+def test_large_upload_is_written_once_to_the_upload_folder(upload_dir, monkeypatch):
+    system_temp = tempfile.mkdtemp()
+    monkeypatch.setattr(tempfile, "tempdir", system_temp)
+    data = os.urandom(20_000)
+    with upload(data):
+        path = app.read_upload(request.files["audio_file"])
+    assert os.path.dirname(path) == str(upload_dir)
+    assert path.endswith(".wav")
+    assert os.listdir(upload_dir) == [os.path.basename(path)]
+    assert os.listdir(system_temp) == []
+    with open(path, "rb") as f:
+        assert f.read() == data
+    app.discard_upload(path)
+    assert os.listdir(upload_dir) == []
+
+def test_spilled_upload_that_is_never_read_is_deleted(upload_dir):
+    with upload(os.urandom(20_000), "note.exe"):
+        assert request.files["audio_file"].stream.name.endswith(".webm")
+        assert len(os.listdir(upload_dir)) == 1
+    assert os.listdir(upload_dir) == []
@@ -0,0 +1,45 @@
+import numpy as np
+
+import app
+
+def noise(seconds, level_db, seed=0):
+    rng = np.random.default_rng(seed)
+    return (rng.standard_normal(int(seconds * app.SAMPLE_RATE)) * 10 ** (level_db / 20)).astype(np.float32)
+
+def speech(seconds, level_db=-20):
+    """A tone with a syllable-rate envelope, loud enough to stand out from room noise."""
+    t = np.arange(int(seconds * app.SAMPLE_RATE)) / app.SAMPLE_RATE
+    envelope = 0.55 + 0.45 * np.sin(2 * np.pi * 4 * t)
+    return (np.sin(2 * np.pi * 220 * t) * envelope * 10 ** (level_db / 20) * np.sqrt(2)).astype(np.float32)
+
+def test_room_noise_alone_has_no_speech():
+    assert app.detect_speech_regions(noise(10, -50)) == []
+
+def test_speech_in_room_noise_keeps_only_the_speech():
+    audio = noise(10, -50)
+    audio[3 * app.SAMPLE_RATE:5 * app.SAMPLE_RATE] += speech(2)
+    regions = app.detect_speech_regions(audio)
+    assert len(regions) == 1
+    start, end = regions[0]
+    pad = app.VAD_PAD_MS / 1000 + app.VAD_FRAME_MS / 1000
+    assert 3 - pad <= start / app.SAMPLE_RATE <= 3
+    assert 5 <= end / app.SAMPLE_RATE <= 5 + pad
+
+def test_speech_without_pauses_is_kept_whole():
+    regions = app.detect_speech_regions(speech(10))
+    assert regions == [(0, 10 * app.SAMPLE_RATE)]
+
+def test_noise_only_upload_is_skipped_entirely(monkeypatch):
+    monkeypatch.setattr(app, "load_audio", lambda source: noise(10, -50))
+    audio, speech_map, vad_report = app.prepare_audio(b"upload")
+    assert len(audio) == 0
+    assert speech_map == []
+    assert vad_report["speech_seconds"] == 0
+    assert vad_report["skipped_seconds"] == 10
+
+def test_timestamps_map_back_to_the_original_recording():
+    speech_map = [(0.0, 2.0, 3.0), (3.0, 10.0, 2.0)]   # Speech at 2-5 s and 10-12 s
+    assert app.map_timestamp(1.0, speech_map) == 3.0
+    assert app.map_timestamp(3.5, speech_map) == 10.5
+    assert app.map_timestamp(6.0, speech_map) == 12.0   # Past the end stays in the last region
+    assert app.map_timestamp(4.0, []) == 4.0
@@ -0,0 +1,40 @@
+import threading
+
+import numpy as np
+import pytest
+
+import app
+
+@pytest.fixture
+def batches(monkeypatch):
+    """Record the size and options of every batch, and let the clips of one test meet."""
+    calls = []
+    transcribe_batch = app.engine.transcribe_batch
+    def record(audios, **options):
+        calls.append((len(audios), options))
+        return transcribe_batch(audios, **options)
+    monkeypatch.setattr(app.engine, "transcribe_batch", record)
+    monkeypatch.setattr(app, "WHISPER_BATCH_SIZE", 3)
+    monkeypatch.setattr(app, "WHISPER_BATCH_WAIT_MS", 500)
+    return calls
+
+def transcribe_together(options):
+    clip = np.zeros(app.SAMPLE_RATE, dtype=np.float32)
+    results = [None] * len(options)
+    def run(i):
+        results[i] = app.whisper_transcribe(clip, **options[i])
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(len(options))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+    return results
+
+def test_clips_with_the_same_options_share_a_batch(batches):
+    results = transcribe_together([{}, {"language": None}, {"initial_prompt": None}])
+    assert batches == [(3, {})]
+    assert all(result is not None for result in results)
+
+def test_clips_with_different_options_are_batched_apart(batches):
+    transcribe_together([{"language": "en"}, {"language": "fr"}, {"language": "en"}])
+    assert sorted(batches, key=lambda call: call[0]) == [(1, {"language": "fr"}), (2, {"language": "en"})]